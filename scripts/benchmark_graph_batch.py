@@ -0,0 +1,80 @@
+"""
+Benchmark del envío de correos individuales por Microsoft Graph contra el servidor
+simulado (ver mock_platforms.py).
+
+Compara, con el mismo número de correos (uno por destinatario):
+- send_mail_graph en bucle: una petición sendMail por correo.
+- send_mail_graph_batch: peticiones $batch de hasta 20 sendMail, reintentando solo
+  las subpeticiones que fallen.
+
+Uso (desde la raíz del proyecto):
+    python -m scripts.benchmark_graph_batch --correos 500 --latencia-ms 50 --tasa-429 0.05
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).resolve().parents[1]
+if str(ROOT_DIR) not in sys.path:
+    sys.path.insert(0, str(ROOT_DIR))
+
+from scripts.mock_platforms import MockPlatformServer
+
+
+def _medir(nombre: str, mock: MockPlatformServer, enviar, correos: int) -> None:
+    antes = dict(mock.stats)
+    inicio = time.monotonic()
+    resultados = enviar()
+    duracion = time.monotonic() - inicio
+    peticiones = mock.stats["requests_graph"] - antes.get("requests_graph", 0)
+    throttled = mock.stats["throttled"] - antes.get("throttled", 0)
+    print(f"{nombre:<24} {sum(resultados):>5}/{correos} enviados  {duracion:>7.2f}s  "
+          f"{peticiones:>5} peticiones  {throttled:>4} throttled")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de sendMail individual frente a $batch en Graph.")
+    parser.add_argument("--correos", type=int, default=200, help="Correos (destinatarios) a enviar en cada modo.")
+    parser.add_argument("--latencia-ms", type=float, default=50, help="Latencia simulada por petición.")
+    parser.add_argument("--tasa-429", type=float, default=0.0, help="Fracción de (sub)peticiones con 429.")
+    parser.add_argument("--retry-after", type=int, default=1, help="Retry-After de los 429 simulados.")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="benchmark_graph_batch_")
+    mock = MockPlatformServer(latency_ms=args.latencia_ms, throttle_rate=args.tasa_429,
+                              retry_after=args.retry_after).start()
+    os.environ.update({
+        "DB_DIR": os.path.join(work_dir, "data"),
+        "GRAPH_API_BASE": f"{mock.base_url}/v1.0",
+        "MICROSOFT_CLIENT_ID": "benchmark",
+        "MICROSOFT_TENANT_ID": "benchmark",
+        "MICROSOFT_CLIENT_SECRET": "benchmark",
+        "MICROSOFT_SENDER_EMAIL": "benchmark@example.com",
+        "RATE_LIMIT_ENABLED": "false",
+    })
+
+    from src import db_config, graph_mail
+    db_config.init_db()
+    # El mock no valida el token: se evita la llamada real a Microsoft Entra ID
+    graph_mail.get_access_token = lambda: "benchmark-token"
+
+    mensajes = [{"receivers": [f"destinatario{i}@example.com"], "subject": "Benchmark",
+                 "content_text": "Contenido de prueba"} for i in range(args.correos)]
+    try:
+        print("=" * 90)
+        _medir("sendMail individual", mock, lambda: [graph_mail.send_mail_graph(**m) for m in mensajes],
+               args.correos)
+        _medir("$batch", mock, lambda: graph_mail.send_mail_graph_batch(mensajes), args.correos)
+        print("=" * 90)
+    finally:
+        mock.stop()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
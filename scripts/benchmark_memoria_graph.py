@@ -0,0 +1,94 @@
+"""
+Benchmark de memoria del envío de correos con adjuntos grandes por Microsoft Graph.
+
+Envía un correo con un adjunto de prueba al servidor Graph simulado (ver mock_platforms.py)
+y mide el pico de memoria residente del proceso. Los adjuntos que superan el límite en
+línea se suben por sesiones de subida, así que el pico no debe crecer con el tamaño del
+fichero (en línea, crecería en torno a 1,33 veces su tamaño por el base64).
+
+Uso (desde la raíz del proyecto):
+    python -m scripts.benchmark_memoria_graph --mb 100
+    python -m scripts.benchmark_memoria_graph --mb 100 --async
+"""
+
+import argparse
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).resolve().parents[1]
+if str(ROOT_DIR) not in sys.path:
+    sys.path.insert(0, str(ROOT_DIR))
+
+from scripts.mock_platforms import MockPlatformServer
+
+
+def _rss_maximo_mb() -> float:
+    # ru_maxrss está en KB en Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de memoria del envío de adjuntos grandes por Graph.")
+    parser.add_argument("--mb", type=int, default=100, help="Tamaño del adjunto de prueba (MB).")
+    parser.add_argument("--async", dest="motor_async", action="store_true", help="Usar send_mail_graph_async.")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="benchmark_memoria_graph_")
+    mock = MockPlatformServer(latency_ms=0).start()
+    os.environ.update({
+        "DB_DIR": os.path.join(work_dir, "data"),
+        "GRAPH_API_BASE": f"{mock.base_url}/v1.0",
+        "MICROSOFT_CLIENT_ID": "benchmark",
+        "MICROSOFT_TENANT_ID": "benchmark",
+        "MICROSOFT_CLIENT_SECRET": "benchmark",
+        "MICROSOFT_SENDER_EMAIL": "benchmark@example.com",
+        "RATE_LIMIT_ENABLED": "false",
+    })
+
+    from src import async_http, db_config, graph_mail
+    db_config.init_db()
+    # El mock no valida el token: se evita la llamada real a Microsoft Entra ID
+    graph_mail.get_access_token = lambda: "benchmark-token"
+
+    try:
+        path = os.path.join(work_dir, "video.mp4")
+        with open(path, "wb") as f:
+            bloque = os.urandom(1024 * 1024)
+            for _ in range(args.mb):
+                f.write(bloque)
+
+        mensaje = {"receivers": ["destinatario@example.com"], "subject": "Benchmark",
+                   "content_text": "Contenido de prueba", "attachments": [path]}
+        rss_inicial = _rss_maximo_mb()
+        inicio = time.monotonic()
+        if args.motor_async:
+            async def _enviar():
+                async with async_http.build_client("graph") as client:
+                    return await graph_mail.send_mail_graph_async(client, **mensaje)
+            ok = async_http.run(_enviar())
+        else:
+            ok = graph_mail.send_mail_graph(**mensaje)
+        duracion = time.monotonic() - inicio
+        rss_final = _rss_maximo_mb()
+
+        print("=" * 60)
+        print(f"Envío {'asíncrono' if args.motor_async else 'síncrono'} con adjunto de {args.mb} MB -> "
+              f"{'aceptado' if ok else 'fallido'}")
+        print(f"Duración:                 {duracion:.2f}s ({args.mb / duracion if duracion else 0:.0f} MB/s)")
+        print(f"Peticiones a Graph:       {mock.stats['requests_graph']}")
+        print(f"Bytes recibidos (mock):   {mock.stats['bytes_received'] / (1024 * 1024):.1f} MB")
+        print(f"Pico de RSS:              {rss_inicial:.0f} MB -> {rss_final:.0f} MB "
+              f"(+{rss_final - rss_inicial:.0f} MB)")
+        print("=" * 60)
+    finally:
+        mock.stop()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
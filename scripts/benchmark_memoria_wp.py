@@ -0,0 +1,90 @@
+"""
+Benchmark de memoria de la subida de medios a WordPress.
+
+Sube un fichero de prueba al endpoint de medios simulado (ver mock_platforms.py) y mide
+el pico de memoria residente del proceso. Con la subida en streaming, el pico no debe
+crecer con el tamaño del fichero.
+
+Uso (desde la raíz del proyecto):
+    python -m scripts.benchmark_memoria_wp --mb 500
+    python -m scripts.benchmark_memoria_wp --mb 500 --async
+"""
+
+import argparse
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).resolve().parents[1]
+if str(ROOT_DIR) not in sys.path:
+    sys.path.insert(0, str(ROOT_DIR))
+
+from scripts.mock_platforms import MockPlatformServer
+
+
+def _rss_maximo_mb() -> float:
+    # ru_maxrss está en KB en Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de memoria de la subida de medios a WordPress.")
+    parser.add_argument("--mb", type=int, default=200, help="Tamaño del fichero de prueba (MB).")
+    parser.add_argument("--async", dest="motor_async", action="store_true", help="Usar upload_media_async.")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="benchmark_memoria_wp_")
+    mock = MockPlatformServer(latency_ms=0).start()
+    os.environ.update({
+        "DB_DIR": os.path.join(work_dir, "data"),
+        "WP_SITE": mock.base_url,
+        "WP_USER": "benchmark",
+        "WP_APP_PASS": "benchmark",
+        "RATE_LIMIT_ENABLED": "false",
+    })
+
+    from src import async_http, db_config, wordpress
+    db_config.init_db()
+
+    try:
+        path = os.path.join(work_dir, "video.mp4")
+        with open(path, "wb") as f:
+            bloque = os.urandom(1024 * 1024)
+            for _ in range(args.mb):
+                f.write(bloque)
+
+        def progreso(enviados, total):
+            progreso.ultimo = enviados
+
+        progreso.ultimo = 0
+        rss_inicial = _rss_maximo_mb()
+        inicio = time.monotonic()
+        if args.motor_async:
+            async def _subir():
+                async with async_http.build_client("wordpress") as client:
+                    return await wordpress.upload_media_async(client, path, progress=progreso)
+            info = async_http.run(_subir())
+        else:
+            info = wordpress.upload_media(path, progress=progreso)
+        duracion = time.monotonic() - inicio
+        rss_final = _rss_maximo_mb()
+
+        print("=" * 60)
+        print(f"Subida {'asíncrona' if args.motor_async else 'síncrona'} de {args.mb} MB -> medio ID {info and info['id']}")
+        print(f"Duración:                 {duracion:.2f}s ({args.mb / duracion if duracion else 0:.0f} MB/s)")
+        print(f"Bytes recibidos (mock):   {mock.stats['bytes_received'] / (1024 * 1024):.1f} MB")
+        print(f"Progreso notificado:      {progreso.ultimo / (1024 * 1024):.1f} MB")
+        print(f"Pico de RSS:              {rss_inicial:.0f} MB -> {rss_final:.0f} MB "
+              f"(+{rss_final - rss_inicial:.0f} MB)")
+        print("=" * 60)
+    finally:
+        mock.stop()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
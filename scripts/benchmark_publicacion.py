@@ -0,0 +1,192 @@
+"""
+Benchmark offline del scheduler de publicaciones.
+
+Crea una base de datos temporal con N publicaciones programadas y sus medios, apunta
+WordPress, LinkedIn y Microsoft Graph a un servidor local simulado (ver mock_platforms.py)
+y ejecuta los ciclos de `publish_programmed_posts` hasta vaciar la cola.
+
+Uso (desde la raíz del proyecto):
+    python -m scripts.benchmark_publicacion --posts 60 --latencia-ms 80 --tasa-429 0.05
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).resolve().parents[1]
+if str(ROOT_DIR) not in sys.path:
+    sys.path.insert(0, str(ROOT_DIR))
+
+from scripts.mock_platforms import MockPlatformServer
+
+PLATAFORMAS = ("WordPress", "LinkedIn", "Gmail")
+
+
+def _parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark offline del scheduler de publicaciones.")
+    parser.add_argument("--posts", type=int, default=30, help="Número de publicaciones programadas.")
+    parser.add_argument("--plataformas", default=",".join(PLATAFORMAS),
+                        help="Plataformas a incluir, separadas por comas (WordPress, LinkedIn, Gmail).")
+    parser.add_argument("--imagenes", type=int, default=2, help="Imágenes por publicación.")
+    parser.add_argument("--imagen-kb", type=int, default=200, help="Tamaño de cada imagen (KB).")
+    parser.add_argument("--video-kb", type=int, default=0, help="Tamaño de un vídeo por publicación (KB, 0 = sin vídeo).")
+    parser.add_argument("--umbral-multipart-mb", type=float, default=25,
+                        help="LINKEDIN_MULTIPART_THRESHOLD_MB: vídeos que se suben por partes a LinkedIn.")
+    parser.add_argument("--destinatarios", type=int, default=3, help="Destinatarios por correo.")
+    parser.add_argument("--latencia-ms", type=float, default=50, help="Latencia simulada por petición.")
+    parser.add_argument("--tasa-error", type=float, default=0.0, help="Probabilidad de responder 500.")
+    parser.add_argument("--tasa-429", type=float, default=0.0, help="Probabilidad de responder 429.")
+    parser.add_argument("--retry-after", type=int, default=1, help="Segundos de Retry-After en los 429.")
+    parser.add_argument("--tasa-cuelgue", type=float, default=0.0,
+                        help="Probabilidad de que una petición no reciba nunca respuesta.")
+    parser.add_argument("--timeout-lectura", type=float, default=10,
+                        help="HTTP_READ_TIMEOUT durante el benchmark (segundos).")
+    parser.add_argument("--lote", type=int, default=20, help="SCHEDULER_BATCH_SIZE durante el benchmark.")
+    parser.add_argument("--rondas", type=int, default=5, help="Rondas máximas de reintento de posts fallidos.")
+    parser.add_argument("--async", dest="motor_async", action="store_true",
+                        help="Publicar cada lote con el motor asíncrono (SCHEDULER_ASYNC_ENGINE).")
+    parser.add_argument("--rate-limit", action="store_true", help="Activar el limitador de peticiones.")
+    parser.add_argument("--conservar", action="store_true", help="No borrar el directorio temporal al terminar.")
+    return parser.parse_args()
+
+
+def _configurar_entorno(base_url: str, work_dir: str, args) -> None:
+    """Apunta todos los adaptadores al servidor simulado. Debe llamarse antes de importar src.*"""
+    os.environ.update({
+        "DB_DIR": os.path.join(work_dir, "data"),
+        "WP_SITE": base_url,
+        "WP_USER": "benchmark",
+        "WP_APP_PASS": "benchmark",
+        "ACCESS_TOKEN_LINKEDIN": "benchmark-token",
+        "LINKEDIN_API_BASE": base_url,
+        "POST_VISIBILITY": "PUBLIC",
+        "GRAPH_API_BASE": f"{base_url}/v1.0",
+        "MICROSOFT_CLIENT_ID": "benchmark",
+        "MICROSOFT_TENANT_ID": "benchmark",
+        "MICROSOFT_CLIENT_SECRET": "benchmark",
+        "MICROSOFT_SENDER_EMAIL": "benchmark@example.com",
+        "SCHEDULER_BATCH_SIZE": str(args.lote),
+        "SCHEDULER_PREPARE_LEAD_MINUTES": "0",
+        "SCHEDULER_METRICS_PORT": "0",
+        "RATE_LIMIT_ENABLED": "true" if args.rate_limit else "false",
+        "HTTP_READ_TIMEOUT": str(args.timeout_lectura),
+        "LINKEDIN_MULTIPART_THRESHOLD_MB": str(args.umbral_multipart_mb),
+        "SCHEDULER_ASYNC_ENGINE": "true" if args.motor_async else "false",
+        # Las rondas del benchmark reintentan al momento los bloques de correo fallidos
+        "EMAIL_OUTBOX_BACKOFF_SECONDS": "0",
+    })
+
+
+def _crear_medio(directorio: str, nombre: str, size_kb: int) -> str:
+    path = os.path.join(directorio, nombre)
+    with open(path, "wb") as f:
+        for _ in range(size_kb):
+            f.write(os.urandom(1024))
+    return path
+
+
+def _sembrar(db_config, work_dir: str, args, plataformas: list, fecha_hora: str) -> None:
+    """Crea las publicaciones programadas y sus medios en la base de datos temporal."""
+    media_dir = os.path.join(work_dir, "media")
+    os.makedirs(media_dir, exist_ok=True)
+
+    for i in range(args.posts):
+        platform = plataformas[i % len(plataformas)]
+        post_id = db_config.create_post(
+            title=f"Benchmark {i}", content=f"Contenido de prueba {i}", platform=platform,
+            asunto=f"Asunto {i}", content_html=f"<p>Contenido de prueba {i}</p>",
+            contacts=[f"destinatario{j}@example.com" for j in range(args.destinatarios)],
+            fecha_hora=fecha_hora
+        )
+        media_ids = []
+        for n in range(args.imagenes):
+            path = _crear_medio(media_dir, f"post{i}_img{n}.jpg", args.imagen_kb)
+            media_ids.append(db_config.create_media_asset(path, "image", os.path.basename(path))["id"])
+        if args.video_kb:
+            path = _crear_medio(media_dir, f"post{i}_video.mp4", args.video_kb)
+            media_ids.append(db_config.create_media_asset(path, "video", os.path.basename(path))["id"])
+        db_config.link_media_to_post(post_id, media_ids)
+
+
+def _percentil(valores: list, p: float) -> float:
+    if not valores:
+        return 0.0
+    valores = sorted(valores)
+    index = min(len(valores) - 1, int(round(p / 100 * (len(valores) - 1))))
+    return valores[index]
+
+
+def main():
+    args = _parse_args()
+    plataformas = [p.strip() for p in args.plataformas.split(",") if p.strip()]
+    work_dir = tempfile.mkdtemp(prefix="benchmark_publicador_")
+    os.chdir(work_dir)
+
+    mock = MockPlatformServer(latency_ms=args.latencia_ms, error_rate=args.tasa_error,
+                              throttle_rate=args.tasa_429, retry_after=args.retry_after,
+                              hang_rate=args.tasa_cuelgue).start()
+    _configurar_entorno(mock.base_url, work_dir, args)
+
+    # Importar después de configurar el entorno: los módulos leen la configuración al cargarse
+    from src import db_config, graph_mail, metrics
+    from scripts import publish_programmed_posts as scheduler
+
+    # El servidor simulado no implementa el flujo OAuth de Azure AD
+    graph_mail.get_access_token = lambda: "benchmark-token"
+
+    try:
+        db_config.init_db()
+        fecha_hora = datetime.now().isoformat()
+        _sembrar(db_config, work_dir, args, plataformas, fecha_hora)
+        print(f"Sembradas {args.posts} publicaciones en {work_dir}. Servidor simulado en {mock.base_url}")
+
+        inicio = time.monotonic()
+        rondas = 0
+        while True:
+            excluidos = set()
+            while scheduler.ejecutar_ciclo(excluidos)[1]:
+                pass
+            pendientes = len(db_config.get_programmed_posts_raw())
+            rondas += 1
+            if not pendientes or rondas >= args.rondas:
+                break
+        duracion = time.monotonic() - inicio
+
+        enviados = db_config.get_sent_posts_raw()
+        lags = [(datetime.fromisoformat(p['sent_at']) - datetime.fromisoformat(p['fecha_hora'])).total_seconds()
+                for p in enviados]
+        intentos = sum(metrics.POSTS_PUBLISHED.get(platform=p.lower()) + metrics.PLATFORM_ERRORS.get(platform=p.lower())
+                       for p in plataformas)
+
+        print("\n" + "=" * 60)
+        print("RESULTADOS DEL BENCHMARK")
+        print("=" * 60)
+        print(f"Publicaciones enviadas:   {len(enviados)}/{args.posts} en {duracion:.2f}s ({rondas} rondas)")
+        print(f"Throughput:               {len(enviados) / duracion if duracion else 0:.2f} posts/s")
+        print(f"Lag p50/p90/p99:          {_percentil(lags, 50):.2f}s / {_percentil(lags, 90):.2f}s / {_percentil(lags, 99):.2f}s")
+        print(f"Intentos de publicación:  {int(intentos)} (reintentos: {int(intentos) - len(enviados)})")
+        print(f"Peticiones HTTP:          " + ", ".join(
+            f"{k.replace('requests_', '')}={v}" for k, v in sorted(mock.stats.items()) if k.startswith("requests_")))
+        print(f"Respuestas 429 / 500:     {mock.stats['throttled']} / {mock.stats['errors']}")
+        print(f"Peticiones colgadas:      {mock.stats['hung']} (cortadas por timeout de {args.timeout_lectura:g}s)")
+        total_peticiones = sum(v for k, v in mock.stats.items() if k.startswith("requests_"))
+        print(f"Conexiones TCP abiertas:  {mock.stats['connections']} "
+              f"({total_peticiones / max(mock.stats['connections'], 1):.1f} peticiones por conexión)")
+        print(f"Bytes recibidos:          {mock.stats['bytes_received'] / (1024 * 1024):.1f} MB")
+        print("=" * 60)
+        if len(enviados) < args.posts:
+            print(f"Aviso: {args.posts - len(enviados)} publicaciones no se enviaron tras {rondas} rondas.")
+    finally:
+        mock.stop()
+        os.chdir(ROOT_DIR)
+        if not args.conservar:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
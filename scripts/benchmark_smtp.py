@@ -0,0 +1,88 @@
+"""
+Benchmark del envío de correos por SMTP contra un servidor local (ver MockSMTPServer).
+
+Compara tres modos con el mismo número de correos:
+- Una conexión por correo (sin pool): handshake y AUTH en cada envío.
+- send_mail con el pool de conexiones: las sesiones autenticadas se reutilizan.
+- send_mail_batch: todos los correos por una única sesión.
+
+Uso (desde la raíz del proyecto):
+    python -m scripts.benchmark_smtp --correos 200 --latencia-ms 20
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).resolve().parents[1]
+if str(ROOT_DIR) not in sys.path:
+    sys.path.insert(0, str(ROOT_DIR))
+
+from scripts.mock_platforms import MockSMTPServer
+
+
+def _medir(nombre: str, mock: MockSMTPServer, enviar, correos: int) -> None:
+    antes = dict(mock.stats)
+    inicio = time.monotonic()
+    resultados = enviar()
+    duracion = time.monotonic() - inicio
+    conexiones = mock.stats["connections"] - antes.get("connections", 0)
+    logins = mock.stats["logins"] - antes.get("logins", 0)
+    print(f"{nombre:<28} {sum(resultados):>4}/{correos} enviados  {duracion:>7.2f}s  "
+          f"{correos / duracion if duracion else 0:>7.1f} correos/s  {conexiones:>4} conexiones  {logins:>4} AUTH")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark del envío de correos por SMTP.")
+    parser.add_argument("--correos", type=int, default=100, help="Correos a enviar en cada modo.")
+    parser.add_argument("--destinatarios", type=int, default=1, help="Destinatarios por correo.")
+    parser.add_argument("--latencia-ms", type=float, default=10, help="Latencia simulada por comando SMTP.")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="benchmark_smtp_")
+    mock = MockSMTPServer(latency_ms=args.latencia_ms).start()
+    os.environ.update({
+        "DB_DIR": os.path.join(work_dir, "data"),
+        "SMTP_SERVER": mock.host,
+        "SMTP_PORT": str(mock.port),
+        "SMTP_USE_SSL": "false",
+        "SMTP_USE_TLS": "false",
+        "SMTP_USERNAME": "benchmark@example.com",
+        "SMTP_PASSWORD": "benchmark",
+        "RATE_LIMIT_ENABLED": "false",
+    })
+
+    from src import email_sender
+
+    receivers = [f"destinatario{i}@example.com" for i in range(args.destinatarios)]
+    mensaje = {"receivers": receivers, "subject": "Benchmark", "content_text": "Contenido de prueba",
+               "content_html": "<p>Contenido de prueba</p>"}
+
+    def sin_pool():
+        pool = email_sender.SMTPPool(email_sender.get_smtp_config(), size=0)
+        resultados = []
+        for _ in range(args.correos):
+            msg = email_sender._build_message("benchmark@example.com", receivers, "Benchmark", "Contenido de prueba")
+            with pool.session() as session:
+                session.send(receivers, msg.as_string())
+            resultados.append(True)
+        return resultados
+
+    try:
+        print("=" * 100)
+        _medir("Una conexión por correo", mock, sin_pool, args.correos)
+        _medir("send_mail (pool)", mock, lambda: [email_sender.send_mail(**mensaje) for _ in range(args.correos)],
+               args.correos)
+        _medir("send_mail_batch", mock, lambda: email_sender.send_mail_batch([mensaje] * args.correos), args.correos)
+        print("=" * 100)
+    finally:
+        mock.stop()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
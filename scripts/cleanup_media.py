@@ -1,6 +1,7 @@
 import os
 import logging
 from src.db_config import get_all_media_assets, delete_media_asset
+from src.media_derivatives import evict_derivatives
 
 # Configuración de logging para este script
 logging.basicConfig(
@@ -56,3 +57,4 @@ def find_and_delete_orphan_assets():
 
 if __name__ == "__main__":
     find_and_delete_orphan_assets()
+    evict_derivatives()
@@ -1,5 +1,5 @@
 import logging
-from src.instagram import get_instagram_client
+from src.instagram import get_instagram_client, SESSION_FILE
 import os
 
 # Logger básico
@@ -15,14 +15,14 @@ def iniciar_sesion_instagram():
     print("     Este script podría pedirte un código de verificación.")
     print("     Revisa tu email y escríbelo en la terminal cuando se te pida.")
     print("-" * 50)
-    os.makedirs("sessions", exist_ok=True)  # Crea la carpeta 'sessions' si no existe.
+    os.makedirs(os.path.dirname(SESSION_FILE) or ".", exist_ok=True)  # Crea la carpeta de la sesión si no existe.
     try:
         client = get_instagram_client()
 
         if client and client.user_id:
             print("-" * 50)
             print(f"✅ ¡Éxito! Sesión guardada con éxito para el usuario {client.user_id}.")
-            print(f"   El archivo 'sessions/ig_session.json' ha sido creado/actualizado.")
+            print(f"   El archivo '{SESSION_FILE}' ha sido creado/actualizado.")
         else:
             print("❌ Fallo al iniciar sesión. Revisa las credenciales o el código de verificación.")
 
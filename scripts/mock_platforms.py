@@ -0,0 +1,403 @@
+"""
+Servidores locales que imitan las APIs de WordPress, LinkedIn y Microsoft Graph
+(MockPlatformServer) y un servidor SMTP (MockSMTPServer).
+
+Se usa en los benchmarks para medir el scheduler sin tocar las plataformas reales.
+La latencia, la tasa de errores 500, la tasa de respuestas 429 y la de peticiones que
+se quedan colgadas son configurables, y el servidor cuenta peticiones, conexiones
+abiertas y bytes recibidos.
+"""
+
+import json
+import random
+import re
+import socket
+import socketserver
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from itertools import count
+
+
+class MockPlatformServer:
+    """
+    Servidor de plataformas simuladas. Todas las APIs comparten un mismo puerto:
+
+    - WordPress:  {base_url}/wp-json/wp/v2/...
+    - LinkedIn:   {base_url}/v2/...
+    - Graph:      {base_url}/v1.0/...
+    """
+
+    def __init__(self, latency_ms: float = 50, error_rate: float = 0.0, throttle_rate: float = 0.0,
+                 retry_after: int = 1, hang_rate: float = 0.0, hang_seconds: float = 300,
+                 part_size: int = 4 * 1024 * 1024,
+                 host: str = "127.0.0.1", port: int = 0):
+        self.latency = latency_ms / 1000.0
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.hang_rate = hang_rate
+        self.hang_seconds = hang_seconds
+        self.part_size = part_size
+        self.stats = Counter()
+        self._ids = count(1)
+        self._lock = threading.Lock()
+        self._random = random.Random(42)
+        self._server = ThreadingHTTPServer((host, port), self._build_handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "MockPlatformServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True, name="mock-platforms")
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def count(self, key: str, amount: int = 1) -> None:
+        with self._lock:
+            self.stats[key] += amount
+
+    def next_id(self) -> int:
+        with self._lock:
+            return next(self._ids)
+
+    def _roll(self, rate: float) -> bool:
+        with self._lock:
+            return rate > 0 and self._random.random() < rate
+
+    # --- Rutas ---
+    def _routes(self):
+        return [
+            ("GET", r"^/v2/userinfo$", "linkedin", self._linkedin_userinfo),
+            ("POST", r"^/v2/assets\?action=registerUpload$", "linkedin", self._linkedin_register),
+            ("POST", r"^/v2/assets\?action=completeMultiPartUpload$", "linkedin", self._empty_ok),
+            ("PUT", r"^/upload/linkedin/\d+$", "linkedin", self._empty_created),
+            ("PUT", r"^/upload/linkedin/\d+/part/\d+$", "linkedin", self._linkedin_part),
+            ("DELETE", r"^/v2/assets/\d+$", "linkedin", self._empty_no_content),
+            ("POST", r"^/v2/ugcPosts$", "linkedin", self._linkedin_post),
+            ("POST", r"^/wp-json/wp/v2/media$", "wordpress", self._wp_media),
+            ("GET", r"^/wp-json/wp/v2/media/\d+", "wordpress", self._wp_media_get),
+            ("POST", r"^/wp-json/wp/v2/posts$", "wordpress", self._wp_post),
+            ("POST", r"^/v1\.0/users/[^/]+/sendMail$", "graph", self._graph_send),
+            ("POST", r"^/v1\.0/\$batch$", "graph", self._graph_batch),
+            ("POST", r"^/v1\.0/users/[^/]+/messages$", "graph", self._graph_draft),
+            ("POST", r"^/v1\.0/users/[^/]+/messages/[^/]+/attachments$", "graph", self._empty_created),
+            ("POST", r"^/v1\.0/users/[^/]+/messages/[^/]+/attachments/createUploadSession$", "graph",
+             self._graph_upload_session),
+            ("PUT", r"^/upload/graph/\d+$", "graph", self._graph_upload_chunk),
+            ("POST", r"^/v1\.0/users/[^/]+/messages/[^/]+/send$", "graph", self._graph_send),
+            ("DELETE", r"^/v1\.0/users/[^/]+/messages/[^/]+$", "graph", self._empty_no_content),
+        ]
+
+    def _linkedin_userinfo(self, handler, body):
+        return 200, {"sub": "benchmark"}, {}
+
+    def _linkedin_register(self, handler, body):
+        upload_id = self.next_id()
+        request = json.loads(body or b"{}").get("registerUploadRequest", {})
+        if "MULTIPART_UPLOAD" in request.get("supportedUploadMechanism", []):
+            file_size = request["fileSize"]
+            parts = [{
+                "url": f"{self.base_url}/upload/linkedin/{upload_id}/part/{n}",
+                "byteRange": {"firstByte": first, "lastByte": min(first + self.part_size, file_size) - 1},
+                "headers": {}
+            } for n, first in enumerate(range(0, file_size, self.part_size))]
+            return 200, {"value": {
+                "asset": f"urn:li:digitalmediaAsset:{upload_id}",
+                "mediaArtifact": f"urn:li:digitalmediaMediaArtifact:{upload_id}",
+                "uploadMechanism": {"com.linkedin.digitalmedia.uploading.MultipartUpload": {
+                    "metadata": f"metadata-{upload_id}",
+                    "partUploadRequests": parts
+                }}
+            }}, {}
+        return 200, {"value": {
+            "asset": f"urn:li:digitalmediaAsset:{upload_id}",
+            "uploadMechanism": {"com.linkedin.digitalmedia.uploading.MediaUploadHttpRequest": {
+                "uploadUrl": f"{self.base_url}/upload/linkedin/{upload_id}"
+            }}
+        }}, {}
+
+    def _linkedin_post(self, handler, body):
+        return 201, {"id": f"urn:li:share:{self.next_id()}"}, {}
+
+    def _wp_media(self, handler, body):
+        media_id = self.next_id()
+        return 201, {"id": media_id, "source_url": f"{self.base_url}/wp-content/uploads/{media_id}"}, {}
+
+    def _wp_media_get(self, handler, body):
+        media_id = int(re.search(r"/media/(\d+)", handler.path).group(1))
+        return 200, {"id": media_id, "source_url": f"{self.base_url}/wp-content/uploads/{media_id}"}, {}
+
+    def _wp_post(self, handler, body):
+        post_id = self.next_id()
+        return 201, {"id": post_id, "link": f"{self.base_url}/?p={post_id}"}, {}
+
+    def _graph_send(self, handler, body):
+        return 202, None, {}
+
+    def _graph_batch(self, handler, body):
+        # Las subpeticiones sufren el throttling y los errores simulados una a una
+        responses = []
+        for request in json.loads(body or b"{}").get("requests", []):
+            self.count("batch_subrequests")
+            if self._roll(self.throttle_rate):
+                self.count("throttled")
+                responses.append({"id": request["id"], "status": 429,
+                                  "headers": {"Retry-After": str(self.retry_after)},
+                                  "body": {"error": {"code": "TooManyRequests", "message": "Too Many Requests"}}})
+            elif self._roll(self.error_rate):
+                self.count("errors")
+                responses.append({"id": request["id"], "status": 503, "headers": {},
+                                  "body": {"error": {"code": "ServiceUnavailable", "message": "Error simulado"}}})
+            else:
+                responses.append({"id": request["id"], "status": 202, "headers": {}, "body": None})
+        return 200, {"responses": responses}, {}
+
+    def _graph_draft(self, handler, body):
+        return 201, {"id": f"draft-{self.next_id()}"}, {}
+
+    def _graph_upload_session(self, handler, body):
+        return 201, {"uploadUrl": f"{self.base_url}/upload/graph/{self.next_id()}",
+                     "nextExpectedRanges": ["0-"]}, {}
+
+    def _graph_upload_chunk(self, handler, body):
+        # Content-Range: bytes <inicio>-<fin>/<total>
+        match = re.match(r"bytes (\d+)-(\d+)/(\d+)", handler.headers.get("Content-Range", ""))
+        if not match:
+            return 400, {"error": "Falta Content-Range"}, {}
+        end, total = int(match.group(2)), int(match.group(3))
+        if end + 1 >= total:
+            return 201, None, {}
+        return 200, {"nextExpectedRanges": [f"{end + 1}-"]}, {}
+
+    def _empty_created(self, handler, body):
+        return 201, None, {}
+
+    def _linkedin_part(self, handler, body):
+        return 200, None, {"ETag": f"etag-{self.next_id()}"}
+
+    def _empty_ok(self, handler, body):
+        return 200, None, {}
+
+    def _empty_no_content(self, handler, body):
+        return 204, None, {}
+
+    def _build_handler(self):
+        mock = self
+        routes = [(method, re.compile(pattern), platform, func) for method, pattern, platform, func in self._routes()]
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                super().setup()
+                # Una instancia por conexión TCP: permite medir la reutilización de conexiones
+                mock.count("connections")
+
+            def log_message(self, format, *args):
+                pass
+
+            def _read_body(self) -> bytes:
+                if self.headers.get("Transfer-Encoding", "").lower() == "chunked":
+                    received = 0
+                    while True:
+                        size = int(self.rfile.readline().strip().split(b";")[0], 16)
+                        if size == 0:
+                            self.rfile.readline()
+                            break
+                        # Se descarta el contenido: solo interesa su tamaño
+                        received += len(self.rfile.read(size))
+                        self.rfile.readline()
+                    mock.count("bytes_received", received)
+                    return b""
+                length = int(self.headers.get("Content-Length") or 0)
+                remaining = length
+                chunks = []
+                while remaining > 0:
+                    chunk = self.rfile.read(min(remaining, 1024 * 1024))
+                    if not chunk:
+                        break
+                    remaining -= len(chunk)
+                    # Guardar solo cuerpos JSON o pequeños; los binarios grandes se descartan
+                    if length <= 1024 * 1024 or "json" in self.headers.get("Content-Type", ""):
+                        chunks.append(chunk)
+                mock.count("bytes_received", length - remaining)
+                return b"".join(chunks)
+
+            def _send(self, status: int, payload=None, headers=None):
+                body = b"" if payload is None else json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                for key, value in (headers or {}).items():
+                    self.send_header(key, str(value))
+                if body:
+                    self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                if body:
+                    self.wfile.write(body)
+
+            def _dispatch(self, method: str):
+                body = self._read_body()
+                for route_method, pattern, platform, func in routes:
+                    if route_method == method and pattern.search(self.path):
+                        break
+                else:
+                    mock.count("not_found")
+                    self._send(404, {"error": f"Ruta no simulada: {method} {self.path}"})
+                    return
+
+                mock.count(f"requests_{platform}")
+                if mock.latency:
+                    time.sleep(mock.latency)
+                if mock._roll(mock.hang_rate):
+                    # Simula un servidor que acepta la petición y nunca responde
+                    mock.count("hung")
+                    time.sleep(mock.hang_seconds)
+                    self.close_connection = True
+                    return
+                if mock._roll(mock.throttle_rate):
+                    mock.count("throttled")
+                    self._send(429, {"error": "Too Many Requests"}, {"Retry-After": mock.retry_after})
+                    return
+                if mock._roll(mock.error_rate):
+                    mock.count("errors")
+                    self._send(500, {"error": "Error simulado"})
+                    return
+
+                status, payload, headers = func(self, body)
+                self._send(status, payload, headers)
+
+            def do_GET(self):
+                self._dispatch("GET")
+
+            def do_POST(self):
+                self._dispatch("POST")
+
+            def do_PUT(self):
+                self._dispatch("PUT")
+
+            def do_DELETE(self):
+                self._dispatch("DELETE")
+
+        return Handler
+
+
+class MockSMTPServer:
+    """
+    Servidor SMTP mínimo (sin TLS) para medir el envío de correos sin un proveedor real.
+    Acepta EHLO/HELO, AUTH PLAIN/LOGIN, MAIL, RCPT, DATA, RSET, NOOP y QUIT, y cuenta
+    conexiones, autenticaciones, mensajes y destinatarios. Con `idle_timeout` cierra las
+    conexiones inactivas con un 421, como hacen los proveedores reales.
+    """
+
+    def __init__(self, latency_ms: float = 0, idle_timeout: float = None, host: str = "127.0.0.1", port: int = 0):
+        self.latency = latency_ms / 1000.0
+        self.idle_timeout = idle_timeout
+        self.stats = Counter()
+        self._lock = threading.Lock()
+        self._server = socketserver.ThreadingTCPServer((host, port), self._build_handler())
+        self._server.daemon_threads = True
+
+    @property
+    def host(self) -> str:
+        return self._server.server_address[0]
+
+    @property
+    def port(self) -> int:
+        return self._server.server_address[1]
+
+    def start(self) -> "MockSMTPServer":
+        threading.Thread(target=self._server.serve_forever, daemon=True, name="mock-smtp").start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def count(self, key: str, amount: int = 1) -> None:
+        with self._lock:
+            self.stats[key] += amount
+
+    def _build_handler(self):
+        mock = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def _reply(self, line: str):
+                self.wfile.write((line + "\r\n").encode("ascii"))
+                self.wfile.flush()
+
+            def _read_line(self) -> str:
+                return self.rfile.readline().decode("utf-8", "replace").rstrip("\r\n")
+
+            def _read_data(self) -> int:
+                size = 0
+                while True:
+                    line = self.rfile.readline()
+                    if not line or line == b".\r\n":
+                        return size
+                    size += len(line)
+
+            def handle(self):
+                mock.count("connections")
+                if mock.idle_timeout:
+                    self.request.settimeout(mock.idle_timeout)
+                self._reply("220 mock ESMTP")
+                try:
+                    while True:
+                        line = self._read_line()
+                        if not line:
+                            return
+                        verb = line.split(" ", 1)[0].upper()
+                        if mock.latency:
+                            time.sleep(mock.latency)
+
+                        if verb == "EHLO":
+                            self.wfile.write(b"250-mock\r\n250-AUTH PLAIN LOGIN\r\n250 SIZE 104857600\r\n")
+                            self.wfile.flush()
+                        elif verb == "HELO":
+                            self._reply("250 mock")
+                        elif verb == "AUTH":
+                            args = line.split(" ")
+                            if args[1].upper() == "LOGIN":
+                                self._reply("334 VXNlcm5hbWU6")
+                                self._read_line()
+                                self._reply("334 UGFzc3dvcmQ6")
+                                self._read_line()
+                            elif len(args) < 3:
+                                self._reply("334 ")
+                                self._read_line()
+                            mock.count("logins")
+                            self._reply("235 2.7.0 Authentication successful")
+                        elif verb == "MAIL":
+                            self._reply("250 OK")
+                        elif verb == "RCPT":
+                            mock.count("recipients")
+                            self._reply("250 OK")
+                        elif verb == "DATA":
+                            self._reply("354 End data with <CR><LF>.<CR><LF>")
+                            mock.count("bytes_received", self._read_data())
+                            mock.count("messages")
+                            self._reply("250 OK queued")
+                        elif verb in ("RSET", "NOOP"):
+                            self._reply("250 OK")
+                        elif verb == "QUIT":
+                            self._reply("221 Bye")
+                            return
+                        else:
+                            self._reply("502 Command not implemented")
+                except socket.timeout:
+                    mock.count("idle_disconnects")
+                    self._reply("421 4.4.2 Idle timeout, closing connection")
+                except (ConnectionError, OSError):
+                    pass
+
+        return Handler
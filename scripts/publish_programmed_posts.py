@@ -1,15 +1,19 @@
 import logging
+import threading
 import time
 import traceback
-from datetime import datetime
+from datetime import datetime, timedelta
 import os
 
-from src.db_config import get_programmed_posts_raw, update_post
-from src.graph_mail import send_mail_graph
-from src.wordpress import create_post_wordpress, upload_media
-from src.instagram import post_image_ig, post_carousel_ig, post_video_ig
-# from src.whatsapp import send_whatsapp
-from src.linkedin import LinkedInClient
+from src import metrics
+from src.db_config import (init_db, get_programmed_posts_raw, update_post, claim_next_publish_job,
+                           requeue_running_publish_jobs, requeue_sending_email_chunks, get_publish_steps,
+                           record_publish_step, get_latest_publish_jobs, get_post_by_id)
+from src.email_outbox import drain as drenar_outbox
+from src.media_derivatives import evict_derivatives
+from src.publish_ledger import PublishLedger
+from src.publisher import (base_platform, publicar_post, publicar_posts, preparar_post, ejecutar_trabajo,
+                           reservar_post, liberar_post)
 
 # Configuración de logging
 logging.basicConfig(
@@ -23,165 +27,311 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Minutos de antelación con los que se preparan (suben y validan) los medios de un post programado
+PREPARE_LEAD_MINUTES = int(os.getenv("SCHEDULER_PREPARE_LEAD_MINUTES", "15"))
 
-def publicar_post(post: dict):
+# Modo de recuperación: tamaño de lote, prioridad por plataforma y tratamiento de posts obsoletos
+BATCH_SIZE = max(1, int(os.getenv("SCHEDULER_BATCH_SIZE", "20")))
+PLATFORM_PRIORITY = [p.strip().lower() for p in os.getenv("SCHEDULER_PLATFORM_PRIORITY", "gmail").split(",") if p.strip()]
+STALE_HOURS = float(os.getenv("SCHEDULER_STALE_HOURS", "0"))
+STALE_POLICY = os.getenv("SCHEDULER_STALE_POLICY", "publish").lower()
+
+# Motor asíncrono: publica todo el lote a la vez en lugar de post a post
+ASYNC_ENGINE = os.getenv("SCHEDULER_ASYNC_ENGINE", "false").lower() == "true"
+
+# Workers que atienden los trabajos encolados desde "Publicar ahora"
+JOB_WORKERS = max(1, int(os.getenv("PUBLISH_JOB_WORKERS", "1")))
+JOB_POLL_SECONDS = float(os.getenv("PUBLISH_JOB_POLL_SECONDS", "2"))
+
+# Worker del outbox de correo: reintenta los bloques de destinatarios pendientes entre ciclos
+EMAIL_OUTBOX_POLL_SECONDS = float(os.getenv("EMAIL_OUTBOX_POLL_SECONDS", "10"))
+
+# Endpoint de métricas de Prometheus (0 lo desactiva)
+METRICS_HOST = os.getenv("SCHEDULER_METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("SCHEDULER_METRICS_PORT", "9108"))
+
+
+def _worker_trabajos(worker_id: int):
+    """
+    Bucle de un worker: atiende los trabajos de publicación encolados por la UI,
+    de forma independiente al ciclo de posts programados.
+    """
+    logger.info(f"Worker de publicación {worker_id} iniciado.")
+    while True:
+        try:
+            job = claim_next_publish_job()
+            if not job:
+                time.sleep(JOB_POLL_SECONDS)
+                continue
+            logger.info(f"[worker {worker_id}] Atendiendo trabajo {job['id']} (post ID {job['post_id']}).")
+            ejecutar_trabajo(job)
+        except Exception as e:
+            logger.error(f"[worker {worker_id}] Error en el worker de publicación: {e}\n{traceback.format_exc()}")
+            time.sleep(JOB_POLL_SECONDS)
+
+
+def _worker_outbox():
+    """
+    Bucle del worker del outbox de correo: envía los bloques de destinatarios cuyo
+    reintento ya ha vencido, sin esperar a que el ciclo vuelva a publicar el post.
+    """
+    logger.info("Worker del outbox de correo iniciado.")
+    while True:
+        try:
+            if not drenar_outbox():
+                time.sleep(EMAIL_OUTBOX_POLL_SECONDS)
+        except Exception as e:
+            logger.error(f"Error en el worker del outbox de correo: {e}\n{traceback.format_exc()}")
+            time.sleep(EMAIL_OUTBOX_POLL_SECONDS)
+
+
+def iniciar_workers():
+    """Arranca los hilos que atienden la cola de trabajos de publicación y el outbox de correo."""
+    reencolados = requeue_running_publish_jobs()
+    if reencolados:
+        logger.info(f"{reencolados} trabajos interrumpidos devueltos a la cola.")
+    bloques = requeue_sending_email_chunks()
+    if bloques:
+        logger.info(f"{bloques} bloques de correo interrumpidos devueltos al outbox.")
+    for worker_id in range(JOB_WORKERS):
+        threading.Thread(target=_worker_trabajos, args=(worker_id,), daemon=True, name=f"publish-worker-{worker_id}").start()
+    threading.Thread(target=_worker_outbox, daemon=True, name="email-outbox-worker").start()
+
+
+def _prioridad(post: dict) -> tuple:
+    """
+    Clave de ordenación de los posts vencidos: primero las plataformas prioritarias
+    (por defecto, el correo) y, dentro de cada grupo, los más atrasados.
+    """
+    platform = base_platform(post.get('platform', ''))
+    rango = PLATFORM_PRIORITY.index(platform) if platform in PLATFORM_PRIORITY else len(PLATFORM_PRIORITY)
+    return rango, post['fecha_hora']
+
+
+def _aplicar_politica_obsoletos(due_posts: list, now: datetime) -> list:
+    """
+    Aplica SCHEDULER_STALE_POLICY a los posts con más de SCHEDULER_STALE_HOURS de retraso.
+
+    - 'publish': se publican igualmente (comportamiento por defecto).
+    - 'skip': no se publican.
+    - 'coalesce': por plataforma solo se publica el obsoleto más reciente; el resto no se publica.
+
+    Los posts omitidos conservan su fecha programada: se anota en su ledger que se omitieron
+    para esa fecha y dejan de considerarse hasta que se reprogramen o se publiquen a mano.
+
+    Returns:
+        list: Posts que deben publicarse.
+    """
+    if STALE_HOURS <= 0 or STALE_POLICY == 'publish':
+        return due_posts
+
+    limite = now - timedelta(hours=STALE_HOURS)
+    vigentes = [p for p in due_posts if datetime.fromisoformat(p['fecha_hora']) >= limite]
+    obsoletos = [p for p in due_posts if datetime.fromisoformat(p['fecha_hora']) < limite]
+    if not obsoletos:
+        return due_posts
+
+    # Los ya omitidos para su fecha actual no cuentan: si no, 'coalesce' elegiría en cada
+    # ciclo el siguiente más reciente y acabaría publicándolos todos
+    pendientes = []
+    for post in obsoletos:
+        omitido = get_publish_steps(post['id']).get("stale_skipped")
+        if not (omitido and omitido.get('fecha_hora') == post['fecha_hora']):
+            pendientes.append(post)
+
+    conservados = []
+    if STALE_POLICY == 'coalesce':
+        mas_recientes = {}
+        for post in pendientes:
+            platform = base_platform(post.get('platform', ''))
+            if platform not in mas_recientes or post['fecha_hora'] > mas_recientes[platform]['fecha_hora']:
+                mas_recientes[platform] = post
+        conservados = list(mas_recientes.values())
+
+    for post in pendientes:
+        if post in conservados:
+            continue
+        record_publish_step(post['id'], "stale_skipped", {"fecha_hora": post['fecha_hora'], "at": now.isoformat()})
+        logger.warning(f"Post ID {post['id']} ({post.get('platform')}) programado para {post['fecha_hora']} "
+                       f"supera el umbral de {STALE_HOURS}h: se omite y conserva su fecha. "
+                       f"Reprográmalo o usa \"Publicar ahora\" para publicarlo.")
+
+    return vigentes + conservados
+
+
+def _publicar(post: dict) -> bool:
+    logger.info(f"--> Es hora de publicar el post ID {post.get('id', 'desconocido')} programado para {post['fecha_hora']}")
+    return publicar_post(post)
+
+
+def _publicar_lote(lote: list):
     """
-    Publica un post según su plataforma, adjuntando los medios asociados.
-    Maneja la lógica de extraer imágenes y vídeos del objeto 'post'.
+    Publica el lote y devuelve el resultado de cada post en orden. Con SCHEDULER_ASYNC_ENGINE
+    se publica todo a la vez con el motor asíncrono; si no, post a post (de forma perezosa).
     """
+    if not (ASYNC_ENGINE and lote):
+        return (_publicar(post) for post in lote)
+
+    logger.info(f"Publicando {len(lote)} posts a la vez con el motor asíncrono.")
     try:
-        if not post or not post.get('id'):
-            logger.warning(f"Se intentó procesar un post inválido: {post}")
-            return False
-
-        post_id = post.get('id')
-        platform_lower = post.get('platform', '').lower()
-        logger.info(f"Procesando post ID: {post_id} para la plataforma: {platform_lower}")
-
-        # Extraer rutas de medios
-        media_assets = post.get('media_assets', [])
-        image_paths = [asset['file_path'] for asset in media_assets if
-                       asset['file_type'] == 'image' and os.path.exists(asset['file_path'])]
-        video_paths = [asset['file_path'] for asset in media_assets if
-                       asset['file_type'] == 'video' and os.path.exists(asset['file_path'])]
-
-        if platform_lower == 'wordpress':
-            logger.info(f"Iniciando publicación programada en WordPress para el post {post_id}")
-
-            # Extraer datos del post
-            title = post.get('title', 'Sin título')
-            content = post.get('content', '')
-
-            embedded_media_html = []
-
-            # Recorremos todas las imágenes para incrustarlas en el contenido.
-            for path in image_paths:
-                try:
-                    logger.info(f"Subiendo imagen para incrustar: {path}")
-                    wp_media_info = upload_media(path)
-                    if wp_media_info and 'url' in wp_media_info:
-                        embedded_media_html.append(f'<p><img src="{wp_media_info["url"]}" alt="{title}"></p>')
-                except Exception as e:
-                    logger.error(f"Error al subir imagen para incrustar ({path}) para el post {post_id}: {e}")
-
-            # Subir los vídeos para incrustar en el contenido
-            for path in video_paths:
-                try:
-                    logger.info(f"Subiendo vídeo para incrustar: {path}")
-                    wp_video_info = upload_media(path)
-                    if wp_video_info and 'url' in wp_video_info:
-                        embedded_media_html.append(f'<p>[video src="{wp_video_info["url"]}"]</p>')
-                except Exception as e:
-                    logger.error(f"Error al subir vídeo para incrustar ({path}) para el post {post_id}: {e}")
-
-            # Construir contenido final
-            final_content = content + "\n\n" + "\n".join(embedded_media_html)
-
-            # Crear el post
-            create_post_wordpress(
-                title=title,
-                content=final_content,
-                status='publish'  # Publicar directamente
-            )
-            logger.info(f"Publicación en WordPress exitosa para el post {post_id}")
-
-        elif platform_lower == 'gmail':
-            # Adjuntar todas las imágenes y vídeos
-            attachments = image_paths + video_paths
-            send_mail_graph(
-                receivers=post.get('contacts', []),
-                subject=post.get('asunto', ''),
-                content_text=post.get('content', ''),
-                content_html=post.get('content_html'),
-                attachments=attachments
-            )
-            logger.info(f"Correo para post {post_id} enviado exitosamente a {post.get('contacts', [])}")
-
-        elif platform_lower == 'instagram':
-            caption = post.get('content', '')
-            if video_paths:
-                logger.info(f"Publicando vídeo en Instagram para el post {post_id}: {video_paths[0]}")
-                post_video_ig(video_path=video_paths[0], caption=caption)
-            elif image_paths:
-                if len(image_paths) == 1:
-                    logger.info(f"Publicando imagen única en Instagram para el post {post_id}: {image_paths[0]}")
-                    post_image_ig(image_path=image_paths[0], caption=caption)
-                else:
-                    logger.info(
-                        f"Publicando carrusel en Instagram para el post {post_id} con {len(image_paths)} imágenes")
-                    post_carousel_ig(image_paths=image_paths, caption=caption)
+        return publicar_posts(lote)
+    except Exception as e:
+        logger.error(f"Error en el motor asíncrono: {e}\n{traceback.format_exc()}")
+        return [False] * len(lote)
+
+
+def _procesar_lote(lote: list, excluidos: set) -> int:
+    """
+    Publica un lote de posts ya reservados y marca como enviados los publicados. Cada post
+    se libera en cuanto se conoce su resultado, por si un "Publicar ahora" espera por él.
+
+    Returns:
+        int: Posts publicados.
+    """
+    posts_procesados_en_ciclo = 0
+    for post, ok in zip(lote, _publicar_lote(lote)):
+        post_id = post.get('id', 'desconocido')
+        try:
+            if ok:
+                # Marcar como enviado en lugar de eliminar
+                sent_at = datetime.now()
+                update_post(post_id, sent_at=sent_at.isoformat())
+                metrics.PUBLISH_LAG.observe((sent_at - datetime.fromisoformat(post['fecha_hora'])).total_seconds(),
+                                            platform=base_platform(post.get('platform', '')))
+                PublishLedger(post_id).clear()
+                logger.info(f"==> Post ID {post_id} procesado y marcado como enviado correctamente.")
+                posts_procesados_en_ciclo += 1
             else:
-                logger.warning(f"Post de Instagram ID {post_id} no tiene medios válidos para publicar.")
-                return False
-            logger.info(f"Publicación en Instagram para el post {post_id} exitosa.")
-
-        elif platform_lower == 'linkedin':
-            logger.info(f"Iniciando publicación en LinkedIn para el post {post_id}")
-            linkedin_client = LinkedInClient()
-            # LinkedIn permite un vídeo o una o varias imágenes, no ambos. Se prioriza el vídeo.
-            video_to_post = video_paths[0] if video_paths else None
-            images_to_post = image_paths if not video_to_post and image_paths else None
-            linkedin_client.post(
-                text=post.get('content', ''),
-                video_path=video_to_post,
-                image_paths=images_to_post
-            )
-            logger.info(f"Publicación en LinkedIn para el post {post_id} procesada exitosamente.")
+                excluidos.add(post_id)
+                logger.error(f"==> Fallo al publicar el post ID {post_id}. Permanecerá en la cola para el siguiente ciclo.")
+        except Exception as e:
+            excluidos.add(post_id)
+            logger.error(f"Error procesando el post ID {post_id}: {e}\n{traceback.format_exc()}")
+        finally:
+            liberar_post(post_id)
+    return posts_procesados_en_ciclo
+
 
+def _sin_enviar(reservados: list) -> list:
+    """
+    Descarta los posts reservados que se marcaron como enviados después de consultarlos
+    (p. ej. por un trabajo o por el worker del outbox al terminar un correo).
+    """
+    lote = []
+    for post in reservados:
+        actual = get_post_by_id(post['id'])
+        if actual and not actual.get('sent_at'):
+            lote.append(post)
         else:
-            if platform_lower == 'whatsapp':
-                logger.warning(f"La publicación para WhatsApp (ID: {post_id}) ha sido omitida según la configuración actual.")
-                return True  # Devolver True para que el post se elimine de la cola y no se reintente
+            logger.info(f"Post ID {post['id']} ya no está pendiente (se envió mientras se preparaba el lote). Se omite.")
+    return lote
 
-            logger.warning(f"Plataforma desconocida o sin acción de publicación: {post.get('platform')} para el post {post_id}")
-            return False
 
-        return True
+def ejecutar_ciclo(excluidos: set = None) -> tuple:
+    """
+    Ejecuta un ciclo del scheduler: publica como máximo SCHEDULER_BATCH_SIZE posts vencidos,
+    en orden de prioridad, y prepara los que vencen pronto si no queda backlog.
 
-    except Exception as e:
-        logger.error(f"Error fatal al publicar el post ID {post.get('id', 'desconocido')} en {post.get('platform', 'desconocido')}: {e}")
-        logger.error(traceback.format_exc())
-        return False
+    Args:
+        excluidos: IDs de posts que ya fallaron en el drenaje actual y no deben reintentarse aún.
+
+    Returns:
+        tuple: (posts del lote intentados, posts vencidos que siguen pendientes tras el lote).
+    """
+    excluidos = excluidos if excluidos is not None else set()
+
+    logger.info('Verificando publicaciones programadas...')
+    # Obtener solo los posts que tienen fecha de programación.
+    programmed_posts = get_programmed_posts_raw()
+
+    metrics.QUEUE_DEPTH.set(len(programmed_posts))
+    if not programmed_posts:
+        metrics.DUE_UNSENT.set(0)
+        logger.info("No hay publicaciones programadas para revisar.")
+        return 0, 0
+
+    logger.info(f"Encontradas {len(programmed_posts)} publicaciones programadas.")
+    now = datetime.now()
+
+    # Comprobar que 'fecha_hora' no sea None antes de procesar
+    due_posts = [p for p in programmed_posts
+                 if p.get('fecha_hora') and datetime.fromisoformat(p['fecha_hora']) <= now
+                 and p.get('id') not in excluidos]
+    # Los posts con un "Publicar ahora" pendiente o en curso los publica su trabajo
+    trabajos = get_latest_publish_jobs([p['id'] for p in due_posts])
+    due_posts = [p for p in due_posts if trabajos.get(p['id'], {}).get('status') not in ('queued', 'running')]
+    due_posts = sorted(_aplicar_politica_obsoletos(due_posts, now), key=_prioridad)
+    metrics.DUE_UNSENT.set(len(due_posts))
+
+    seleccion = due_posts[:BATCH_SIZE]
+    if len(due_posts) > len(seleccion):
+        logger.info(f"Modo de recuperación: {len(due_posts)} posts vencidos. Se procesa un lote de {len(seleccion)}.")
+    # Reservar los posts del lote: los que ya está publicando un trabajo se omiten
+    reservados = [p for p in seleccion if reservar_post(p['id'])]
+
+    try:
+        lote = _sin_enviar(reservados)
+        posts_procesados_en_ciclo = _procesar_lote(lote, excluidos)
+    finally:
+        for post in reservados:
+            liberar_post(post['id'])
+
+    pendientes = len(due_posts) - len(seleccion)
+
+    # Preparar con antelación los posts que vencen dentro del margen configurado
+    if PREPARE_LEAD_MINUTES > 0 and not pendientes:
+        horizonte = datetime.now() + timedelta(minutes=PREPARE_LEAD_MINUTES)
+        for post in programmed_posts:
+            try:
+                if post.get('fecha_hora') and now < datetime.fromisoformat(post['fecha_hora']) <= horizonte:
+                    preparar_post(post)
+            except Exception as e:
+                logger.error(f"Error preparando el post ID {post.get('id', 'desconocido')}: {e}")
+
+    logger.info(f"Ciclo completado: {posts_procesados_en_ciclo} publicaciones procesadas.")
+    return len(lote), pendientes
 
 
 def main():
     logger.info('Iniciando revisión de publicaciones programadas')
+    # Crear las tablas nuevas (p. ej. el estado del limitador) si aún no existen
+    init_db()
+    iniciar_workers()
+    metrics.start_metrics_server(METRICS_PORT, METRICS_HOST)
+
+    # Limpieza de derivados sin usar: al arrancar y después una vez al día, en reposo
+    ultima_limpieza = None
+
+    # Estado del drenaje del backlog (modo de recuperación tras una parada)
+    excluidos = set()
+    drenaje_inicio = None
+    drenados = 0
+
     while True:
         print('-' * 40)
         try:
-            logger.info('Verificando publicaciones programadas...')
-            # Obtener solo los posts que tienen fecha de programación.
-            programmed_posts = get_programmed_posts_raw()
+            inicio_lote = time.monotonic()
+            intentados, pendientes = ejecutar_ciclo(excluidos)
+            metrics.CYCLE_DURATION.observe(time.monotonic() - inicio_lote)
 
-            if not programmed_posts:
-                logger.info("No hay publicaciones programadas para revisar.")
-                time.sleep(60)
+            if pendientes:
+                # Seguir drenando sin esperar al siguiente minuto
+                if drenaje_inicio is None:
+                    drenaje_inicio = inicio_lote
+                    drenados = 0
+                drenados += intentados
+                ritmo = (time.monotonic() - drenaje_inicio) / max(drenados, 1)
+                logger.info(f"Drenando backlog: {drenados} procesados, {pendientes} pendientes. "
+                            f"Tiempo estimado hasta vaciarlo: {pendientes * ritmo:.0f}s.")
                 continue
 
-            logger.info(f"Encontradas {len(programmed_posts)} publicaciones programadas.")
-            now = datetime.now()
-            posts_procesados_en_ciclo = 0
-
-            for post in programmed_posts:
-                post_id = post.get('id', 'desconocido')
-                try:
-                    # Comprobar que 'fecha_hora' no sea None antes de procesar
-                    if post.get('fecha_hora'):
-                        fecha_hora_dt = datetime.fromisoformat(post['fecha_hora'])
-
-                        if fecha_hora_dt <= now:
-                            logger.info(f"--> Es hora de publicar el post ID {post_id} programado para {fecha_hora_dt}")
-                            if publicar_post(post):
-                                # Marcar como enviado en lugar de eliminar
-                                update_post(post_id, sent_at=datetime.now().isoformat())
-                                logger.info(f"==> Post ID {post_id} procesado y marcado como enviado correctamente.")
-                                posts_procesados_en_ciclo += 1
-                            else:
-                                logger.error(f"==> Fallo al publicar el post ID {post_id}. Permanecerá en la cola para el siguiente ciclo.")
-                except Exception as e:
-                    logger.error(f"Error procesando el post ID {post_id}: {e}\n{traceback.format_exc()}")
-
-            logger.info(f"Ciclo completado: {posts_procesados_en_ciclo} publicaciones procesadas.")
+            if drenaje_inicio is not None:
+                logger.info(f"Backlog drenado en {time.monotonic() - drenaje_inicio:.0f}s.")
+                drenaje_inicio = None
+            excluidos.clear()
+            if ultima_limpieza is None or time.monotonic() - ultima_limpieza >= 86400:
+                ultima_limpieza = time.monotonic()
+                evict_derivatives()
             time.sleep(60)
 
         except Exception as e:
@@ -0,0 +1,105 @@
+"""
+Motor de E/S asíncrona para las plataformas que son APIs HTTPS (WordPress, LinkedIn,
+Microsoft Graph y WhatsApp Cloud).
+
+Permite tener muchas subidas y envíos en vuelo a la vez en un único hilo:
+- `build_client()` crea un `httpx.AsyncClient` con el pool, timeouts y métricas de `http_client`.
+- `request()` respeta el limitador compartido y los 429 con Retry-After, como los `_request` síncronos.
+- `gather_limited()` ejecuta corrutinas con concurrencia acotada, conservando el orden de los resultados.
+
+La concurrencia máxima se configura con ASYNC_MAX_CONCURRENCY.
+"""
+
+import os
+import asyncio
+import logging
+from typing import Awaitable, Callable, Iterable, List, Optional
+
+import httpx
+
+from src import http_client, metrics, rate_limiter
+
+logger = logging.getLogger(__name__)
+
+MAX_CONCURRENCY = max(1, int(os.getenv("ASYNC_MAX_CONCURRENCY", "20")))
+
+
+def build_client(name: str = "async", max_connections: int = MAX_CONCURRENCY) -> httpx.AsyncClient:
+    """
+    Crea un cliente HTTP asíncrono. Debe usarse dentro del event loop que lo va a cerrar
+    (`async with build_client() as client: ...`).
+
+    Args:
+        name: Nombre del cliente en las métricas.
+        max_connections: Conexiones simultáneas máximas del pool.
+    """
+    async def _observe(response: httpx.Response):
+        metrics.HTTP_REQUESTS.inc(client=name, status=response.status_code)
+
+    return httpx.AsyncClient(
+        timeout=httpx.Timeout(http_client.READ_TIMEOUT, connect=http_client.CONNECT_TIMEOUT),
+        limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+        transport=httpx.AsyncHTTPTransport(retries=http_client.RETRIES),
+        event_hooks={"response": [_observe]}
+    )
+
+
+async def request(client: httpx.AsyncClient, platform: str, account: str, method: str, url: str,
+                  **kwargs) -> httpx.Response:
+    """
+    Realiza una petición respetando el limitador de la plataforma. Si la respuesta es un 429
+    (o un 503 con Retry-After), espera lo indicado y reintenta.
+
+    Para cuerpos en streaming (generadores asíncronos), que no se pueden enviar dos veces,
+    se pasa `content_factory`: una función que crea el cuerpo de nuevo en cada intento.
+
+    Raises:
+        RuntimeError: Si hay un error de red o timeout.
+        rate_limiter.RateLimitExceeded: Si no hay cupo de peticiones.
+    """
+    content_factory = kwargs.pop("content_factory", None)
+    response = None
+    for attempt in range(rate_limiter.MAX_THROTTLE_RETRIES + 1):
+        await rate_limiter.acquire_async(platform, account)
+        if content_factory is not None:
+            kwargs["content"] = content_factory()
+        try:
+            response = await client.request(method, url, **kwargs)
+        except httpx.HTTPError as e:
+            raise RuntimeError(f"Error de conexión con {platform} en {method} {url}: {e}") from e
+
+        wait = await asyncio.to_thread(rate_limiter.check_response, platform, account, response)
+        if wait is None:
+            break
+        logger.warning(f"{platform} respondió {response.status_code} (throttling). Intento {attempt + 1}.")
+    return response
+
+
+async def gather_limited(factories: Iterable[Callable[[], Awaitable]], limit: int = MAX_CONCURRENCY,
+                         return_exceptions: bool = True) -> List:
+    """
+    Ejecuta las corrutinas con como mucho `limit` en vuelo a la vez.
+
+    Args:
+        factories: Funciones sin argumentos que devuelven la corrutina a ejecutar
+                   (así las corrutinas solo se crean cuando hay hueco).
+        limit: Concurrencia máxima.
+        return_exceptions: Si es True, los errores se devuelven en su posición en lugar de propagarse.
+
+    Returns:
+        list: Resultados en el mismo orden que `factories`.
+    """
+    semaphore = asyncio.Semaphore(max(1, limit))
+
+    async def _run(factory):
+        async with semaphore:
+            return await factory()
+
+    return await asyncio.gather(*(_run(f) for f in factories), return_exceptions=return_exceptions)
+
+
+def run(coro: Awaitable, timeout: Optional[float] = None):
+    """Ejecuta una corrutina en un event loop nuevo desde código síncrono."""
+    if timeout:
+        coro = asyncio.wait_for(coro, timeout)
+    return asyncio.run(coro)
@@ -0,0 +1,86 @@
+"""
+Caché de adjuntos de correo ya codificados en base64, por hash de contenido.
+
+Cuando un correo se reparte en muchos mensajes (ver email_fanout.py), cada adjunto se lee
+y se codifica una sola vez y los mensajes siguientes reutilizan el resultado. La caché se
+limita en bytes (ATTACHMENT_CACHE_MB) y descarta primero lo usado hace más tiempo; los
+adjuntos que no caben en ella se codifican sin guardarse.
+"""
+
+import base64
+import os
+import threading
+from collections import OrderedDict
+from email.mime.base import MIMEBase
+
+from src.file_hash import file_sha256
+
+MAX_BYTES = int(float(os.getenv("ATTACHMENT_CACHE_MB", "64")) * 1024 * 1024)
+
+# (hash, forma) -> texto base64. La forma "mime" va partida en líneas de 76 caracteres,
+# como la genera email.encoders; la forma "raw" va en una sola línea (Microsoft Graph).
+_cache = OrderedDict()
+_size = 0
+_lock = threading.Lock()
+
+
+def _encode(data: bytes, form: str) -> str:
+    if form == "mime":
+        return base64.encodebytes(data).decode("ascii")
+    return base64.b64encode(data).decode("ascii")
+
+
+def get_base64(file_path: str, form: str = "raw") -> str:
+    """
+    Devuelve el contenido del fichero en base64, reutilizando la codificación de cualquier
+    fichero con el mismo contenido.
+
+    Args:
+        file_path: Ruta del adjunto.
+        form: "raw" (una sola línea) o "mime" (líneas de 76 caracteres).
+
+    Raises:
+        FileNotFoundError: Si el fichero no existe.
+    """
+    global _size
+    key = (file_sha256(file_path), form)
+
+    with _lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            return _cache[key]
+
+    with open(file_path, "rb") as f:
+        encoded = _encode(f.read(), form)
+
+    if len(encoded) <= MAX_BYTES:
+        with _lock:
+            if key not in _cache:
+                _cache[key] = encoded
+                _size += len(encoded)
+                while _size > MAX_BYTES:
+                    _, evicted = _cache.popitem(last=False)
+                    _size -= len(evicted)
+    return encoded
+
+
+def mime_attachment(file_path: str) -> MIMEBase:
+    """
+    Crea la parte MIME de un adjunto con el contenido ya codificado en base64.
+    Cada llamada devuelve una parte nueva (se puede adjuntar a otro mensaje), pero el
+    contenido codificado se comparte.
+    """
+    part = MIMEBase('application', 'octet-stream')
+    part.set_payload(get_base64(file_path, form="mime"))
+    part['Content-Transfer-Encoding'] = 'base64'
+    filename = os.path.basename(file_path)
+    part.add_header('Content-Disposition', f'attachment; filename="{filename}"')
+    return part
+
+
+def clear() -> None:
+    """Vacía la caché."""
+    global _size
+    with _lock:
+        _cache.clear()
+        _size = 0
@@ -3,7 +3,8 @@ import json
 import re
 from datetime import datetime
 from typing import List, Optional, Dict, Any, Set
-from sqlalchemy import create_engine, Column, Integer, String, Text, Table, ForeignKey, CheckConstraint
+from sqlalchemy import create_engine, Column, Integer, String, Text, Float, Table, ForeignKey, CheckConstraint, UniqueConstraint
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.orm import sessionmaker, relationship, declarative_base, joinedload
 from sqlalchemy.exc import IntegrityError
 import logging
@@ -24,7 +25,7 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 # Configuración de la base de datos
-DB_DIR = "data"
+DB_DIR = os.getenv("DB_DIR", "data")
 if not os.path.exists(DB_DIR):
     os.makedirs(DB_DIR)
 
@@ -127,6 +128,155 @@ MediaAsset.posts = relationship(
 )
 
 
+class RateLimitState(Base):
+    """
+    Estado persistente de un token bucket para limitar las llamadas a una plataforma.
+
+    Se guarda una fila por (plataforma, cuenta) para que la UI y el scheduler
+    compartan el mismo presupuesto de peticiones.
+
+    Attributes:
+        platform (str): Plataforma limitada (ej. "linkedin", "wordpress").
+        account (str): Identificador de la cuenta dentro de la plataforma.
+        tokens (float): Tokens disponibles en el momento de `updated_at`.
+        updated_at (float): Epoch (segundos) de la última recarga del bucket.
+        day (str): Día (YYYY-MM-DD) al que corresponde `day_count`.
+        day_count (int): Peticiones consumidas durante `day`.
+        blocked_until (float, optional): Epoch hasta el que la plataforma pidió esperar (Retry-After).
+    """
+    __tablename__ = "rate_limit_state"
+    id = Column(Integer, primary_key=True, index=True)
+    platform = Column(String, nullable=False)
+    account = Column(String, nullable=False)
+    tokens = Column(Float, nullable=False)
+    updated_at = Column(Float, nullable=False)
+    day = Column(String, nullable=True)
+    day_count = Column(Integer, nullable=False, default=0)
+    blocked_until = Column(Float, nullable=True)
+    __table_args__ = (UniqueConstraint('platform', 'account', name='uq_rate_limit_platform_account'),)
+
+
+class PublishStep(Base):
+    """
+    Paso remoto completado durante la publicación de un post (ledger de publicación).
+
+    Permite que un reintento continúe desde el primer paso pendiente en lugar de
+    volver a subir todos los medios.
+
+    Attributes:
+        post_id (int): Post al que pertenece el paso.
+        step_key (str): Identificador del paso (ej. "wordpress_media:<ruta>", "linkedin_post").
+        result (str): Resultado remoto del paso en formato JSON (id de medio, URN, URL...).
+        created_at (str): Timestamp de cuando se completó el paso.
+    """
+    __tablename__ = "publish_steps"
+    id = Column(Integer, primary_key=True, index=True)
+    post_id = Column(Integer, ForeignKey('posts.id'), nullable=False, index=True)
+    step_key = Column(String, nullable=False)
+    result = Column(Text, nullable=True)
+    created_at = Column(String, nullable=False, default=lambda: datetime.now().isoformat())
+    __table_args__ = (UniqueConstraint('post_id', 'step_key', name='uq_publish_step'),)
+
+
+class PublishJob(Base):
+    """
+    Trabajo de publicación encolado (p. ej. desde el botón "Publicar ahora") para los workers del scheduler.
+
+    Attributes:
+        post_id (int): Post a publicar.
+        priority (int): Prioridad del trabajo; los valores más altos se atienden antes.
+        status (str): 'queued', 'running', 'done' o 'failed'.
+        progress (str, optional): Último mensaje de progreso para mostrar en la UI.
+        error (str, optional): Mensaje de error si el trabajo falló.
+    """
+    __tablename__ = "publish_jobs"
+    id = Column(Integer, primary_key=True, index=True)
+    post_id = Column(Integer, ForeignKey('posts.id'), nullable=False, index=True)
+    priority = Column(Integer, nullable=False, default=0)
+    status = Column(String, nullable=False, default='queued', index=True)
+    progress = Column(Text, nullable=True)
+    error = Column(Text, nullable=True)
+    created_at = Column(String, nullable=False, default=lambda: datetime.now().isoformat())
+    updated_at = Column(String, nullable=False, default=lambda: datetime.now().isoformat())
+
+
+class WordPressMedia(Base):
+    """
+    Medio ya subido a un sitio de WordPress, identificado por el hash de su contenido.
+    Permite reutilizarlo en lugar de volver a subir el mismo fichero.
+
+    Attributes:
+        site (str): URL del sitio de WordPress.
+        content_hash (str): SHA-256 del contenido del fichero.
+        media_id (int): ID del medio en WordPress.
+        source_url (str): URL pública del medio.
+        verified_at (float): Epoch de la última comprobación de que el medio sigue existiendo.
+    """
+    __tablename__ = "wordpress_media"
+    id = Column(Integer, primary_key=True, index=True)
+    site = Column(String, nullable=False)
+    content_hash = Column(String, nullable=False)
+    media_id = Column(Integer, nullable=False)
+    source_url = Column(String, nullable=True)
+    verified_at = Column(Float, nullable=False)
+    created_at = Column(String, nullable=False, default=lambda: datetime.now().isoformat())
+    __table_args__ = (UniqueConstraint('site', 'content_hash', name='uq_wordpress_media'),)
+
+
+class EmailOutbox(Base):
+    """
+    Bloque de destinatarios pendiente de envío de un post de correo (outbox).
+
+    Cada post de correo se reparte en bloques de destinatarios (ver email_fanout.py); cada
+    bloque tiene su propio estado, de modo que un envío grande se puede reanudar tras una
+    caída y los reintentos solo afectan a los destinatarios aún no entregados.
+
+    Attributes:
+        post_id (int): Post al que pertenece el bloque.
+        chunk_key (str): Identificador del bloque (depende solo de sus destinatarios).
+        recipients (str): Lista JSON de destinatarios del bloque.
+        status (str): 'queued', 'sending', 'sent' o 'failed'.
+        attempts (int): Intentos de envío realizados.
+        next_attempt_at (float): Epoch a partir del que se puede (re)intentar el envío.
+        error (str, optional): Último error del envío.
+    """
+    __tablename__ = "email_outbox"
+    id = Column(Integer, primary_key=True, index=True)
+    post_id = Column(Integer, ForeignKey('posts.id'), nullable=False, index=True)
+    chunk_key = Column(String, nullable=False)
+    recipients = Column(Text, nullable=False)
+    status = Column(String, nullable=False, default='queued', index=True)
+    attempts = Column(Integer, nullable=False, default=0)
+    next_attempt_at = Column(Float, nullable=False, default=0.0)
+    error = Column(Text, nullable=True)
+    created_at = Column(String, nullable=False, default=lambda: datetime.now().isoformat())
+    updated_at = Column(String, nullable=False, default=lambda: datetime.now().isoformat())
+    __table_args__ = (UniqueConstraint('post_id', 'chunk_key', name='uq_email_outbox_chunk'),)
+
+
+class MediaDerivative(Base):
+    """
+    Derivado de un activo multimedia adaptado a una plataforma (p. ej. el vídeo transcodificado
+    para Instagram y su miniatura). Permite reutilizarlo en lugar de volver a generarlo.
+
+    Attributes:
+        asset_id (int): MediaAsset original.
+        profile (str): Perfil de destino, con el hash de sus parámetros (ver media_derivatives.py).
+        content_hash (str): SHA-256 del contenido original.
+        file_path (str): Ruta del derivado.
+        thumbnail_path (str, optional): Ruta de la miniatura del derivado.
+    """
+    __tablename__ = "media_derivatives"
+    id = Column(Integer, primary_key=True, index=True)
+    asset_id = Column(Integer, ForeignKey('media_assets.id'), nullable=False, index=True)
+    profile = Column(String, nullable=False)
+    content_hash = Column(String, nullable=False)
+    file_path = Column(String, nullable=False)
+    thumbnail_path = Column(String, nullable=True)
+    created_at = Column(String, nullable=False, default=lambda: datetime.now().isoformat())
+    __table_args__ = (UniqueConstraint('asset_id', 'profile', name='uq_media_derivative'),)
+
+
 def init_db():
     """
     Inicializa la base de datos creando todas las tablas.
@@ -513,12 +663,16 @@ def delete_post(post_id: int) -> bool:
         if not post: return False
 
         assets_to_check = list(post.media_assets)
+        session.query(PublishStep).filter(PublishStep.post_id == post_id).delete()
+        session.query(PublishJob).filter(PublishJob.post_id == post_id).delete()
+        session.query(EmailOutbox).filter(EmailOutbox.post_id == post_id).delete()
         session.delete(post)
         session.commit()
 
         for asset in assets_to_check:
             asset_in_db = session.query(MediaAsset).filter(MediaAsset.id == asset.id).first()
             if asset_in_db and not asset_in_db.posts:
+                session.query(MediaDerivative).filter(MediaDerivative.asset_id == asset.id).delete()
                 session.delete(asset_in_db)
                 logger.info(f"Registro de MediaAsset eliminado: ID {asset.id}")
 
@@ -621,7 +775,8 @@ def delete_media_asset(asset_id: int) -> bool:
                 logger.warning(f"Se intentó eliminar el MediaAsset con ID {asset_id}, pero no se encontró.")
                 return False
 
-            # Eliminar el registro de la base de datos
+            # Eliminar el registro de la base de datos (y sus derivados)
+            session.query(MediaDerivative).filter(MediaDerivative.asset_id == asset_id).delete()
             session.delete(asset)
             # El commit se gestiona automáticamente por el context manager get_db_session
 
@@ -716,6 +871,359 @@ def get_sent_posts_by_platform(platform: str) -> List[Dict[str, Any]]:
         return [model_to_dict(post) for post in posts]
 
 
+# --- Funciones del ledger de publicación ---
+def get_publish_steps(post_id: int) -> Dict[str, Any]:
+    """
+    Obtiene los pasos de publicación ya completados de un post.
+
+    Returns:
+        Dict[str, Any]: Diccionario {step_key: resultado deserializado}.
+    """
+    with get_db_session() as session:
+        steps = session.query(PublishStep).filter(PublishStep.post_id == post_id).all()
+        return {step.step_key: json.loads(step.result) if step.result else None for step in steps}
+
+
+def record_publish_step(post_id: int, step_key: str, result: Any) -> None:
+    """
+    Registra (o actualiza) el resultado remoto de un paso de publicación completado.
+    """
+    with get_db_session() as session:
+        step = session.query(PublishStep).filter_by(post_id=post_id, step_key=step_key).first()
+        if step is None:
+            step = PublishStep(post_id=post_id, step_key=step_key)
+            session.add(step)
+        step.result = json.dumps(result)
+        step.created_at = datetime.now().isoformat()
+
+
+def delete_publish_steps(post_id: int, step_keys: List[str]) -> None:
+    """
+    Elimina pasos concretos del ledger de un post (p. ej. un registro de subida caducado).
+    """
+    if not step_keys:
+        return
+    with get_db_session() as session:
+        session.query(PublishStep).filter(
+            PublishStep.post_id == post_id, PublishStep.step_key.in_(step_keys)
+        ).delete(synchronize_session=False)
+
+
+def clear_publish_steps(post_id: int) -> None:
+    """
+    Elimina el ledger de un post, normalmente tras una publicación completada.
+    """
+    with get_db_session() as session:
+        session.query(PublishStep).filter(PublishStep.post_id == post_id).delete()
+
+
+# --- Funciones de la cola de trabajos de publicación ---
+def enqueue_publish_job(post_id: int, priority: int = 10) -> int:
+    """
+    Encola un trabajo de publicación. Si el post ya tiene un trabajo pendiente o en curso, lo reutiliza.
+
+    Returns:
+        int: ID del trabajo.
+    """
+    with get_db_session() as session:
+        job = session.query(PublishJob).filter(
+            PublishJob.post_id == post_id,
+            PublishJob.status.in_(['queued', 'running'])
+        ).first()
+        if job:
+            return job.id
+
+        job = PublishJob(post_id=post_id, priority=priority, status='queued', progress="En cola")
+        session.add(job)
+        session.flush()
+        return job.id
+
+
+def claim_next_publish_job() -> Optional[Dict[str, Any]]:
+    """
+    Reserva el siguiente trabajo en cola (mayor prioridad y más antiguo primero) y lo marca como 'running'.
+
+    Returns:
+        Optional[Dict[str, Any]]: Datos del trabajo reservado, o None si no hay ninguno.
+    """
+    with get_db_session() as session:
+        candidates = session.query(PublishJob.id).filter(PublishJob.status == 'queued').order_by(
+            PublishJob.priority.desc(), PublishJob.created_at.asc()
+        ).limit(5).all()
+
+        for (job_id,) in candidates:
+            # Actualización condicional: solo un worker puede pasar el trabajo de 'queued' a 'running'
+            claimed = session.query(PublishJob).filter(
+                PublishJob.id == job_id, PublishJob.status == 'queued'
+            ).update({"status": 'running', "updated_at": datetime.now().isoformat()}, synchronize_session=False)
+            if claimed:
+                job = session.query(PublishJob).filter(PublishJob.id == job_id).first()
+                return model_to_dict(job)
+        return None
+
+
+def update_publish_job(job_id: int, **kwargs) -> bool:
+    """
+    Actualiza los campos de un trabajo de publicación (status, progress, error).
+    """
+    with get_db_session() as session:
+        job = session.query(PublishJob).filter(PublishJob.id == job_id).first()
+        if not job:
+            return False
+        for key, value in kwargs.items():
+            if hasattr(job, key):
+                setattr(job, key, value)
+        job.updated_at = datetime.now().isoformat()
+        return True
+
+
+def get_latest_publish_jobs(post_ids: List[int]) -> Dict[int, Dict[str, Any]]:
+    """
+    Obtiene el trabajo de publicación más reciente de cada post indicado.
+
+    Returns:
+        Dict[int, Dict[str, Any]]: Diccionario {post_id: datos del trabajo}.
+    """
+    if not post_ids:
+        return {}
+    with get_db_session() as session:
+        jobs = session.query(PublishJob).filter(PublishJob.post_id.in_(post_ids)).order_by(PublishJob.id.asc()).all()
+        return {job.post_id: model_to_dict(job) for job in jobs}
+
+
+def requeue_running_publish_jobs() -> int:
+    """
+    Devuelve a la cola los trabajos que quedaron 'running' (p. ej. tras reiniciar el scheduler).
+
+    Returns:
+        int: Número de trabajos reencolados.
+    """
+    with get_db_session() as session:
+        return session.query(PublishJob).filter(PublishJob.status == 'running').update(
+            {"status": 'queued', "updated_at": datetime.now().isoformat()}, synchronize_session=False
+        )
+
+
+# --- Funciones de la caché de medios de WordPress ---
+def get_wordpress_media(site: str, content_hash: str) -> Optional[Dict[str, Any]]:
+    """
+    Busca un medio ya subido a un sitio de WordPress por el hash de su contenido.
+    """
+    with get_db_session() as session:
+        media = session.query(WordPressMedia).filter_by(site=site, content_hash=content_hash).first()
+        return model_to_dict(media) if media else None
+
+
+def save_wordpress_media(site: str, content_hash: str, media_id: int, source_url: Optional[str]) -> None:
+    """
+    Guarda (o actualiza) el medio de WordPress correspondiente a un contenido.
+    Es un upsert: dos subidas simultáneas del mismo fichero no chocan con la restricción única.
+    """
+    values = {"media_id": media_id, "source_url": source_url, "verified_at": datetime.now().timestamp()}
+    statement = sqlite_insert(WordPressMedia).values(site=site, content_hash=content_hash, **values)
+    with get_db_session() as session:
+        session.execute(statement.on_conflict_do_update(index_elements=['site', 'content_hash'], set_=values))
+
+
+def mark_wordpress_media_verified(site: str, content_hash: str) -> None:
+    """
+    Actualiza la fecha de la última comprobación de un medio de WordPress.
+    """
+    with get_db_session() as session:
+        session.query(WordPressMedia).filter_by(site=site, content_hash=content_hash).update(
+            {"verified_at": datetime.now().timestamp()}, synchronize_session=False
+        )
+
+
+def delete_wordpress_media(site: str, content_hash: str) -> None:
+    """
+    Olvida un medio de WordPress (p. ej. porque se borró de la biblioteca del sitio).
+    """
+    with get_db_session() as session:
+        session.query(WordPressMedia).filter_by(site=site, content_hash=content_hash).delete()
+
+
+# --- Funciones de los derivados de medios ---
+def get_media_derivative(asset_id: int, profile: str) -> Optional[Dict[str, Any]]:
+    """
+    Busca el derivado de un activo para un perfil.
+    """
+    with get_db_session() as session:
+        derivative = session.query(MediaDerivative).filter_by(asset_id=asset_id, profile=profile).first()
+        return model_to_dict(derivative) if derivative else None
+
+
+def save_media_derivative(asset_id: int, profile: str, content_hash: str, file_path: str,
+                          thumbnail_path: Optional[str] = None) -> None:
+    """
+    Guarda (o actualiza) el derivado de un activo para un perfil.
+    """
+    with get_db_session() as session:
+        derivative = session.query(MediaDerivative).filter_by(asset_id=asset_id, profile=profile).first()
+        if derivative is None:
+            derivative = MediaDerivative(asset_id=asset_id, profile=profile)
+            session.add(derivative)
+        derivative.content_hash = content_hash
+        derivative.file_path = file_path
+        derivative.thumbnail_path = thumbnail_path
+        derivative.created_at = datetime.now().isoformat()
+
+
+def delete_media_derivatives_by_paths(file_paths: List[str]) -> int:
+    """
+    Elimina los derivados cuyo fichero o miniatura está entre las rutas indicadas
+    (p. ej. porque se borraron del disco al limpiar el directorio de derivados).
+
+    Returns:
+        int: Número de derivados eliminados.
+    """
+    if not file_paths:
+        return 0
+    with get_db_session() as session:
+        return session.query(MediaDerivative).filter(
+            MediaDerivative.file_path.in_(file_paths) | MediaDerivative.thumbnail_path.in_(file_paths)
+        ).delete(synchronize_session=False)
+
+
+# --- Funciones del outbox de correo ---
+def enqueue_email_chunks(post_id: int, chunks: List[tuple]) -> int:
+    """
+    Añade al outbox los bloques de destinatarios de un post que aún no estén en él.
+    Los bloques ya existentes (enviados, pendientes o fallidos) no se modifican.
+
+    Args:
+        post_id: Post de correo.
+        chunks: Lista de tuplas (chunk_key, lista de destinatarios).
+
+    Returns:
+        int: Número de bloques nuevos.
+    """
+    with get_db_session() as session:
+        existing = {key for (key,) in session.query(EmailOutbox.chunk_key).filter(EmailOutbox.post_id == post_id)}
+        added = 0
+        for chunk_key, recipients in chunks:
+            if chunk_key not in existing:
+                session.add(EmailOutbox(post_id=post_id, chunk_key=chunk_key, recipients=json.dumps(recipients),
+                                        status='queued', next_attempt_at=0.0))
+                existing.add(chunk_key)
+                added += 1
+        return added
+
+
+def get_email_outbox_recipients(post_id: int) -> Set[str]:
+    """
+    Devuelve los destinatarios (en minúsculas) que ya tienen un bloque en el outbox del post,
+    sea cual sea su estado.
+    """
+    with get_db_session() as session:
+        rows = session.query(EmailOutbox.recipients).filter(EmailOutbox.post_id == post_id).all()
+        return {address.lower() for (recipients,) in rows for address in json.loads(recipients)}
+
+
+def clear_email_outbox(post_id: int) -> None:
+    """
+    Elimina el outbox de un post (p. ej. para volver a enviar un correo ya enviado).
+    """
+    with get_db_session() as session:
+        session.query(EmailOutbox).filter(EmailOutbox.post_id == post_id).delete()
+
+
+def claim_email_chunks(post_id: Optional[int] = None, limit: int = 100) -> List[Dict[str, Any]]:
+    """
+    Reserva los bloques en cola cuyo próximo intento ya ha vencido y los marca como 'sending'.
+
+    Args:
+        post_id: Si se indica, solo se reservan bloques de ese post.
+        limit: Número máximo de bloques a reservar.
+
+    Returns:
+        List[Dict[str, Any]]: Bloques reservados (con `recipients` ya deserializado).
+    """
+    now = datetime.now().timestamp()
+    with get_db_session() as session:
+        query = session.query(EmailOutbox.id).filter(EmailOutbox.status == 'queued',
+                                                     EmailOutbox.next_attempt_at <= now)
+        if post_id is not None:
+            query = query.filter(EmailOutbox.post_id == post_id)
+        candidates = query.order_by(EmailOutbox.post_id.asc(), EmailOutbox.id.asc()).limit(limit).all()
+
+        claimed = []
+        for (chunk_id,) in candidates:
+            # Actualización condicional: solo un worker puede pasar el bloque de 'queued' a 'sending'
+            updated = session.query(EmailOutbox).filter(
+                EmailOutbox.id == chunk_id, EmailOutbox.status == 'queued'
+            ).update({"status": 'sending', "updated_at": datetime.now().isoformat()}, synchronize_session=False)
+            if updated:
+                claimed.append(chunk_id)
+
+        chunks = session.query(EmailOutbox).filter(EmailOutbox.id.in_(claimed)).order_by(EmailOutbox.id.asc()).all()
+        return [dict(model_to_dict(chunk), recipients=json.loads(chunk.recipients)) for chunk in chunks]
+
+
+def update_email_chunk(chunk_id: int, **kwargs) -> bool:
+    """
+    Actualiza los campos de un bloque del outbox (status, attempts, next_attempt_at, error).
+    """
+    with get_db_session() as session:
+        chunk = session.query(EmailOutbox).filter(EmailOutbox.id == chunk_id).first()
+        if not chunk:
+            return False
+        for key, value in kwargs.items():
+            if hasattr(chunk, key):
+                setattr(chunk, key, value)
+        chunk.updated_at = datetime.now().isoformat()
+        return True
+
+
+def get_email_outbox_summary(post_ids: List[int]) -> Dict[int, Dict[str, int]]:
+    """
+    Cuenta los destinatarios de cada post del outbox por estado.
+
+    Returns:
+        Dict[int, Dict[str, int]]: {post_id: {'queued': n, 'sending': n, 'sent': n, 'failed': n, 'total': n}}.
+    """
+    if not post_ids:
+        return {}
+    with get_db_session() as session:
+        rows = session.query(EmailOutbox.post_id, EmailOutbox.status, EmailOutbox.recipients).filter(
+            EmailOutbox.post_id.in_(post_ids)
+        ).all()
+
+    summary = {}
+    for post_id, status, recipients in rows:
+        counts = summary.setdefault(post_id, {'queued': 0, 'sending': 0, 'sent': 0, 'failed': 0, 'total': 0})
+        count = len(json.loads(recipients))
+        counts[status] = counts.get(status, 0) + count
+        counts['total'] += count
+    return summary
+
+
+def retry_failed_email_chunks(post_id: int) -> int:
+    """
+    Devuelve a la cola los bloques de un post que agotaron sus intentos.
+
+    Returns:
+        int: Número de bloques reencolados.
+    """
+    with get_db_session() as session:
+        return session.query(EmailOutbox).filter(
+            EmailOutbox.post_id == post_id, EmailOutbox.status == 'failed'
+        ).update({"status": 'queued', "attempts": 0, "next_attempt_at": 0.0,
+                  "updated_at": datetime.now().isoformat()}, synchronize_session=False)
+
+
+def requeue_sending_email_chunks() -> int:
+    """
+    Devuelve a la cola los bloques que quedaron 'sending' (p. ej. tras una caída del scheduler).
+
+    Returns:
+        int: Número de bloques reencolados.
+    """
+    with get_db_session() as session:
+        return session.query(EmailOutbox).filter(EmailOutbox.status == 'sending').update(
+            {"status": 'queued', "updated_at": datetime.now().isoformat()}, synchronize_session=False
+        )
+
 
 if __name__ == '__main__':
     # Ejecuta esta línea una vez para crear la base de datos y las tablas
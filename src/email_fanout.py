@@ -0,0 +1,187 @@
+"""
+Reparto (fan-out) de un correo entre muchos destinatarios.
+
+En lugar de un único mensaje con todos los destinatarios en el `To`, los destinatarios se
+dividen en bloques que se envían en paralelo:
+- Con EMAIL_CHUNK_SIZE=1 cada destinatario recibe su propio mensaje.
+- Con bloques mayores, los destinatarios van solo en copia oculta (CCO), sin `To`, de modo
+  que nadie ve las direcciones de los demás y el remitente no recibe una copia por bloque.
+
+El tamaño de bloque se acota al máximo de destinatarios por mensaje del proveedor. El
+resultado de cada bloque se notifica en cuanto se conoce, y el outbox del post lo guarda
+(ver email_outbox.py), así que un reintento solo reenvía los bloques que fallaron. Con
+Microsoft Graph, los mensajes de los bloques se agrupan en llamadas $batch (ver
+`graph_mail.send_mail_graph_batch`).
+"""
+
+import os
+import hashlib
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = max(1, int(os.getenv("EMAIL_CHUNK_SIZE", "50")))
+FANOUT_CONCURRENCY = max(1, int(os.getenv("EMAIL_FANOUT_CONCURRENCY", "4")))
+
+# Destinatarios máximos por mensaje de cada proveedor (Graph admite 500; los servidores
+# SMTP suelen rechazar más de 100 RCPT TO por mensaje).
+MAX_RECIPIENTS = {
+    "graph": int(os.getenv("GRAPH_MAX_RECIPIENTS", "500")),
+    "smtp": int(os.getenv("SMTP_MAX_RECIPIENTS", "100")),
+}
+
+# Recibe (índice del bloque, enviado) en cuanto se conoce el resultado de cada bloque
+ResultCallback = Optional[Callable[[int, bool], None]]
+
+
+def chunk_recipients(receivers: List[str], size: int) -> List[List[str]]:
+    """
+    Divide los destinatarios en bloques de como mucho `size`, eliminando vacíos y
+    duplicados (sin distinguir mayúsculas) y conservando el orden.
+    """
+    unique = []
+    seen = set()
+    for receiver in receivers:
+        address = (receiver or "").strip()
+        if address and address.lower() not in seen:
+            seen.add(address.lower())
+            unique.append(address)
+
+    size = max(1, size)
+    return [unique[i:i + size] for i in range(0, len(unique), size)]
+
+
+def chunk_key(chunk: List[str]) -> str:
+    """Clave de un bloque en el outbox: depende solo de sus destinatarios, no de su posición."""
+    digest = hashlib.sha1(",".join(sorted(a.lower() for a in chunk)).encode("utf-8")).hexdigest()
+    return f"email_chunk:{digest[:16]}"
+
+
+def envelope(chunk: List[str]) -> dict:
+    """
+    Destinatarios visibles y ocultos de un bloque: un único destinatario va en el `To`;
+    varios van solo en CCO (por SMTP, con la cabecera "To: undisclosed-recipients:;").
+    """
+    if len(chunk) == 1:
+        return {"receivers": chunk, "bcc": None}
+    return {"receivers": [], "bcc": chunk}
+
+
+def _transport():
+    """
+    Devuelve (nombre, función de envío por lotes, correos por lote) del proveedor
+    configurado. Con Graph, cada lote es una llamada $batch; con SMTP, cada correo va solo
+    y el paralelismo lo dan las sesiones del pool.
+    """
+    from src.graph_mail import BATCH_SIZE, get_graph_config, send_mail_graph_batch
+    from src.email_sender import get_smtp_config, send_mail
+
+    if get_graph_config():
+        return "graph", send_mail_graph_batch, BATCH_SIZE
+    if not get_smtp_config():
+        raise RuntimeError("No hay ningún proveedor de correo configurado (Microsoft Graph o SMTP).")
+    return "smtp", lambda messages: [send_mail(**m) for m in messages], 1
+
+
+def transport_configured() -> bool:
+    """Indica si hay algún proveedor de correo configurado (Microsoft Graph o SMTP)."""
+    from src.graph_mail import get_graph_config
+    from src.email_sender import get_smtp_config
+
+    return bool(get_graph_config() or get_smtp_config())
+
+
+def max_chunk_size(chunk_size: int = CHUNK_SIZE) -> int:
+    """Tamaño de bloque efectivo: el configurado, acotado al máximo del proveedor en uso."""
+    from src.graph_mail import get_graph_config
+
+    return min(chunk_size, MAX_RECIPIENTS["graph" if get_graph_config() else "smtp"])
+
+
+def send_chunks(
+    chunks: List[List[str]],
+    subject: str,
+    content_text: str,
+    content_html: Optional[str] = None,
+    attachments: Optional[List[str]] = None,
+    on_result: ResultCallback = None,
+    concurrency: int = FANOUT_CONCURRENCY
+) -> List[bool]:
+    """
+    Envía un mensaje por bloque de destinatarios, con `concurrency` lotes en paralelo.
+
+    Args:
+        chunks: Bloques de destinatarios (ver `chunk_recipients`)
+        subject: Asunto del correo
+        content_text: Contenido en texto plano
+        content_html: Contenido en HTML (opcional)
+        attachments: Lista de rutas a archivos adjuntos (opcional)
+        on_result: Función opcional que recibe (índice del bloque, enviado) en cuanto se conoce
+                   el resultado de cada bloque; se llama siempre desde el hilo que envía
+        concurrency: Lotes enviados a la vez
+
+    Returns:
+        list: Un booleano por bloque, en el mismo orden.
+    """
+    _, send_batch, batch_size = _transport()
+    results = [False] * len(chunks)
+
+    def _message(chunk: List[str]) -> dict:
+        return dict(subject=subject, content_text=content_text, content_html=content_html,
+                    attachments=attachments, **envelope(chunk))
+
+    groups = [list(range(i, min(i + batch_size, len(chunks)))) for i in range(0, len(chunks), batch_size)]
+    with ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(groups) or 1))) as pool:
+        futures = {pool.submit(send_batch, [_message(chunks[i]) for i in group]): group for group in groups}
+        for future in as_completed(futures):
+            group = futures[future]
+            try:
+                outcomes = future.result()
+            except Exception as e:
+                logger.error(f"Error enviando {len(group)} bloques del correo: {e}")
+                outcomes = [False] * len(group)
+            for index, ok in zip(group, outcomes):
+                results[index] = bool(ok)
+                if on_result:
+                    on_result(index, bool(ok))
+    return results
+
+
+async def send_chunks_async(
+    client,
+    chunks: List[List[str]],
+    subject: str,
+    content_text: str,
+    content_html: Optional[str] = None,
+    attachments: Optional[List[str]] = None,
+    on_result: ResultCallback = None,
+    concurrency: int = FANOUT_CONCURRENCY
+) -> List[bool]:
+    """
+    Versión asíncrona de `send_chunks` para Microsoft Graph sobre un httpx.AsyncClient
+    (ver src/async_http.py). Requiere que Graph esté configurado.
+    """
+    from src import async_http
+    from src.graph_mail import BATCH_SIZE, send_mail_graph_batch_async
+
+    results = [False] * len(chunks)
+
+    async def _send_group(group: List[int]):
+        messages = [dict(subject=subject, content_text=content_text, content_html=content_html,
+                         attachments=attachments, **envelope(chunks[i])) for i in group]
+        try:
+            outcomes = await send_mail_graph_batch_async(client, messages)
+        except Exception as e:
+            logger.error(f"Error enviando {len(group)} bloques del correo: {e}")
+            outcomes = [False] * len(group)
+        for index, ok in zip(group, outcomes):
+            results[index] = bool(ok)
+            if on_result:
+                on_result(index, bool(ok))
+
+    groups = [list(range(i, min(i + BATCH_SIZE, len(chunks)))) for i in range(0, len(chunks), BATCH_SIZE)]
+    await async_http.gather_limited([lambda g=group: _send_group(g) for group in groups], limit=concurrency)
+    return results
+
@@ -0,0 +1,267 @@
+"""
+Outbox persistente de los correos de los posts (tabla `email_outbox`).
+
+Publicar un post de correo ya no es una única llamada que envía o falla entera:
+1. `enqueue_post()` reparte los destinatarios en bloques (ver email_fanout.py) y guarda una
+   fila por bloque en estado 'queued'. Los destinatarios que ya tienen bloque no se repiten.
+2. `drain_post()` (o `drain()` para todos los posts, desde el worker del scheduler) reserva
+   los bloques vencidos, los envía en paralelo y guarda el resultado de cada uno en cuanto
+   se conoce: 'sent', o de vuelta a 'queued' con espera exponencial hasta agotar
+   EMAIL_OUTBOX_MAX_ATTEMPTS intentos ('failed').
+3. El envío termina cuando no quedan bloques en cola ni enviándose. Si se entregó al menos
+   a parte de los destinatarios, el post se da por enviado (entrega parcial); los bloques
+   fallidos se reintentan con "Reintentar fallidos" o en el siguiente "Publicar ahora".
+
+Así, tras una caída el envío continúa por los bloques pendientes y los reintentos solo
+afectan a los destinatarios aún no entregados.
+"""
+
+import os
+import asyncio
+import logging
+from datetime import datetime
+from typing import Callable, Dict, Optional
+
+from src.db_config import (enqueue_email_chunks, claim_email_chunks, update_email_chunk, get_email_outbox_summary,
+                           get_email_outbox_recipients, clear_email_outbox, retry_failed_email_chunks,
+                           get_post_by_id, update_post)
+from src.email_fanout import (FANOUT_CONCURRENCY, chunk_key, chunk_recipients, max_chunk_size, send_chunks,
+                              send_chunks_async, transport_configured)
+
+logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = max(1, int(os.getenv("EMAIL_OUTBOX_MAX_ATTEMPTS", "5")))
+BACKOFF_SECONDS = float(os.getenv("EMAIL_OUTBOX_BACKOFF_SECONDS", "60"))
+BACKOFF_MAX_SECONDS = float(os.getenv("EMAIL_OUTBOX_BACKOFF_MAX_SECONDS", "3600"))
+# Bloques que se reservan en cada pasada
+CLAIM_LIMIT = max(1, int(os.getenv("EMAIL_OUTBOX_CLAIM_LIMIT", "200")))
+
+ProgressCallback = Optional[Callable[[str], None]]
+
+
+def enqueue_post(post: dict) -> int:
+    """
+    Prepara el outbox para un intento de envío del post:
+    - Si quedan bloques en cola o enviándose, el envío anterior sigue en curso y continúa.
+    - Si el envío anterior terminó y se entregó a todos, se empieza un envío nuevo.
+    - Si terminó con bloques fallidos, esos bloques vuelven a la cola; los destinatarios
+      que ya lo recibieron no lo reciben de nuevo.
+    En todos los casos se añaden los destinatarios del post que aún no tienen bloque.
+
+    Returns:
+        int: Número de bloques nuevos.
+    """
+    post_id = post['id']
+    summary = _summary(post_id)
+    if summary['total'] and not _pending(summary):
+        if summary['failed']:
+            requeued = retry_failed_email_chunks(post_id)
+            logger.info(f"Outbox del post {post_id}: {requeued} bloques fallidos devueltos a la cola.")
+        else:
+            logger.info(f"El correo del post {post_id} ya se había enviado. Se envía de nuevo.")
+            clear_email_outbox(post_id)
+
+    existing = get_email_outbox_recipients(post_id)
+    receivers = [r for r in post.get('contacts', []) if (r or '').strip().lower() not in existing]
+    chunks = chunk_recipients(receivers, max_chunk_size())
+    added = enqueue_email_chunks(post_id, [(chunk_key(chunk), chunk) for chunk in chunks])
+    if added:
+        logger.info(f"Outbox del post {post_id}: {added} bloques nuevos ({len(receivers)} destinatarios).")
+    return added
+
+
+def drain_post(post: dict, progress: ProgressCallback = None, concurrency: int = FANOUT_CONCURRENCY) -> Dict[str, int]:
+    """
+    Envía los bloques del post cuyo próximo intento ya ha vencido.
+
+    Returns:
+        Dict[str, int]: Destinatarios del post por estado (ver `db_config.get_email_outbox_summary`).
+    """
+    if not transport_configured():
+        logger.error(f"No se puede enviar el correo del post {post['id']}: no hay proveedor de correo configurado.")
+        return _summary(post['id'])
+
+    while True:
+        claimed = claim_email_chunks(post['id'], CLAIM_LIMIT)
+        if not claimed:
+            break
+        sent = _send(post, claimed, concurrency)
+        _report(post['id'], progress)
+        if not sent:
+            break
+    return _summary(post['id'])
+
+
+async def drain_post_async(client, post: dict, progress: ProgressCallback = None,
+                           concurrency: int = FANOUT_CONCURRENCY) -> Dict[str, int]:
+    """
+    Versión asíncrona de `drain_post` para Microsoft Graph sobre un httpx.AsyncClient.
+    Las operaciones sobre la BD se hacen en un hilo aparte.
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        claimed = await asyncio.to_thread(claim_email_chunks, post['id'], CLAIM_LIMIT)
+        if not claimed:
+            break
+        reported = set()
+        records = []
+
+        def _on_result(index: int, ok: bool, claimed=claimed) -> None:
+            # Se guarda en cuanto se conoce, pero en el executor por defecto y no en el bucle
+            reported.add(index)
+            records.append(loop.run_in_executor(None, _record, claimed[index], ok))
+
+        try:
+            message_args = await asyncio.to_thread(_message_args, post)
+            await send_chunks_async(client, [chunk['recipients'] for chunk in claimed], **message_args,
+                                    on_result=_on_result, concurrency=concurrency)
+        except Exception as e:
+            logger.error(f"Error enviando el correo del post {post['id']}: {e}")
+            await asyncio.gather(*records, return_exceptions=True)
+            await asyncio.to_thread(_requeue, claimed, reported)
+            break
+        await asyncio.gather(*records)
+        await asyncio.to_thread(_report, post['id'], progress)
+    return await asyncio.to_thread(_summary, post['id'])
+
+
+def drain(concurrency: int = FANOUT_CONCURRENCY) -> int:
+    """
+    Una pasada del worker del outbox: envía los bloques vencidos de cualquier post. Cuando
+    termina el envío de un post programado, lo marca como enviado (ver `_finish`).
+
+    Returns:
+        int: Número de bloques enviados (con éxito o no) en la pasada.
+    """
+    from src.publisher import reservar_post, liberar_post
+
+    if not transport_configured():
+        return 0
+
+    claimed = claim_email_chunks(limit=CLAIM_LIMIT)
+    by_post = {}
+    for chunk in claimed:
+        by_post.setdefault(chunk['post_id'], []).append(chunk)
+
+    processed = 0
+    for post_id, chunks in by_post.items():
+        # Si el ciclo o un trabajo está publicando el post, sus bloques los envía él
+        if not reservar_post(post_id):
+            _requeue(chunks, set())
+            continue
+        try:
+            post = get_post_by_id(post_id)
+            if not post:
+                for chunk in chunks:
+                    update_email_chunk(chunk['id'], status='failed', error="El post ya no existe.")
+                continue
+            logger.info(f"Outbox: enviando {len(chunks)} bloques pendientes del post {post_id}.")
+            if _send(post, chunks, concurrency):
+                processed += len(chunks)
+                _finish(post)
+        finally:
+            liberar_post(post_id)
+    return processed
+
+
+def _finish(post: dict) -> None:
+    """
+    Cierra el envío de un post programado cuando ya no le quedan bloques pendientes: si se
+    entregó al menos a parte de los destinatarios, el post se marca como enviado para que el
+    scheduler no lo repita. Los bloques fallidos se pueden reintentar desde la UI.
+    """
+    summary = _summary(post['id'])
+    if _pending(summary) or not summary['sent'] or not post.get('fecha_hora') or post.get('sent_at'):
+        return
+
+    from src.publish_ledger import PublishLedger
+
+    update_post(post['id'], sent_at=datetime.now().isoformat())
+    PublishLedger(post['id']).clear()
+    if summary['failed']:
+        logger.warning(f"Correo del post {post['id']} entregado parcialmente: {summary['sent']}/{summary['total']} "
+                       f"destinatarios ({summary['failed']} fallidos). Se marca como enviado.")
+    else:
+        logger.info(f"Correo del post {post['id']} entregado a sus {summary['total']} destinatarios. "
+                    f"Se marca como enviado.")
+
+
+def _send(post: dict, chunks: list, concurrency: int) -> bool:
+    """
+    Envía bloques ya reservados guardando el resultado de cada uno. Si el envío falla antes
+    de conocer el resultado de algún bloque, esos bloques vuelven a la cola.
+
+    Returns:
+        bool: False si el envío no pudo completarse.
+    """
+    reported = set()
+
+    def _on_result(index: int, ok: bool) -> None:
+        reported.add(index)
+        _record(chunks[index], ok)
+
+    try:
+        send_chunks([chunk['recipients'] for chunk in chunks], **_message_args(post), on_result=_on_result,
+                    concurrency=concurrency)
+        return True
+    except Exception as e:
+        logger.error(f"Error enviando el correo del post {post['id']}: {e}")
+        _requeue(chunks, reported)
+        return False
+
+
+def _requeue(chunks: list, reported: set) -> None:
+    """Devuelve a la cola los bloques reservados cuyo resultado no llegó a conocerse."""
+    for index, chunk in enumerate(chunks):
+        if index not in reported:
+            update_email_chunk(chunk['id'], status='queued')
+
+
+def _message_args(post: dict) -> dict:
+    """Asunto, contenido y adjuntos (todas las imágenes y vídeos) del correo de un post."""
+    from src.publisher import rutas_medios
+
+    image_paths, video_paths = rutas_medios(post)
+    return {
+        "subject": post.get('asunto', ''),
+        "content_text": post.get('content', ''),
+        "content_html": post.get('content_html'),
+        "attachments": image_paths + video_paths,
+    }
+
+
+def _backoff(attempts: int) -> float:
+    """Espera exponencial antes del siguiente intento de un bloque."""
+    return min(BACKOFF_SECONDS * 2 ** max(attempts - 1, 0), BACKOFF_MAX_SECONDS)
+
+
+def _record(chunk: dict, ok: bool) -> None:
+    """Guarda el resultado del envío de un bloque reservado."""
+    attempts = chunk['attempts'] + 1
+    if ok:
+        update_email_chunk(chunk['id'], status='sent', attempts=attempts, error=None)
+    elif attempts >= MAX_ATTEMPTS:
+        logger.error(f"Bloque {chunk['id']} del post {chunk['post_id']}: {attempts} intentos fallidos. Se abandona.")
+        update_email_chunk(chunk['id'], status='failed', attempts=attempts, error="El proveedor rechazó el envío.")
+    else:
+        wait = _backoff(attempts)
+        update_email_chunk(chunk['id'], status='queued', attempts=attempts, error="El proveedor rechazó el envío.",
+                           next_attempt_at=datetime.now().timestamp() + wait)
+        logger.warning(f"Bloque {chunk['id']} del post {chunk['post_id']}: intento {attempts} fallido. "
+                       f"Se reintentará en {wait:.0f}s.")
+
+
+def _summary(post_id: int) -> Dict[str, int]:
+    return get_email_outbox_summary([post_id]).get(post_id, {'queued': 0, 'sending': 0, 'sent': 0, 'failed': 0,
+                                                            'total': 0})
+
+
+def _pending(summary: Dict[str, int]) -> int:
+    """Destinatarios cuyo bloque está en cola o enviándose."""
+    return summary['queued'] + summary['sending']
+
+
+def _report(post_id: int, progress: ProgressCallback) -> None:
+    if progress:
+        summary = _summary(post_id)
+        progress(f"Correo: {summary['sent']}/{summary['total']} destinatarios entregados.")
@@ -5,20 +5,242 @@ Soporta: Gmail, Microsoft 365/Outlook, y servidores SMTP personalizados
 import smtplib
 import ssl
 import os
+import time
+import threading
+from contextlib import contextmanager
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
-from email.mime.base import MIMEBase
-from email import encoders
 from typing import List, Optional
 from dotenv import load_dotenv
 
+from src import rate_limiter
+from src.attachment_cache import mime_attachment
+
 # Cargar variables de entorno
 load_dotenv()
 
 
-def send_mail(receivers: List[str], subject: str, content_text: str, content_html: Optional[str] = None, attachments: Optional[List[str]] = None) -> bool:
+# Conexiones SMTP autenticadas que se mantienen abiertas para reutilizarlas (0 = una conexión por envío)
+SMTP_POOL_SIZE = int(os.getenv("SMTP_POOL_SIZE", "2"))
+# Segundos sin uso tras los que una conexión se descarta en lugar de reutilizarse
+SMTP_MAX_IDLE_SECONDS = float(os.getenv("SMTP_MAX_IDLE_SECONDS", "60"))
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_smtp_config() -> Optional[dict]:
+    """
+    Obtiene la configuración SMTP desde variables de entorno.
+    Primero busca SMTP_* (nuevo estándar), si no, usa GMAIL_* (retrocompatibilidad).
+
+    Returns:
+        dict | None: Configuración, o None si faltan las credenciales.
+    """
+    sender_email = os.getenv("SMTP_USERNAME") or os.getenv("GMAIL_USERNAME")
+    app_password = os.getenv("SMTP_PASSWORD") or os.getenv("GMAIL_APP_PASSWORD")
+    if not sender_email or not app_password:
+        return None
+
+    # Configuración SMTP (valores por defecto para Gmail si no se especifican)
+    return {
+        "sender_email": sender_email,
+        "app_password": app_password,
+        "smtp_server": os.getenv("SMTP_SERVER", "smtp.gmail.com"),
+        "smtp_port": int(os.getenv("SMTP_PORT", "465")),
+        "smtp_use_tls": os.getenv("SMTP_USE_TLS", "false").lower() == "true",
+        "smtp_use_ssl": os.getenv("SMTP_USE_SSL", "true").lower() == "true",
+    }
+
+
+def _connect(config: dict) -> smtplib.SMTP:
+    """Abre una conexión SMTP y se autentica."""
+    # Configurar contexto SSL
+    context = ssl.create_default_context()
+    smtp_server, smtp_port = config["smtp_server"], config["smtp_port"]
+
+    # Conectar según el tipo de conexión
+    if config["smtp_use_ssl"]:
+        # SSL directo (puerto 465) - Gmail
+        print(f"🔐 Conectando a {smtp_server}:{smtp_port} usando SSL...")
+        server = smtplib.SMTP_SSL(smtp_server, smtp_port, context=context)
+    else:
+        # STARTTLS (puerto 587) - Microsoft 365, Outlook
+        print(f"🔐 Conectando a {smtp_server}:{smtp_port} usando STARTTLS...")
+        server = smtplib.SMTP(smtp_server, smtp_port)
+        server.ehlo()
+        if config["smtp_use_tls"]:
+            server.starttls(context=context)
+            server.ehlo()
+    try:
+        server.login(config["sender_email"], config["app_password"])
+    except Exception:
+        server.close()
+        raise
+    return server
+
+
+def _is_disconnect(error: Exception) -> bool:
+    """True si el error indica que el servidor cerró la conexión (p. ej. por inactividad)."""
+    if isinstance(error, (smtplib.SMTPServerDisconnected, ConnectionError)):
+        return True
+    return isinstance(error, smtplib.SMTPResponseException) and error.smtp_code == 421
+
+
+class SMTPSession:
+    """
+    Conexión SMTP autenticada que se puede reutilizar para varios envíos.
+    Si el servidor la ha cerrado, se reconecta de forma transparente y se reintenta el envío una vez.
+    """
+
+    def __init__(self, config: dict):
+        self.config = config
+        self.server = None
+        self.last_used = 0.0
+
+    def is_stale(self, max_idle: float) -> bool:
+        return self.server is None or time.monotonic() - self.last_used > max_idle
+
+    def send(self, receivers: List[str], message: str) -> None:
+        for attempt in range(2):
+            if self.server is None:
+                self.server = _connect(self.config)
+            try:
+                self.server.sendmail(self.config["sender_email"], receivers, message)
+                self.last_used = time.monotonic()
+                return
+            except Exception as e:
+                if not _is_disconnect(e):
+                    raise
+                self.close()
+                if attempt:
+                    raise
+                print(f"🔄 El servidor SMTP cerró la conexión ({e}). Reconectando...")
+
+    def close(self) -> None:
+        if self.server is not None:
+            try:
+                self.server.quit()
+            except Exception:
+                self.server.close()
+        self.server = None
+
+
+class SMTPPool:
+    """
+    Pool de sesiones SMTP autenticadas. Reutiliza las conexiones entre envíos para no
+    repetir el handshake TLS y el AUTH en cada correo, y limita cuántas hay abiertas a la vez.
+    """
+
+    def __init__(self, config: dict, size: int = SMTP_POOL_SIZE, max_idle: float = SMTP_MAX_IDLE_SECONDS):
+        self.config = config
+        self.size = size
+        self.max_idle = max_idle
+        self._idle = []
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(size) if size > 0 else None
+
+    @contextmanager
+    def session(self):
+        """Presta una sesión del pool (o una nueva) y la devuelve al terminar si sigue sana."""
+        if self._slots:
+            self._slots.acquire()
+        session = None
+        with self._lock:
+            while self._idle and session is None:
+                candidate = self._idle.pop()
+                if candidate.is_stale(self.max_idle):
+                    candidate.close()
+                else:
+                    session = candidate
+        session = session or SMTPSession(self.config)
+
+        healthy = False
+        try:
+            yield session
+            healthy = True
+        finally:
+            if healthy and self.size > 0 and session.server is not None:
+                with self._lock:
+                    self._idle.append(session)
+            else:
+                session.close()
+            if self._slots:
+                self._slots.release()
+
+    def close(self) -> None:
+        with self._lock:
+            for session in self._idle:
+                session.close()
+            self._idle.clear()
+
+
+def get_smtp_pool(config: dict) -> SMTPPool:
+    """Devuelve el pool SMTP del proceso para la configuración dada."""
+    key = (config["smtp_server"], config["smtp_port"], config["sender_email"])
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = _pools[key] = SMTPPool(config)
+        return pool
+
+
+def _build_message(sender_email: str, receivers: List[str], subject: str, content_text: str,
+                   content_html: Optional[str] = None, attachments: Optional[List[str]] = None) -> MIMEMultipart:
+    """Construye el mensaje MIME con cuerpo de texto/HTML y adjuntos."""
+    # Crear mensaje MIME
+    msg = MIMEMultipart('mixed')
+    msg['From'] = sender_email
+    msg['Subject'] = subject
+    # Sin destinatarios visibles (envío solo en CCO), el `To` es un grupo vacío (RFC 5322)
+    msg['To'] = ", ".join(receivers) if receivers else "undisclosed-recipients:;"
+
+    # Crear contenedor para el cuerpo del mensaje
+    body_part = MIMEMultipart('alternative')
+    body_part.attach(MIMEText(content_text, 'plain'))
+
+    if content_html:
+        body_part.attach(MIMEText(content_html, 'html'))
+
+    msg.attach(body_part)
+
+    # Adjuntar archivos
+    if attachments:
+        for filepath in attachments:
+            if not os.path.exists(filepath):
+                print(f"⚠️  Advertencia: Archivo no encontrado: {filepath}")
+                continue
+
+            # Codificado una sola vez por contenido y reutilizado entre mensajes
+            msg.attach(mime_attachment(filepath))
+            print(f"📎 Archivo adjuntado: {os.path.basename(filepath)}")
+
+    return msg
+
+
+def _print_missing_credentials():
+    print("❌ Error: No se encontraron las credenciales SMTP")
+    print("Variables requeridas:")
+    print("  - SMTP_USERNAME + SMTP_PASSWORD (recomendado)")
+    print("  - O GMAIL_USERNAME + GMAIL_APP_PASSWORD (retrocompatibilidad)")
+
+
+def _print_auth_help(e: Exception):
+    print(f"❌ Error de autenticación SMTP: {e}")
+    print("\n🔍 Posibles soluciones:")
+    print("1. Verifica que el usuario y contraseña sean correctos")
+    print("2. Si usas Microsoft 365:")
+    print("   - Necesitas una 'Contraseña de aplicación'")
+    print("   - Genera una en: https://account.microsoft.com/security")
+    print("3. Si usas Gmail:")
+    print("   - Necesitas una 'Contraseña de aplicación'")
+    print("   - Activa 2FA y genera una en: https://myaccount.google.com/apppasswords")
+
+
+def send_mail(receivers: List[str], subject: str, content_text: str, content_html: Optional[str] = None, attachments: Optional[List[str]] = None,
+              bcc: Optional[List[str]] = None) -> bool:
     """
-    Envía un correo con adjuntos.
+    Envía un correo con adjuntos, reutilizando una conexión del pool SMTP si la hay.
 
     Soporta múltiples proveedores:
     - Gmail (smtp.gmail.com:465 con SSL)
@@ -26,105 +248,41 @@ def send_mail(receivers: List[str], subject: str, content_text: str, content_htm
     - Servidores SMTP personalizados
 
     Args:
-        receivers: Lista de correos destinatarios
+        receivers: Lista de correos destinatarios (puede estar vacía si hay `bcc`)
         subject: Asunto del correo
         content_text: Contenido en texto plano
         content_html: Contenido en HTML (opcional)
         attachments: Lista de rutas a archivos adjuntos (opcional)
+        bcc: Destinatarios en copia oculta (opcional): reciben el correo sin aparecer en las cabeceras
 
     Returns:
         bool: True si el envío fue exitoso, False en caso contrario
     """
     # Cargar credenciales desde variables de entorno
-    # Primero busca SMTP_* (nuevo estándar), si no, usa GMAIL_* (retrocompatibilidad)
-    sender_email = os.getenv("SMTP_USERNAME") or os.getenv("GMAIL_USERNAME")
-    app_password = os.getenv("SMTP_PASSWORD") or os.getenv("GMAIL_APP_PASSWORD")
-
-    # Configuración SMTP (valores por defecto para Gmail si no se especifican)
-    smtp_server = os.getenv("SMTP_SERVER", "smtp.gmail.com")
-    smtp_port = int(os.getenv("SMTP_PORT", "465"))
-    smtp_use_tls = os.getenv("SMTP_USE_TLS", "false").lower() == "true"
-    smtp_use_ssl = os.getenv("SMTP_USE_SSL", "true").lower() == "true"
+    config = get_smtp_config()
 
     # Validar credenciales
-    if not sender_email or not app_password:
-        print("❌ Error: No se encontraron las credenciales SMTP")
-        print("Variables requeridas:")
-        print("  - SMTP_USERNAME + SMTP_PASSWORD (recomendado)")
-        print("  - O GMAIL_USERNAME + GMAIL_APP_PASSWORD (retrocompatibilidad)")
+    if not config:
+        _print_missing_credentials()
         return False
 
-    if not receivers:
+    if not receivers and not bcc:
         print("⚠️  Advertencia: No hay destinatarios para enviar el correo.")
         return False
 
     try:
-        # Crear mensaje MIME
-        msg = MIMEMultipart('mixed')
-        msg['From'] = sender_email
-        msg['Subject'] = subject
-        msg['To'] = ", ".join(receivers)
-
-        # Crear contenedor para el cuerpo del mensaje
-        body_part = MIMEMultipart('alternative')
-        body_part.attach(MIMEText(content_text, 'plain'))
-
-        if content_html:
-            body_part.attach(MIMEText(content_html, 'html'))
-
-        msg.attach(body_part)
-
-        # Adjuntar archivos
-        if attachments:
-            for filepath in attachments:
-                if not os.path.exists(filepath):
-                    print(f"⚠️  Advertencia: Archivo no encontrado: {filepath}")
-                    continue
+        msg = _build_message(config["sender_email"], receivers, subject, content_text, content_html, attachments)
+        rate_limiter.acquire("smtp", config["sender_email"])
+
+        with get_smtp_pool(config).session() as session:
+            session.send(receivers + list(bcc or []), msg.as_string())
 
-                with open(filepath, 'rb') as f:
-                    part = MIMEBase('application', 'octet-stream')
-                    part.set_payload(f.read())
-
-                encoders.encode_base64(part)
-                filename = os.path.basename(filepath)
-                part.add_header('Content-Disposition', f'attachment; filename="{filename}"')
-                msg.attach(part)
-                print(f"📎 Archivo adjuntado: {filename}")
-
-        # Configurar contexto SSL
-        context = ssl.create_default_context()
-
-        # Conectar según el tipo de conexión
-        if smtp_use_ssl:
-            # SSL directo (puerto 465) - Gmail
-            print(f"🔐 Conectando a {smtp_server}:{smtp_port} usando SSL...")
-            with smtplib.SMTP_SSL(smtp_server, smtp_port, context=context) as server:
-                server.login(sender_email, app_password)
-                server.sendmail(sender_email, receivers, msg.as_string())
-        else:
-            # STARTTLS (puerto 587) - Microsoft 365, Outlook
-            print(f"🔐 Conectando a {smtp_server}:{smtp_port} usando STARTTLS...")
-            with smtplib.SMTP(smtp_server, smtp_port) as server:
-                server.ehlo()
-                if smtp_use_tls:
-                    server.starttls(context=context)
-                    server.ehlo()
-                server.login(sender_email, app_password)
-                server.sendmail(sender_email, receivers, msg.as_string())
-
-        print(f"✅ Correo enviado exitosamente a: {', '.join(receivers)}")
+        print(f"✅ Correo enviado exitosamente a: {', '.join(receivers) or '(sin destinatarios visibles)'}"
+              + (f" (+{len(bcc)} en CCO)" if bcc else ""))
         return True
 
     except smtplib.SMTPAuthenticationError as e:
-        print(f"❌ Error de autenticación SMTP: {e}")
-        print("\n🔍 Posibles soluciones:")
-        print("1. Verifica que el usuario y contraseña sean correctos")
-        print("2. Si usas Microsoft 365:")
-        print("   - Necesitas una 'Contraseña de aplicación'")
-        print("   - Genera una en: https://account.microsoft.com/security")
-        print("3. Si usas Gmail:")
-        print("   - Necesitas una 'Contraseña de aplicación'")
-        print("   - Activa 2FA y genera una en: https://myaccount.google.com/apppasswords")
+        _print_auth_help(e)
         return False
 
     except smtplib.SMTPServerDisconnected as e:
@@ -136,6 +294,10 @@ def send_mail(receivers: List[str], subject: str, content_text: str, content_htm
         print(f"❌ Error SMTP: {e}")
         return False
 
+    except rate_limiter.RateLimitExceeded as e:
+        print(f"⏳ Envío aplazado por límite de peticiones: {e}")
+        return False
+
     except Exception as e:
         print(f"❌ Error inesperado al enviar el correo: {e}")
         import traceback
@@ -143,6 +305,55 @@ def send_mail(receivers: List[str], subject: str, content_text: str, content_htm
         return False
 
 
+def send_mail_batch(messages: List[dict]) -> List[bool]:
+    """
+    Envía varios correos por una misma sesión SMTP autenticada.
+
+    Args:
+        messages: Lista de diccionarios con los argumentos de `send_mail`
+                  (receivers, subject, content_text, content_html, attachments, bcc).
+
+    Returns:
+        list: True/False por cada mensaje, en el mismo orden.
+    """
+    config = get_smtp_config()
+    if not config:
+        _print_missing_credentials()
+        return [False] * len(messages)
+
+    results = []
+    try:
+        with get_smtp_pool(config).session() as session:
+            for message in messages:
+                receivers = message.get("receivers") or []
+                if not receivers:
+                    print("⚠️  Advertencia: No hay destinatarios para enviar el correo.")
+                    results.append(False)
+                    continue
+                try:
+                    msg = _build_message(config["sender_email"], receivers, message.get("subject", ""),
+                                         message.get("content_text", ""), message.get("content_html"),
+                                         message.get("attachments"))
+                    rate_limiter.acquire("smtp", config["sender_email"])
+                    session.send(receivers + list(message.get("bcc") or []), msg.as_string())
+                    results.append(True)
+                except (smtplib.SMTPRecipientsRefused, smtplib.SMTPDataError, smtplib.SMTPSenderRefused) as e:
+                    # Error de este mensaje: el resto del lote sigue por la misma sesión
+                    print(f"❌ Error SMTP enviando a {', '.join(receivers)}: {e}")
+                    results.append(False)
+    except smtplib.SMTPAuthenticationError as e:
+        _print_auth_help(e)
+    except rate_limiter.RateLimitExceeded as e:
+        print(f"⏳ Envío aplazado por límite de peticiones: {e}")
+    except (smtplib.SMTPException, OSError) as e:
+        print(f"❌ Error SMTP: {e}")
+
+    # Los mensajes que no llegaron a intentarse se consideran fallidos
+    results.extend([False] * (len(messages) - len(results)))
+    print(f"✅ Lote SMTP: {sum(results)}/{len(messages)} correos enviados.")
+    return results
+
+
 # Función de compatibilidad con el código antiguo
 def send_gmail(*args, **kwargs):
     """Alias para mantener compatibilidad con código antiguo"""
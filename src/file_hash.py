@@ -0,0 +1,46 @@
+"""
+Hash del contenido de los ficheros de medios, memorizado por proceso.
+
+El hash se recalcula solo si cambian la ruta, el tamaño o la fecha de modificación del
+fichero, de modo que publicar varias veces los mismos medios no vuelve a leerlos enteros.
+"""
+
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+
+# Tamaño de bloque de lectura y número máximo de hashes memorizados
+_CHUNK_SIZE = 1024 * 1024
+_MAX_ENTRIES = 1024
+
+_cache = OrderedDict()
+_lock = threading.Lock()
+
+
+def file_sha256(file_path: str) -> str:
+    """
+    Devuelve el SHA-256 (hex) del contenido del fichero, leyéndolo por bloques.
+
+    Raises:
+        FileNotFoundError: Si el fichero no existe.
+    """
+    stat = os.stat(file_path)
+    key = (os.path.abspath(file_path), stat.st_size, stat.st_mtime_ns)
+
+    with _lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            return _cache[key]
+
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    content_hash = digest.hexdigest()
+
+    with _lock:
+        _cache[key] = content_hash
+        while len(_cache) > _MAX_ENTRIES:
+            _cache.popitem(last=False)
+    return content_hash
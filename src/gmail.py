@@ -3,11 +3,11 @@ import ssl
 import os
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
-from email.mime.base import MIMEBase
-from email import encoders
 from typing import List, Optional
 from dotenv import load_dotenv
 
+from src.attachment_cache import mime_attachment
+
 # Cargar variables de entorno
 load_dotenv()
 
@@ -54,15 +54,9 @@ def send_mail(receivers: List[str], subject: str, content_text: str, content_htm
                     print(f"Advertencia: Fichero adjunto no encontrado y será omitido: {filepath}")
                     continue
 
-                with open(filepath, 'rb') as f:
-                    part = MIMEBase('application', 'octet-stream')
-                    part.set_payload(f.read())
-
-                encoders.encode_base64(part)
-                filename = os.path.basename(filepath)
-                part.add_header('Content-Disposition', f'attachment; filename="{filename}"')
-                msg.attach(part)
-                print(f"Fichero adjuntado: {filename}")
+                # Codificado una sola vez por contenido y reutilizado entre mensajes
+                msg.attach(mime_attachment(filepath))
+                print(f"Fichero adjuntado: {os.path.basename(filepath)}")
 
         # Conectar y enviar el mensaje completo
         context = ssl.create_default_context()
@@ -4,19 +4,46 @@ Ideal para organizaciones con Microsoft 365 que tienen SMTP AUTH deshabilitado.
 """
 
 import os
+import json
+import asyncio
+import threading
 import requests
 from typing import List, Optional
 from dotenv import load_dotenv
 
+from src import attachment_cache, http_client, rate_limiter
+
 try:
-    from msal import ConfidentialClientApplication
+    from msal import ConfidentialClientApplication, SerializableTokenCache
 except ImportError:
     ConfidentialClientApplication = None
+    SerializableTokenCache = None
     print("Advertencia: msal no está instalado. Ejecuta: pip install msal")
 
 # Cargar variables de entorno
 load_dotenv()
 
+GRAPH_API_BASE = os.getenv("GRAPH_API_BASE", "https://graph.microsoft.com/v1.0").rstrip("/")
+GRAPH_SCOPES = ["https://graph.microsoft.com/.default"]
+
+# Graph rechaza peticiones de más de 4 MB: por encima de este total los adjuntos no van en
+# línea en sendMail, sino en un borrador (los mayores, por sesión de subida)
+INLINE_ATTACHMENTS_MAX_BYTES = int(float(os.getenv("GRAPH_INLINE_ATTACHMENTS_MAX_MB", "3")) * 1024 * 1024)
+# Los bloques de una sesión de subida deben ser múltiplos de 320 KiB y de menos de 4 MB
+UPLOAD_CHUNK_BYTES = min(max(1, int(os.getenv("GRAPH_UPLOAD_CHUNK_KB", "3200")) // 320), 12) * 320 * 1024
+# Graph admite como mucho 20 peticiones por $batch y 4 MB por petición
+BATCH_SIZE = min(max(1, int(os.getenv("GRAPH_BATCH_SIZE", "20"))), 20)
+BATCH_MAX_BYTES = 4 * 1024 * 1024 - 64 * 1024
+# Estados de una subpetición del lote que se reintentan (el resto son errores definitivos)
+BATCH_RETRY_STATUS = {429, 500, 502, 503, 504}
+
+# Aplicación MSAL y caché de tokens compartidas por el proceso. MSAL devuelve el token
+# en caché hasta poco antes de que caduque, así que solo se pide uno nuevo cuando hace falta.
+_msal_app = None
+_msal_app_key = None
+_token_cache = None
+_token_lock = threading.Lock()
+
 
 def get_graph_config() -> dict:
     """
@@ -42,9 +69,55 @@ def get_graph_config() -> dict:
     }
 
 
+def _load_token_cache(cache_path: Optional[str]):
+    """Crea la caché de tokens, cargando la guardada en disco si existe."""
+    cache = SerializableTokenCache()
+    if cache_path and os.path.exists(cache_path):
+        try:
+            with open(cache_path, "r", encoding="utf-8") as f:
+                cache.deserialize(f.read())
+        except (OSError, ValueError) as e:
+            print(f"Advertencia: No se pudo leer la caché de tokens {cache_path}: {e}")
+    return cache
+
+
+def _save_token_cache(cache, cache_path: Optional[str]) -> None:
+    """Guarda la caché de tokens en disco (de forma atómica y solo legible por el usuario)."""
+    if not cache_path or not cache.has_state_changed:
+        return
+    tmp_path = f"{cache_path}.tmp"
+    try:
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(cache.serialize())
+        os.replace(tmp_path, cache_path)
+        cache.has_state_changed = False
+    except OSError as e:
+        print(f"Advertencia: No se pudo guardar la caché de tokens {cache_path}: {e}")
+
+
+def _get_msal_app(config: dict):
+    """Devuelve la aplicación MSAL del proceso, recreándola si cambian las credenciales."""
+    global _msal_app, _msal_app_key, _token_cache
+
+    app_key = (config['client_id'], config['tenant_id'], config['client_secret'])
+    if _msal_app is None or _msal_app_key != app_key:
+        _token_cache = _load_token_cache(os.getenv("MICROSOFT_TOKEN_CACHE_PATH"))
+        _msal_app = ConfidentialClientApplication(
+            config['client_id'],
+            authority=f"https://login.microsoftonline.com/{config['tenant_id']}",
+            client_credential=config['client_secret'],
+            token_cache=_token_cache
+        )
+        _msal_app_key = app_key
+    return _msal_app
+
+
 def get_access_token() -> str:
     """
     Obtiene un token de acceso para Microsoft Graph API.
+    Reutiliza el token en caché mientras sea válido; con MICROSOFT_TOKEN_CACHE_PATH
+    la caché se conserva también entre reinicios del scheduler.
 
     Returns:
         str: Token de acceso o None si falla.
@@ -58,18 +131,11 @@ def get_access_token() -> str:
         print("Error: Configuración de Microsoft Graph incompleta.")
         return None
 
-    authority = f"https://login.microsoftonline.com/{config['tenant_id']}"
-
-    app = ConfidentialClientApplication(
-        config['client_id'],
-        authority=authority,
-        client_credential=config['client_secret']
-    )
-
-    # Obtener token para Microsoft Graph
-    scopes = ["https://graph.microsoft.com/.default"]
-
-    result = app.acquire_token_for_client(scopes=scopes)
+    with _token_lock:
+        app = _get_msal_app(config)
+        # Obtener token para Microsoft Graph (de la caché si sigue vigente)
+        result = app.acquire_token_for_client(scopes=GRAPH_SCOPES)
+        _save_token_cache(_token_cache, os.getenv("MICROSOFT_TOKEN_CACHE_PATH"))
 
     if "access_token" in result:
         return result["access_token"]
@@ -93,6 +159,10 @@ def send_mail_graph(
     """
     Envía un correo usando Microsoft Graph API.
 
+    Si los adjuntos superan GRAPH_INLINE_ATTACHMENTS_MAX_MB en total, el correo se crea como
+    borrador, los adjuntos grandes se suben por sesiones de subida (en bloques, sin cargar
+    el fichero entero en memoria) y después se envía el borrador.
+
     Args:
         receivers: Lista de direcciones de correo destinatarias
         subject: Asunto del correo
@@ -105,6 +175,464 @@ def send_mail_graph(
     Returns:
         bool: True si el envío fue exitoso, False en caso contrario.
     """
+    config = _check_send_config(receivers + list(cc or []) + list(bcc or []))
+    if not config:
+        return False
+
+    # Obtener token de acceso
+    access_token = get_access_token()
+    if not access_token:
+        return False
+
+    sender_email = config['sender_email']
+    headers = {
+        "Authorization": f"Bearer {access_token}",
+        "Content-Type": "application/json"
+    }
+
+    try:
+        if _needs_draft(attachments):
+            message = _build_message(receivers, subject, content_text, content_html, None, cc, bcc)
+            response = _send_draft(sender_email, headers, message, attachments)
+        else:
+            message = _build_message(receivers, subject, content_text, content_html, attachments, cc, bcc)
+            response = _graph_request(sender_email, "POST", f"{GRAPH_API_BASE}/users/{sender_email}/sendMail",
+                                      json=message, headers=headers)
+
+        return _handle_send_response(response, receivers, sender_email)
+
+    except requests.exceptions.RequestException as e:
+        print(f"Error de conexión: {e}")
+        return False
+    except rate_limiter.RateLimitExceeded as e:
+        print(f"Envío aplazado por límite de peticiones: {e}")
+        return False
+
+
+def _graph_request(sender_email: str, method: str, url: str, **kwargs) -> requests.Response:
+    """Petición a Graph que respeta el limitador y reintenta los 429 con Retry-After."""
+    for attempt in range(rate_limiter.MAX_THROTTLE_RETRIES + 1):
+        rate_limiter.acquire("graph", sender_email)
+        response = http_client.get_session("graph").request(method, url, **kwargs)
+        if rate_limiter.check_response("graph", sender_email, response) is None:
+            break
+        print(f"Graph API respondió {response.status_code} (throttling). Intento {attempt + 1}.")
+    return response
+
+
+def _send_draft(sender_email: str, headers: dict, message: dict, attachments: List[str]) -> requests.Response:
+    """
+    Crea el correo como borrador, le añade los adjuntos y lo envía.
+    Devuelve la respuesta del primer paso que falle o la del envío (202 si fue aceptado).
+    Si no se llega a enviar, el borrador se elimina.
+    """
+    messages_url = f"{GRAPH_API_BASE}/users/{sender_email}/messages"
+    response = _graph_request(sender_email, "POST", messages_url, json=message["message"], headers=headers)
+    if response.status_code != 201:
+        return response
+
+    draft_url = f"{messages_url}/{response.json()['id']}"
+    sent = False
+    try:
+        for filepath in attachments:
+            if not os.path.exists(filepath):
+                print(f"Advertencia: Archivo no encontrado: {filepath}")
+                continue
+            if os.path.getsize(filepath) > INLINE_ATTACHMENTS_MAX_BYTES:
+                response = _upload_attachment(sender_email, draft_url, headers, filepath)
+            else:
+                response = _graph_request(sender_email, "POST", f"{draft_url}/attachments",
+                                          json=_file_attachment(filepath), headers=headers)
+            if response.status_code not in (200, 201):
+                return response
+
+        response = _graph_request(sender_email, "POST", f"{draft_url}/send", headers=headers)
+        sent = response.status_code == 202
+        return response
+    finally:
+        if not sent:
+            _delete_draft(sender_email, draft_url, headers)
+
+
+def _upload_attachment(sender_email: str, draft_url: str, headers: dict, filepath: str) -> requests.Response:
+    """Sube un adjunto grande al borrador mediante una sesión de subida, bloque a bloque."""
+    size = os.path.getsize(filepath)
+    filename = os.path.basename(filepath)
+    response = _graph_request(sender_email, "POST", f"{draft_url}/attachments/createUploadSession",
+                              json=_upload_session_payload(filename, size), headers=headers)
+    if response.status_code != 201:
+        return response
+
+    upload_url = response.json()["uploadUrl"]
+    with open(filepath, "rb") as f:
+        for start in range(0, size, UPLOAD_CHUNK_BYTES):
+            chunk = f.read(UPLOAD_CHUNK_BYTES)
+            # La URL de subida ya está autenticada: no se envía el token
+            response = _graph_request(sender_email, "PUT", upload_url, data=chunk,
+                                      headers=_chunk_headers(start, len(chunk), size))
+            if response.status_code not in (200, 201):
+                return response
+
+    print(f"Archivo adjuntado (sesión de subida): {filename}")
+    return response
+
+
+def _delete_draft(sender_email: str, draft_url: str, headers: dict) -> None:
+    """Elimina un borrador que no se llegó a enviar (si falla, solo se avisa)."""
+    try:
+        _graph_request(sender_email, "DELETE", draft_url, headers=headers)
+    except (requests.exceptions.RequestException, rate_limiter.RateLimitExceeded) as e:
+        print(f"Advertencia: No se pudo eliminar el borrador {draft_url}: {e}")
+
+
+async def send_mail_graph_async(
+    client,
+    receivers: List[str],
+    subject: str,
+    content_text: str,
+    content_html: Optional[str] = None,
+    attachments: Optional[List[str]] = None,
+    cc: Optional[List[str]] = None,
+    bcc: Optional[List[str]] = None
+) -> bool:
+    """
+    Versión asíncrona de `send_mail_graph` sobre un httpx.AsyncClient (ver src/async_http.py).
+    La obtención del token y la lectura de los adjuntos se hacen en un hilo aparte.
+    """
+    from src import async_http
+
+    config = _check_send_config(receivers + list(cc or []) + list(bcc or []))
+    if not config:
+        return False
+
+    access_token = await asyncio.to_thread(get_access_token)
+    if not access_token:
+        return False
+
+    sender_email = config['sender_email']
+    headers = {
+        "Authorization": f"Bearer {access_token}",
+        "Content-Type": "application/json"
+    }
+
+    try:
+        if _needs_draft(attachments):
+            message = _build_message(receivers, subject, content_text, content_html, None, cc, bcc)
+            response = await _send_draft_async(client, sender_email, headers, message, attachments)
+        else:
+            message = await asyncio.to_thread(_build_message, receivers, subject, content_text, content_html,
+                                              attachments, cc, bcc)
+            response = await async_http.request(client, "graph", sender_email, "POST",
+                                                f"{GRAPH_API_BASE}/users/{sender_email}/sendMail",
+                                                json=message, headers=headers)
+        return _handle_send_response(response, receivers, sender_email)
+    except rate_limiter.RateLimitExceeded as e:
+        print(f"Envío aplazado por límite de peticiones: {e}")
+        return False
+    except RuntimeError as e:
+        print(f"Error de conexión: {e}")
+        return False
+
+
+async def _send_draft_async(client, sender_email: str, headers: dict, message: dict, attachments: List[str]):
+    """Versión asíncrona de `_send_draft`."""
+    from src import async_http
+
+    messages_url = f"{GRAPH_API_BASE}/users/{sender_email}/messages"
+    response = await async_http.request(client, "graph", sender_email, "POST", messages_url,
+                                        json=message["message"], headers=headers)
+    if response.status_code != 201:
+        return response
+
+    draft_url = f"{messages_url}/{response.json()['id']}"
+    sent = False
+    try:
+        for filepath in attachments:
+            if not os.path.exists(filepath):
+                print(f"Advertencia: Archivo no encontrado: {filepath}")
+                continue
+            if os.path.getsize(filepath) > INLINE_ATTACHMENTS_MAX_BYTES:
+                response = await _upload_attachment_async(client, sender_email, draft_url, headers, filepath)
+            else:
+                attachment = await asyncio.to_thread(_file_attachment, filepath)
+                response = await async_http.request(client, "graph", sender_email, "POST",
+                                                    f"{draft_url}/attachments", json=attachment, headers=headers)
+            if response.status_code not in (200, 201):
+                return response
+
+        response = await async_http.request(client, "graph", sender_email, "POST", f"{draft_url}/send",
+                                            headers=headers)
+        sent = response.status_code == 202
+        return response
+    finally:
+        if not sent:
+            try:
+                await async_http.request(client, "graph", sender_email, "DELETE", draft_url, headers=headers)
+            except (RuntimeError, rate_limiter.RateLimitExceeded) as e:
+                print(f"Advertencia: No se pudo eliminar el borrador {draft_url}: {e}")
+
+
+async def _upload_attachment_async(client, sender_email: str, draft_url: str, headers: dict, filepath: str):
+    """
+    Versión asíncrona de `_upload_attachment`. Cada bloque se envía en streaming desde el
+    disco, de modo que httpx no retiene copias del bloque entre peticiones.
+    """
+    from src import async_http
+
+    size = os.path.getsize(filepath)
+    filename = os.path.basename(filepath)
+    response = await async_http.request(client, "graph", sender_email, "POST",
+                                        f"{draft_url}/attachments/createUploadSession",
+                                        json=_upload_session_payload(filename, size), headers=headers)
+    if response.status_code != 201:
+        return response
+
+    upload_url = response.json()["uploadUrl"]
+    for start in range(0, size, UPLOAD_CHUNK_BYTES):
+        length = min(UPLOAD_CHUNK_BYTES, size - start)
+        response = await async_http.request(client, "graph", sender_email, "PUT", upload_url,
+                                            content_factory=lambda start=start, length=length:
+                                            _iter_range_async(filepath, start, length),
+                                            headers=_chunk_headers(start, length, size))
+        if response.status_code not in (200, 201):
+            return response
+
+    print(f"Archivo adjuntado (sesión de subida): {filename}")
+    return response
+
+
+async def _iter_range_async(filepath: str, start: int, length: int):
+    """Lee `length` bytes del fichero desde `start`, en trozos pequeños y en un hilo aparte."""
+    with open(filepath, "rb") as f:
+        f.seek(start)
+        remaining = length
+        while remaining > 0:
+            data = await asyncio.to_thread(f.read, min(remaining, 320 * 1024))
+            if not data:
+                break
+            remaining -= len(data)
+            yield data
+
+
+def _needs_draft(attachments: Optional[List[str]]) -> bool:
+    """Los adjuntos solo van en línea en sendMail si en total no superan el límite de Graph."""
+    total = sum(os.path.getsize(path) for path in attachments or [] if os.path.exists(path))
+    return total > INLINE_ATTACHMENTS_MAX_BYTES
+
+
+def _upload_session_payload(filename: str, size: int) -> dict:
+    return {"AttachmentItem": {"attachmentType": "file", "name": filename, "size": size}}
+
+
+def _chunk_headers(start: int, length: int, total: int) -> dict:
+    return {
+        "Content-Type": "application/octet-stream",
+        "Content-Length": str(length),
+        "Content-Range": f"bytes {start}-{start + length - 1}/{total}"
+    }
+
+
+def send_mail_graph_batch(messages: List[dict]) -> List[bool]:
+    """
+    Envía varios correos agrupando las peticiones sendMail en llamadas $batch de hasta
+    GRAPH_BATCH_SIZE (máximo 20). Las subpeticiones rechazadas por throttling o por un
+    error temporal se reintentan solas, sin reenviar las que ya se aceptaron.
+
+    Los correos con adjuntos que no caben en línea se envían por separado (ver `send_mail_graph`).
+
+    Args:
+        messages: Lista de diccionarios con los argumentos de `send_mail_graph`
+                  (receivers, subject, content_text, content_html, attachments, cc, bcc).
+
+    Returns:
+        list: Un booleano por correo, en el mismo orden, indicando si se envió.
+    """
+    results = [False] * len(messages)
+    prepared = _prepare_batch(messages)
+    if prepared is None:
+        return results
+    config, payloads, individual = prepared
+
+    for index in individual:
+        results[index] = send_mail_graph(**messages[index])
+
+    sender_email = config['sender_email']
+    access_token = get_access_token() if payloads else None
+    if not access_token:
+        return results
+    headers = {
+        "Authorization": f"Bearer {access_token}",
+        "Content-Type": "application/json"
+    }
+
+    pending = sorted(payloads)
+    for attempt in range(rate_limiter.MAX_THROTTLE_RETRIES + 1):
+        retry, wait = [], 0.0
+        for group in _batch_groups(pending, payloads):
+            try:
+                response = _graph_request(sender_email, "POST", f"{GRAPH_API_BASE}/$batch",
+                                          json=_batch_body(sender_email, group, payloads), headers=headers)
+            except requests.exceptions.RequestException as e:
+                print(f"Error de conexión: {e}")
+                continue
+            except rate_limiter.RateLimitExceeded as e:
+                print(f"Envío aplazado por límite de peticiones: {e}")
+                break
+            wait = max(wait, _apply_batch_response(response, group, results, retry, sender_email))
+
+        pending = retry
+        if not pending or attempt == rate_limiter.MAX_THROTTLE_RETRIES:
+            break
+        # El Retry-After de las subpeticiones se registra en el limitador: el siguiente
+        # $batch espera lo indicado antes de salir
+        if wait:
+            rate_limiter.register_retry_after("graph", sender_email, wait)
+        print(f"Reintentando {len(pending)} correos del lote (intento {attempt + 2}).")
+
+    print(f"Lote de Graph: {sum(results)}/{len(messages)} correos enviados.")
+    return results
+
+
+async def send_mail_graph_batch_async(client, messages: List[dict]) -> List[bool]:
+    """Versión asíncrona de `send_mail_graph_batch` sobre un httpx.AsyncClient."""
+    from src import async_http
+
+    results = [False] * len(messages)
+    prepared = await asyncio.to_thread(_prepare_batch, messages)
+    if prepared is None:
+        return results
+    config, payloads, individual = prepared
+
+    for index in individual:
+        results[index] = await send_mail_graph_async(client, **messages[index])
+
+    sender_email = config['sender_email']
+    access_token = await asyncio.to_thread(get_access_token) if payloads else None
+    if not access_token:
+        return results
+    headers = {
+        "Authorization": f"Bearer {access_token}",
+        "Content-Type": "application/json"
+    }
+
+    pending = sorted(payloads)
+    for attempt in range(rate_limiter.MAX_THROTTLE_RETRIES + 1):
+        retry, wait = [], 0.0
+        for group in _batch_groups(pending, payloads):
+            try:
+                response = await async_http.request(client, "graph", sender_email, "POST",
+                                                    f"{GRAPH_API_BASE}/$batch",
+                                                    json=_batch_body(sender_email, group, payloads),
+                                                    headers=headers)
+            except RuntimeError as e:
+                print(f"Error de conexión: {e}")
+                continue
+            except rate_limiter.RateLimitExceeded as e:
+                print(f"Envío aplazado por límite de peticiones: {e}")
+                break
+            wait = max(wait, _apply_batch_response(response, group, results, retry, sender_email))
+
+        pending = retry
+        if not pending or attempt == rate_limiter.MAX_THROTTLE_RETRIES:
+            break
+        if wait:
+            await asyncio.to_thread(rate_limiter.register_retry_after, "graph", sender_email, wait)
+        print(f"Reintentando {len(pending)} correos del lote (intento {attempt + 2}).")
+
+    print(f"Lote de Graph: {sum(results)}/{len(messages)} correos enviados.")
+    return results
+
+
+def _prepare_batch(messages: List[dict]):
+    """
+    Comprueba la configuración y construye el cuerpo sendMail de cada correo del lote.
+
+    Returns:
+        tuple | None: (config, {índice: cuerpo sendMail}, índices que se envían por separado),
+                      o None si no hay configuración o destinatarios.
+    """
+    if not messages:
+        return None
+    config = _check_send_config([r for m in messages for r in _recipients(m)])
+    if not config:
+        return None
+
+    payloads, individual = {}, []
+    for index, message in enumerate(messages):
+        if not _recipients(message):
+            print("Advertencia: No hay destinatarios para enviar el correo.")
+        elif _needs_draft(message.get("attachments")):
+            individual.append(index)
+        else:
+            payloads[index] = _build_message(message["receivers"], message["subject"], message["content_text"],
+                                             message.get("content_html"), message.get("attachments"),
+                                             message.get("cc"), message.get("bcc"))
+    return config, payloads, individual
+
+
+def _batch_groups(indices: List[int], payloads: dict) -> List[List[int]]:
+    """Agrupa los correos en lotes de como mucho BATCH_SIZE peticiones y BATCH_MAX_BYTES."""
+    groups, group, group_bytes = [], [], 0
+    for index in indices:
+        size = len(json.dumps(payloads[index]))
+        if group and (len(group) >= BATCH_SIZE or group_bytes + size > BATCH_MAX_BYTES):
+            groups.append(group)
+            group, group_bytes = [], 0
+        group.append(index)
+        group_bytes += size
+    if group:
+        groups.append(group)
+    return groups
+
+
+def _batch_body(sender_email: str, group: List[int], payloads: dict) -> dict:
+    return {"requests": [{
+        "id": str(index),
+        "method": "POST",
+        "url": f"/users/{sender_email}/sendMail",
+        "headers": {"Content-Type": "application/json"},
+        "body": payloads[index]
+    } for index in group]}
+
+
+def _apply_batch_response(response, group: List[int], results: List[bool], retry: List[int],
+                          sender_email: str) -> float:
+    """
+    Marca en `results` los correos aceptados del lote (202) y añade a `retry` los que se
+    pueden reintentar.
+
+    Returns:
+        float: Mayor Retry-After (en segundos) de las subpeticiones con throttling, o 0.
+    """
+    if response.status_code != 200:
+        # El $batch entero falló: se informa como un envío normal y no se reintenta
+        _handle_send_response(response, [], sender_email)
+        return 0.0
+
+    wait = 0.0
+    responses = {r.get("id"): r for r in response.json().get("responses", [])}
+    for index in group:
+        sub = responses.get(str(index), {})
+        status = sub.get("status")
+        if status == 202:
+            results[index] = True
+        elif status in BATCH_RETRY_STATUS:
+            retry.append(index)
+            retry_after = rate_limiter.parse_retry_after((sub.get("headers") or {}).get("Retry-After"))
+            wait = max(wait, retry_after or 0.0)
+        else:
+            error = (sub.get("body") or {}).get("error", {})
+            print(f"Error al enviar correo del lote: {status} {error.get('message', '')}")
+    return wait
+
+
+def _recipients(message: dict) -> List[str]:
+    """Todos los destinatarios de un correo del lote (To, CC y CCO)."""
+    return (message.get("receivers") or []) + (message.get("cc") or []) + (message.get("bcc") or [])
+
+
+def _check_send_config(receivers: List[str]) -> Optional[dict]:
+    """Comprueba la configuración y los destinatarios antes de un envío."""
     config = get_graph_config()
     if not config:
         print("Error: Configuración de Microsoft Graph incompleta.")
@@ -113,18 +641,25 @@ def send_mail_graph(
         print("  MICROSOFT_TENANT_ID")
         print("  MICROSOFT_CLIENT_SECRET")
         print("  MICROSOFT_SENDER_EMAIL")
-        return False
+        return None
 
     if not receivers:
         print("Advertencia: No hay destinatarios para enviar el correo.")
-        return False
+        return None
+
+    return config
 
-    # Obtener token de acceso
-    access_token = get_access_token()
-    if not access_token:
-        return False
 
-    # Construir el mensaje
+def _build_message(
+    receivers: List[str],
+    subject: str,
+    content_text: str,
+    content_html: Optional[str] = None,
+    attachments: Optional[List[str]] = None,
+    cc: Optional[List[str]] = None,
+    bcc: Optional[List[str]] = None
+) -> dict:
+    """Construye el cuerpo de la petición sendMail, con los adjuntos codificados en base64."""
     message = {
         "message": {
             "subject": subject,
@@ -158,52 +693,44 @@ def send_mail_graph(
             if not os.path.exists(filepath):
                 print(f"Advertencia: Archivo no encontrado: {filepath}")
                 continue
+            message["message"]["attachments"].append(_file_attachment(filepath))
 
-            import base64
-            with open(filepath, "rb") as f:
-                content = base64.b64encode(f.read()).decode("utf-8")
+    return message
 
-            filename = os.path.basename(filepath)
-            message["message"]["attachments"].append({
-                "@odata.type": "#microsoft.graph.fileAttachment",
-                "name": filename,
-                "contentBytes": content
-            })
-            print(f"Archivo adjuntado: {filename}")
 
-    # Enviar el correo
-    sender_email = config['sender_email']
-    endpoint = f"https://graph.microsoft.com/v1.0/users/{sender_email}/sendMail"
+def _file_attachment(filepath: str) -> dict:
+    """Adjunto en línea (fileAttachment) con el contenido del fichero en base64 (ver attachment_cache)."""
+    # Codificado una sola vez por contenido y reutilizado entre mensajes
+    content = attachment_cache.get_base64(filepath)
 
-    headers = {
-        "Authorization": f"Bearer {access_token}",
-        "Content-Type": "application/json"
+    filename = os.path.basename(filepath)
+    print(f"Archivo adjuntado: {filename}")
+    return {
+        "@odata.type": "#microsoft.graph.fileAttachment",
+        "name": filename,
+        "contentBytes": content
     }
 
-    try:
-        response = requests.post(endpoint, json=message, headers=headers)
 
-        if response.status_code == 202:
-            print(f"Correo enviado exitosamente via Graph API a: {', '.join(receivers)}")
-            return True
-        else:
-            print(f"Error al enviar correo: {response.status_code}")
-            print(f"Respuesta: {response.text}")
+def _handle_send_response(response, receivers: List[str], sender_email: str) -> bool:
+    """Interpreta la respuesta de sendMail (202 = aceptado) e informa de los errores comunes."""
+    if response.status_code == 202:
+        print(f"Correo enviado exitosamente via Graph API a: {', '.join(receivers) or '(solo CCO)'}")
+        return True
 
-            # Errores comunes
-            if response.status_code == 401:
-                print("\nPosible solución: Verifica que el Client Secret no haya expirado.")
-            elif response.status_code == 403:
-                print("\nPosible solución: Verifica que la app tenga el permiso 'Mail.Send' en Azure.")
-                print("También asegúrate de que sea un permiso de APLICACIÓN, no delegado.")
-            elif response.status_code == 404:
-                print(f"\nPosible solución: Verifica que el email '{sender_email}' exista y sea válido.")
+    print(f"Error al enviar correo: {response.status_code}")
+    print(f"Respuesta: {response.text}")
 
-            return False
+    # Errores comunes
+    if response.status_code == 401:
+        print("\nPosible solución: Verifica que el Client Secret no haya expirado.")
+    elif response.status_code == 403:
+        print("\nPosible solución: Verifica que la app tenga el permiso 'Mail.Send' en Azure.")
+        print("También asegúrate de que sea un permiso de APLICACIÓN, no delegado.")
+    elif response.status_code == 404:
+        print(f"\nPosible solución: Verifica que el email '{sender_email}' exista y sea válido.")
 
-    except requests.exceptions.RequestException as e:
-        print(f"Error de conexión: {e}")
-        return False
+    return False
 
 
 def test_graph_connection() -> bool:
@@ -0,0 +1,97 @@
+"""
+Sesiones HTTP compartidas por los adaptadores de plataformas.
+
+Cada plataforma obtiene con `get_session(nombre)` una única `requests.Session` por proceso, con:
+- Pool de conexiones por host (keep-alive): las peticiones sucesivas no repiten el handshake TCP+TLS.
+- Timeouts de conexión y lectura por defecto, para que un socket colgado no bloquee el scheduler.
+- Reintentos automáticos de errores de conexión y de 5xx solo en métodos idempotentes.
+  Los 429 no se reintentan aquí: los gestiona `rate_limiter` respetando Retry-After.
+
+Configurable con HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT, HTTP_POOL_MAXSIZE y HTTP_RETRIES.
+"""
+
+import os
+import logging
+import threading
+from typing import Dict
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from src import metrics
+
+logger = logging.getLogger(__name__)
+
+CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "10"))
+READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "120"))
+POOL_MAXSIZE = int(os.getenv("HTTP_POOL_MAXSIZE", "10"))
+RETRIES = int(os.getenv("HTTP_RETRIES", "3"))
+
+# PUT queda fuera: las subidas se envían como streams de fichero y no se pueden repetir a ciegas
+RETRY_METHODS = frozenset({"GET", "HEAD", "OPTIONS", "DELETE"})
+RETRY_STATUS = (500, 502, 503, 504)
+
+_sessions: Dict[str, requests.Session] = {}
+_lock = threading.Lock()
+
+
+class _PlatformSession(requests.Session):
+    """Sesión que aplica el timeout por defecto y registra métricas de cada respuesta."""
+
+    def __init__(self, name: str, timeout):
+        super().__init__()
+        self.name = name
+        self.default_timeout = timeout
+        self.hooks["response"].append(self._observe)
+
+    def request(self, method, url, **kwargs):
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = self.default_timeout
+        return super().request(method, url, **kwargs)
+
+    def _observe(self, response, *args, **kwargs):
+        metrics.HTTP_REQUESTS.inc(client=self.name, status=response.status_code)
+        metrics.HTTP_REQUEST_DURATION.observe(response.elapsed.total_seconds(), client=self.name)
+
+
+def _build_session(name: str) -> requests.Session:
+    retry = Retry(
+        total=RETRIES,
+        connect=RETRIES,
+        read=RETRIES,
+        status=RETRIES,
+        backoff_factor=0.5,
+        status_forcelist=RETRY_STATUS,
+        allowed_methods=RETRY_METHODS,
+        respect_retry_after_header=False,
+        raise_on_status=False
+    )
+    adapter = HTTPAdapter(pool_connections=POOL_MAXSIZE, pool_maxsize=POOL_MAXSIZE, max_retries=retry)
+    session = _PlatformSession(name, (CONNECT_TIMEOUT, READ_TIMEOUT))
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def get_session(name: str) -> requests.Session:
+    """
+    Devuelve la sesión HTTP compartida de una plataforma, creándola la primera vez.
+
+    Args:
+        name: Nombre de la plataforma ('linkedin', 'wordpress', 'graph'...). Se usa en las métricas.
+    """
+    with _lock:
+        session = _sessions.get(name)
+        if session is None:
+            session = _sessions[name] = _build_session(name)
+            logger.debug(f"Sesión HTTP creada para {name} (pool={POOL_MAXSIZE}, reintentos={RETRIES}).")
+        return session
+
+
+def close_sessions() -> None:
+    """Cierra todas las sesiones y sus conexiones abiertas."""
+    with _lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
@@ -1,13 +1,17 @@
 import os
+import json
+from pathlib import Path
+import threading
 from dotenv import load_dotenv
 from instagrapi import Client
-from instagrapi.exceptions import ChallengeRequired
-import PIL.Image
+from instagrapi.exceptions import ChallengeRequired, PleaseWaitFewMinutes, ClientThrottledError, LoginRequired
 import logging
-import tempfile
 
 from pydantic_core import ValidationError
 
+from src import rate_limiter
+from src.media_derivatives import normalize_images, video_derivative
+
 # Configuración de logging para este módulo
 logger = logging.getLogger(__name__)
 
@@ -18,51 +22,102 @@ password = os.getenv("INSTAGRAM_PASSWORD")
 if not username or not password:
     raise ValueError("Credenciales de Instagram (INSTAGRAM_USERNAME, INSTAGRAM_PASSWORD) no encontradas en el fichero .env")
 
-# Usar una variable global para guardar el cliente en memoria y no tener que loguear
-# ni leer el fichero en cada llamada dentro del mismo ciclo del scheduler.
+# Segundos que se bloquea el limitador cuando Instagram pide esperar
+THROTTLE_BACKOFF_SECONDS = 600
+
+# Sesión de instagrapi guardada en disco (cookies y uuids del dispositivo), reutilizada entre procesos
+SESSION_FILE = os.getenv("INSTAGRAM_SESSION_PATH", "sessions/ig_session.json")
+
+# Cliente compartido por el proceso (UI y workers del scheduler). instagrapi no es seguro
+# entre hilos, así que su uso se serializa con el lock.
 _client_instance = None
+_client_lock = threading.RLock()
 
 
 def get_instagram_client() -> Client:
     """
     Obtiene un cliente de Instagrapi logueado.
-    Reutiliza una sesión guardada si existe y es válida.
-    Si no, crea una nueva sesión y la guarda para futuros usos.
+
+    Reutiliza el cliente en memoria si existe. Si no, carga la sesión guardada y la valida
+    con una llamada autenticada barata; solo si no es válida (o no existe) se hace login.
     """
     global _client_instance
 
-    # Si ya existe un cliente válido en memoria, devolverlo directamente
-    if _client_instance:
-        logger.info("Reutilizando cliente de Instagram desde la memoria.")
-        return _client_instance
+    with _client_lock:
+        # Si ya existe un cliente válido en memoria, devolverlo directamente
+        if _client_instance:
+            return _client_instance
 
-    # Si no, crear uno nuevo
-    client = Client()
-    session_file = "sessions/ig_session.json"
+        client = Client()
 
-    # Intentar usar una sesión existente
-    if os.path.exists(session_file):
-        try:
-            logger.info(f"Intentando cargar la sesión desde {session_file}...")
-            client.load_settings(session_file)
-            client.login(username, password)
-            logger.info("Sesión reutilizada con éxito.")
-            _client_instance = client  # Guardar el cliente en memoria
-            return client
-        except Exception as e:
-            logger.warning(f"La sesión guardada era inválida. Se creará una nueva. Error: {e}")
-
-    # Si no hay sesión o la anterior falló, login completo
-    logger.info("Realizando un nuevo login completo en Instagram...")
+        # Intentar usar una sesión existente
+        if os.path.exists(SESSION_FILE):
+            try:
+                logger.info(f"Intentando cargar la sesión desde {SESSION_FILE}...")
+                client.load_settings(SESSION_FILE)
+                client.account_info()
+                logger.info("Sesión reutilizada con éxito (sin nuevo login).")
+                _save_session(client)
+                _client_instance = client
+                return client
+            except Exception as e:
+                logger.warning(f"La sesión guardada no es válida. Se iniciará sesión de nuevo. Error: {e}")
+
+        _login(client)
+        _client_instance = client
+        return client
+
+
+def _login(client: Client) -> None:
+    """
+    Inicia sesión conservando los identificadores del dispositivo de la sesión anterior
+    (si la había), para que Instagram no lo vea como un dispositivo nuevo.
+    """
+    logger.info("Realizando login en Instagram...")
+    uuids = client.get_settings().get("uuids")
+    client.set_settings({})
+    if uuids:
+        client.set_uuids(uuids)
     try:
         client.login(username, password)
-        logger.info("Login en Instagram exitoso. Guardando nueva sesión...")
-        client.dump_settings(session_file)
-        _client_instance = client  # Guardar el cliente en memoria
-        return client
     except Exception as e:
         logger.critical(f"FALLO CRÍTICO: No se pudo iniciar sesión en Instagram. Error: {e}")
         raise e
+    logger.info("Login en Instagram exitoso. Guardando nueva sesión...")
+    _save_session(client)
+
+
+def _save_session(client: Client) -> None:
+    """Guarda la sesión en disco de forma atómica y solo legible por el usuario."""
+    os.makedirs(os.path.dirname(SESSION_FILE) or ".", exist_ok=True)
+    tmp_path = f"{SESSION_FILE}.tmp"
+    try:
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(client.get_settings(), f, indent=4)
+        os.replace(tmp_path, SESSION_FILE)
+    except OSError as e:
+        logger.warning(f"No se pudo guardar la sesión de Instagram en {SESSION_FILE}: {e}")
+
+
+def _upload_with_rate_limit(upload_func, **kwargs):
+    """
+    Ejecuta una subida de instagrapi consumiendo un token del limitador compartido.
+    Si Instagram pide esperar, bloquea el bucket para que ni la UI ni el scheduler insistan.
+    Si la sesión ha caducado, inicia sesión de nuevo y reintenta una vez.
+    """
+    rate_limiter.acquire("instagram", username)
+    with _client_lock:
+        try:
+            return upload_func(**kwargs)
+        except LoginRequired as e:
+            logger.warning(f"La sesión de Instagram ha caducado. Se inicia sesión de nuevo. Error: {e}")
+            _login(upload_func.__self__)
+            return upload_func(**kwargs)
+        except (PleaseWaitFewMinutes, ClientThrottledError) as e:
+            logger.error(f"Instagram ha limitado las peticiones: {e}")
+            rate_limiter.register_retry_after("instagram", username, THROTTLE_BACKOFF_SECONDS)
+            raise
 
 
 def post_image_ig(image_path: str, caption: str):
@@ -70,9 +125,12 @@ def post_image_ig(image_path: str, caption: str):
     if not os.path.exists(image_path):
         raise FileNotFoundError(f"No se encuentra la imagen: {image_path}")
     client = get_instagram_client()
+    upload_path = normalize_images([image_path], "instagram")[0]
+    if not upload_path:
+        raise ValueError(f"No se pudo procesar la imagen: {image_path}")
     logger.info(f"Subiendo imagen a Instagram: {image_path}")
     try:
-        media = client.photo_upload(path=image_path, caption=caption)
+        media = _upload_with_rate_limit(client.photo_upload, path=upload_path, caption=caption)
         logger.info("Respuesta del servidor de Instagram (Imagen): %s", media.dict())
         return media.pk
     except ValidationError as e:
@@ -84,77 +142,65 @@ def post_image_ig(image_path: str, caption: str):
 
 
 def post_carousel_ig(image_paths: list, caption: str):
-    """Publica un carrusel, estandarizando las imágenes para máxima compatibilidad."""
+    """
+    Publica un carrusel. Las imágenes se normalizan a JPEG con la relación de aspecto y el
+    tamaño que admite Instagram (ver media_derivatives.py); los derivados quedan cacheados
+    para las siguientes publicaciones y reintentos.
+    """
     if not (2 <= len(image_paths) <= 10):
         raise ValueError("El carrusel debe contener entre 2 y 10 imágenes.")
 
     client = get_instagram_client()
-    processed_paths = []
-    temp_files_to_clean = []
 
-    logger.info("Procesando y estandarizando imágenes para el carrusel...")
-    try:
-        for path in image_paths:
-            if not os.path.exists(path):
-                logger.warning(f"La imagen {path} no existe y será omitida.")
-                continue
+    existing_paths = []
+    for path in image_paths:
+        if os.path.exists(path):
+            existing_paths.append(path)
+        else:
+            logger.warning(f"La imagen {path} no existe y será omitida.")
 
-            try:
-                with tempfile.NamedTemporaryFile(suffix=".jpg", delete=False) as temp_file:
-                    temp_path = temp_file.name
-                    with PIL.Image.open(path) as img:
-                        with img.convert('RGB') as converted_img:
-                            converted_img.save(temp_path, 'jpeg', quality=95)
-
-                processed_paths.append(temp_path)
-                temp_files_to_clean.append(temp_path)
-                logger.info(f"Imagen '{path}' procesada y guardada temporalmente en '{temp_path}'")
-            except Exception as e:
-                logger.error(f"Error procesando la imagen '{path}': {e}")
-                continue
-
-        if not processed_paths:
-            raise FileNotFoundError("Ninguna de las imágenes proporcionadas para el carrusel es válida.")
+    logger.info("Procesando y estandarizando imágenes para el carrusel...")
+    processed_paths = [p for p in normalize_images(existing_paths, "instagram") if p]
+    if not processed_paths:
+        raise FileNotFoundError("Ninguna de las imágenes proporcionadas para el carrusel es válida.")
 
-        logger.info(f"Subiendo carrusel a Instagram con {len(processed_paths)} imágenes procesadas.")
+    logger.info(f"Subiendo carrusel a Instagram con {len(processed_paths)} imágenes procesadas.")
 
-        try:
-            media = client.album_upload(paths=processed_paths, caption=caption)
-            logger.info("Respuesta del servidor de Instagram (Carrusel): %s", media.dict())
-            return media.pk
-        except ValidationError as e:
-            logger.warning(
-                f"Publicación de carrusel en Instagram completada, pero la respuesta del servidor no pudo ser validada. "
-                f"Asumiendo éxito. Error de Pydantic: {e}"
-            )
-            return True  # Devolver True indica éxito al scheduler
-        except ChallengeRequired as e:
-            logger.error("Instagram requiere una verificación de seguridad (ChallengeRequired): %s", e)
-            raise Exception("ERROR: La cuenta de Instagram requiere una verificación.")
-        except Exception as e:
-            logger.error("Error desconocido durante la subida del carrusel: %s", e)
-            raise e
-
-    finally:
-        # Limpieza de ficheros temporales
-        logger.info("Limpiando ficheros de imagen temporales...")
-        for temp_path in temp_files_to_clean:
-            if os.path.exists(temp_path):
-                try:
-                    os.remove(temp_path)
-                    logger.info(f"Fichero temporal '{temp_path}' eliminado.")
-                except Exception as e:
-                    logger.error(f"No se pudo eliminar el fichero temporal '{temp_path}': {e}")
+    try:
+        media = _upload_with_rate_limit(client.album_upload, paths=processed_paths, caption=caption)
+        logger.info("Respuesta del servidor de Instagram (Carrusel): %s", media.dict())
+        return media.pk
+    except ValidationError as e:
+        logger.warning(
+            f"Publicación de carrusel en Instagram completada, pero la respuesta del servidor no pudo ser validada. "
+            f"Asumiendo éxito. Error de Pydantic: {e}"
+        )
+        return True  # Devolver True indica éxito al scheduler
+    except ChallengeRequired as e:
+        logger.error("Instagram requiere una verificación de seguridad (ChallengeRequired): %s", e)
+        raise Exception("ERROR: La cuenta de Instagram requiere una verificación.")
+    except Exception as e:
+        logger.error("Error desconocido durante la subida del carrusel: %s", e)
+        raise e
 
 
 def post_video_ig(video_path: str, caption: str):
-    """Publica un vídeo en Instagram."""
+    """
+    Publica un vídeo en Instagram. Se sube el derivado H.264/AAC con su miniatura (ver
+    media_derivatives.py), generado la primera vez y reutilizado después; sin ffmpeg se
+    sube el original.
+    """
     if not os.path.exists(video_path):
         raise FileNotFoundError(f"No se encuentra el vídeo: {video_path}")
     client = get_instagram_client()
+    derivative = video_derivative(video_path, "instagram")
+    if derivative:
+        upload_args = {"path": Path(derivative["file_path"]), "thumbnail": Path(derivative["thumbnail_path"])}
+    else:
+        upload_args = {"path": video_path}
     logger.info(f"Subiendo vídeo a Instagram: {video_path}")
     try:
-        media = client.video_upload(path=video_path, caption=caption)
+        media = _upload_with_rate_limit(client.video_upload, **upload_args, caption=caption)
         logger.info("Respuesta del servidor de Instagram (Vídeo): %s", media.dict())
         return media.pk
     except ValidationError as e:
@@ -1,12 +1,66 @@
 import os
+import time
+import asyncio
 import requests
 import json
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
 from dotenv import load_dotenv
 import logging
 
+from src import http_client, rate_limiter
+
 # Logger
 logger = logging.getLogger(__name__)
 
+# Tiempo durante el que se reutiliza el URN del autor antes de volver a consultar /v2/userinfo
+URN_TTL_SECONDS = int(os.getenv("LINKEDIN_URN_TTL_SECONDS", "86400"))
+# Días antes de ACCESS_TOKEN_LINKEDIN_EXPIRES_AT a partir de los que se avisa en el log
+TOKEN_EXPIRY_WARNING_DAYS = 7
+# Imágenes de una misma publicación que se registran y suben a la vez
+UPLOAD_CONCURRENCY = max(1, int(os.getenv("LINKEDIN_UPLOAD_CONCURRENCY", "4")))
+# Los vídeos a partir de este tamaño se suben por partes (MULTIPART_UPLOAD)
+MULTIPART_THRESHOLD_BYTES = int(float(os.getenv("LINKEDIN_MULTIPART_THRESHOLD_MB", "25")) * 1024 * 1024)
+# Partes de vídeo que se suben a la vez y reintentos de cada parte
+PART_CONCURRENCY = max(1, int(os.getenv("LINKEDIN_PART_CONCURRENCY", "4")))
+PART_RETRIES = max(1, int(os.getenv("LINKEDIN_PART_RETRIES", "3")))
+# Tamaño de los bloques en los que se lee el fichero en las subidas asíncronas
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+# Segundos durante los que se reutiliza un registro de subida (y sus URLs) de un intento anterior.
+# Las URLs de subida de LinkedIn caducan; pasado este tiempo el medio se registra de nuevo.
+UPLOAD_URL_TTL_SECONDS = int(os.getenv("LINKEDIN_UPLOAD_URL_TTL_SECONDS", "3600"))
+# Bucket del limitador para los PUT a URLs de subida prefirmadas (RATE_LIMIT_LINKEDIN_UPLOAD_*),
+# independiente del de la API REST
+UPLOAD_BUCKET = "linkedin_upload"
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def _registration_fresh(registration: dict) -> bool:
+    """Indica si un registro de subida guardado en el ledger aún tiene URLs válidas."""
+    return time.time() - registration.get('registered_at', 0) < UPLOAD_URL_TTL_SECONDS
+
+
+def _upload_rejected(error: Exception) -> bool:
+    """
+    Indica si LinkedIn rechazó una subida con un 4xx que no es de token ni de throttling,
+    normalmente porque la URL de subida ha caducado.
+    """
+    status = getattr(getattr(error, "response", None), "status_code", None)
+    return status is not None and 400 <= status < 500 and status not in (401, 429)
+
+
+async def _iter_file_async(file_path: str):
+    """Lee el fichero por bloques en un hilo aparte y los va entregando al cliente httpx."""
+    with open(file_path, 'rb') as f:
+        while True:
+            chunk = await asyncio.to_thread(f.read, UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+
 
 class LinkedInClient:
     """
@@ -21,19 +75,86 @@ class LinkedInClient:
             logger.critical("❌ ERROR CRÍTICO: No se pudo cargar ACCESS_TOKEN_LINKEDIN desde el archivo .env.")
             raise ValueError("El token de acceso de LinkedIn no está configurado.")
 
+        self.token_expires_at = self._parse_token_expiry(os.getenv("ACCESS_TOKEN_LINKEDIN_EXPIRES_AT"))
+        self.rate_limit_account = rate_limiter.account_key(self.access_token)
+        self.api_base = os.getenv("LINKEDIN_API_BASE", "https://api.linkedin.com").rstrip("/")
         self.api_headers = {
             "Authorization": f"Bearer {self.access_token}",
             "Content-Type": "application/json",
             "X-Restli-Protocol-Version": "2.0.0"
         }
-        self.author_urn = self._get_user_urn()
         self.post_visibility = os.getenv("POST_VISIBILITY")
+        # Sesión compartida con keep-alive, timeouts y reintentos (ver http_client)
+        self.session = http_client.get_session("linkedin")
+        # Se marca a True si LinkedIn rechaza el token (401); get_linkedin_client creará otro cliente
+        self.invalidated = False
+        self._author_urn = None
+        self._author_urn_fetched_at = 0.0
+        self._urn_lock = threading.Lock()
+
+    @staticmethod
+    def _parse_token_expiry(value):
+        """Interpreta ACCESS_TOKEN_LINKEDIN_EXPIRES_AT (fecha ISO), si está configurada."""
+        if not value:
+            return None
+        try:
+            return datetime.fromisoformat(value)
+        except ValueError:
+            logger.warning(f"ACCESS_TOKEN_LINKEDIN_EXPIRES_AT no es una fecha ISO válida: {value}")
+            return None
+
+    def check_token(self):
+        """
+        Comprueba la caducidad conocida del token sin hacer peticiones.
+        Lanza ValueError si ya ha caducado y avisa si caduca en pocos días.
+        """
+        if self.invalidated:
+            raise ValueError("LinkedIn rechazó el token de acceso. Renueva ACCESS_TOKEN_LINKEDIN.")
+        if not self.token_expires_at:
+            return
+        remaining = self.token_expires_at - datetime.now()
+        if remaining.total_seconds() <= 0:
+            raise ValueError(f"El token de acceso de LinkedIn caducó el {self.token_expires_at.isoformat()}.")
+        if remaining.days < TOKEN_EXPIRY_WARNING_DAYS:
+            logger.warning(f"⚠️ El token de acceso de LinkedIn caduca en {remaining.days} días.")
+
+    @property
+    def author_urn(self):
+        """URN del autor, consultado a LinkedIn como mucho una vez cada URN_TTL_SECONDS."""
+        with self._urn_lock:
+            if not self._author_urn or time.monotonic() - self._author_urn_fetched_at > URN_TTL_SECONDS:
+                self._author_urn = self._get_user_urn()
+                self._author_urn_fetched_at = time.monotonic()
+            return self._author_urn
+
+    def _request(self, method: str, url: str, bucket: str = "linkedin", **kwargs) -> requests.Response:
+        """
+        Realiza una petición a LinkedIn respetando el limitador compartido.
+        Si LinkedIn responde 429, espera lo indicado en Retry-After y reintenta.
+        Las subidas a URLs prefirmadas usan su propio bucket (UPLOAD_BUCKET) para no gastar
+        el cupo de la API REST ni quedar limitadas a su ritmo.
+        """
+        for attempt in range(rate_limiter.MAX_THROTTLE_RETRIES + 1):
+            rate_limiter.acquire(bucket, self.rate_limit_account)
+            data = kwargs.get("data")
+            if attempt and hasattr(data, "seek"):
+                data.seek(0)
+            response = self.session.request(method, url, **kwargs)
+            if response.status_code == 401:
+                # Token caducado o revocado: no tiene sentido reutilizar este cliente
+                self.invalidated = True
+                logger.error("❌ LinkedIn rechazó el token de acceso (401). Se descarta el cliente en caché.")
+                break
+            if rate_limiter.check_response(bucket, self.rate_limit_account, response) is None:
+                break
+            logger.warning(f"LinkedIn respondió {response.status_code} (throttling). Intento {attempt + 1}.")
+        return response
 
     def _get_user_urn(self):
         """Obtiene el URN del usuario autenticado."""
         logger.info("Obteniendo URN de usuario de LinkedIn...")
         try:
-            response = requests.get("https://api.linkedin.com/v2/userinfo", headers={"Authorization": f"Bearer {self.access_token}"})
+            response = self._request("GET", f"{self.api_base}/v2/userinfo", headers={"Authorization": f"Bearer {self.access_token}"})
             response.raise_for_status()
             user_info = response.json()
             user_urn = f"urn:li:person:{user_info['sub']}"
@@ -46,25 +167,32 @@ class LinkedInClient:
     def _register_asset(self, is_video=False):
         """Registra un asset (imagen/video) y obtiene la URL de subida."""
         logger.info(f"Registrando nuevo asset ({'VIDEO' if is_video else 'IMAGE'})...")
+        payload = self._register_payload(is_video)
+        try:
+            response = self._request("POST", f"{self.api_base}/v2/assets?action=registerUpload", headers=self.api_headers, json=payload)
+            response.raise_for_status()
+            return self._parse_registration(response.json())
+        except requests.exceptions.HTTPError as e:
+            logger.error(f"❌ ERROR al registrar el asset en LinkedIn: {e.response.status_code} - {e.response.text}")
+            raise
+
+    def _register_payload(self, is_video=False) -> dict:
         asset_type = "VIDEO" if is_video else "IMAGE"
-        payload = {
+        return {
             "registerUploadRequest": {
                 "recipes": [f"urn:li:digitalmediaRecipe:feedshare-{asset_type.lower()}"],
                 "owner": self.author_urn,
                 "serviceRelationships": [{"relationshipType": "OWNER", "identifier": "urn:li:userGeneratedContent"}]
             }
         }
-        try:
-            response = requests.post("https://api.linkedin.com/v2/assets?action=registerUpload", headers=self.api_headers, json=payload)
-            response.raise_for_status()
-            data = response.json()
-            upload_url = data['value']['uploadMechanism']['com.linkedin.digitalmedia.uploading.MediaUploadHttpRequest']['uploadUrl']
-            asset_urn = data['value']['asset']
-            logger.info(f"✅ Asset registrado con éxito. URN: {asset_urn}")
-            return asset_urn, upload_url
-        except requests.exceptions.HTTPError as e:
-            logger.error(f"❌ ERROR al registrar el asset en LinkedIn: {e.response.status_code} - {e.response.text}")
-            raise
+
+    @staticmethod
+    def _parse_registration(data: dict):
+        """Extrae (URN del asset, URL de subida) de la respuesta de registerUpload."""
+        upload_url = data['value']['uploadMechanism']['com.linkedin.digitalmedia.uploading.MediaUploadHttpRequest']['uploadUrl']
+        asset_urn = data['value']['asset']
+        logger.info(f"✅ Asset registrado con éxito. URN: {asset_urn}")
+        return asset_urn, upload_url
 
     def _upload_file(self, upload_url, file_path):
         """Sube el contenido binario del fichero a la URL de subida."""
@@ -72,7 +200,7 @@ class LinkedInClient:
         try:
             with open(file_path, 'rb') as f:
                 headers = {'Content-Type': 'application/octet-stream'}
-                response = requests.put(upload_url, headers=headers, data=f)
+                response = self._request("PUT", upload_url, bucket=UPLOAD_BUCKET, headers=headers, data=f)
                 response.raise_for_status()
                 logger.info(f"✅ Fichero subido correctamente (Status: {response.status_code}).")
         except FileNotFoundError:
@@ -82,40 +210,369 @@ class LinkedInClient:
             logger.error(f"❌ ERROR al subir el fichero a LinkedIn: {e.response.status_code} - {e.response.text}")
             raise
 
-    def post(self, text: str, image_paths: list = None, video_path: str = None):
-        """Crea una nueva publicación en LinkedIn.
-        - Si no se proporcionan medios, publica solo texto.
-        - Si se proporciona video_path, publica el vídeo (ignora image_paths).
-        - Si se proporcionan image_paths, publica las imágenes.
+    def _upload_asset(self, file_path: str, is_video: bool = False, ledger=None) -> str:
         """
-        logger.info("Iniciando proceso de publicación en LinkedIn...")
+        Registra y sube un fichero, devolviendo el URN del asset.
+        Si se proporciona un ledger, reutiliza el registro o la subida ya completados en un intento anterior.
+        """
+        register_key = f"linkedin_register:{file_path}"
+        upload_key = f"linkedin_upload:{file_path}"
+
+        uploaded = ledger.get(upload_key) if ledger else None
+        if uploaded:
+            logger.info(f"Reutilizando asset ya subido para {file_path}: {uploaded['asset_urn']}")
+            return uploaded['asset_urn']
+
+        if is_video and os.path.getsize(file_path) >= MULTIPART_THRESHOLD_BYTES:
+            return self._upload_video_multipart(file_path, ledger=ledger)
+
+        registered = self._saved_registration(register_key, file_path, ledger)
+        for attempt in range(2):
+            if registered:
+                asset_urn, upload_url = registered['asset_urn'], registered['upload_url']
+            else:
+                asset_urn, upload_url = self._register_asset(is_video=is_video)
+                if ledger:
+                    ledger.record(register_key, {"asset_urn": asset_urn, "upload_url": upload_url,
+                                                 "registered_at": time.time()})
+
+            try:
+                self._upload_file(upload_url, file_path)
+                break
+            except Exception as e:
+                if attempt == 0 and _upload_rejected(e):
+                    logger.warning(f"LinkedIn rechazó la URL de subida de {file_path}. Se registra de nuevo.")
+                    self._forget_registration(asset_urn, [register_key], ledger)
+                    registered = None
+                    continue
+                if not ledger:
+                    self._delete_asset(asset_urn)
+                raise
+        if ledger:
+            ledger.record(upload_key, {"asset_urn": asset_urn})
+        return asset_urn
+
+    def _saved_registration(self, register_key: str, file_path: str, ledger=None):
+        """Registro de subida de un intento anterior, o None si no hay o sus URLs han caducado."""
+        registered = ledger.get(register_key) if ledger else None
+        if registered and not _registration_fresh(registered):
+            logger.info(f"El registro de subida de {file_path} ha caducado. Se registra de nuevo.")
+            self._forget_registration(registered['asset_urn'], [register_key], ledger)
+            return None
+        return registered
+
+    def _forget_registration(self, asset_urn: str, step_keys: list, ledger=None):
+        """Descarta un registro de subida inservible: olvida sus pasos y elimina el asset."""
+        if ledger:
+            ledger.forget(*step_keys)
+        self._delete_asset(asset_urn)
+
+    # --- Subida de vídeo por partes ---
+    def _register_multipart(self, file_size: int) -> dict:
+        """
+        Registra un vídeo con MULTIPART_UPLOAD. LinkedIn devuelve las partes en las que hay
+        que dividir el fichero, cada una con su URL de subida.
+
+        Returns:
+            dict: Estado de la subida (asset_urn, media_artifact, metadata y partes), apto para el ledger.
+        """
+        logger.info(f"Registrando vídeo para subida por partes ({file_size / (1024 * 1024):.1f} MB)...")
+        payload = self._register_payload(is_video=True)
+        payload["registerUploadRequest"]["supportedUploadMechanism"] = ["MULTIPART_UPLOAD"]
+        payload["registerUploadRequest"]["fileSize"] = file_size
+        try:
+            response = self._request("POST", f"{self.api_base}/v2/assets?action=registerUpload", headers=self.api_headers, json=payload)
+            response.raise_for_status()
+        except requests.exceptions.HTTPError as e:
+            logger.error(f"❌ ERROR al registrar el vídeo en LinkedIn: {e.response.status_code} - {e.response.text}")
+            raise
+
+        value = response.json()['value']
+        mechanism = value['uploadMechanism']['com.linkedin.digitalmedia.uploading.MultipartUpload']
+        parts = [{
+            "url": part['url'],
+            "first_byte": part['byteRange']['firstByte'],
+            "last_byte": part['byteRange']['lastByte'],
+            "headers": part.get('headers', {})
+        } for part in mechanism['partUploadRequests']]
+        logger.info(f"✅ Vídeo registrado. URN: {value['asset']} ({len(parts)} partes)")
+        return {
+            "asset_urn": value['asset'],
+            "media_artifact": value.get('mediaArtifact'),
+            "metadata": mechanism.get('metadata'),
+            "parts": parts,
+            "registered_at": time.time()
+        }
 
+    def _upload_part(self, file_path: str, part: dict) -> dict:
+        """
+        Sube una parte del vídeo, leyendo del disco solo su rango de bytes.
+        Reintenta los errores de red y de servidor con espera exponencial.
+
+        Returns:
+            dict: Respuesta de la parte para completeMultiPartUpload.
+        """
+        size = part['last_byte'] - part['first_byte'] + 1
+        for attempt in range(PART_RETRIES):
+            try:
+                with open(file_path, 'rb') as f:
+                    f.seek(part['first_byte'])
+                    data = f.read(size)
+                headers = {'Content-Type': 'application/octet-stream', **part['headers']}
+                response = self._request("PUT", part['url'], bucket=UPLOAD_BUCKET, headers=headers, data=data)
+                response.raise_for_status()
+                return {"httpStatusCode": response.status_code, "headers": {"ETag": response.headers.get("ETag")}}
+            except requests.exceptions.RequestException as e:
+                if attempt == PART_RETRIES - 1 or self.invalidated:
+                    raise
+                wait = 2 ** attempt
+                logger.warning(f"Fallo al subir la parte {part['first_byte']}-{part['last_byte']} de {file_path}: {e}. "
+                               f"Reintentando en {wait}s...")
+                time.sleep(wait)
+
+    def _upload_video_multipart(self, file_path: str, ledger=None) -> str:
+        """
+        Sube un vídeo grande por partes, en paralelo (LINKEDIN_PART_CONCURRENCY) y con
+        reintentos por parte. Con un ledger, el registro y cada parte subida quedan guardados
+        en la BD, de modo que un reintento solo sube las partes pendientes.
+        La memoria usada es como mucho una parte por hilo, sea cual sea el tamaño del fichero.
+        Si el registro ha caducado o LinkedIn rechaza las partes (URLs caducadas), el vídeo se
+        registra de nuevo y se sube desde el principio.
+        """
+        state_key = f"linkedin_multipart:{file_path}"
+        upload_key = f"linkedin_upload:{file_path}"
+
+        state = self._saved_registration(state_key, file_path, ledger)
+        if state is None and ledger:
+            # Olvidar también las partes del registro caducado, si las había
+            ledger.forget(*[key for key in ledger.steps() if key.startswith(f"{state_key}:part:")])
+
+        for attempt in range(2):
+            if not state:
+                state = self._register_multipart(os.path.getsize(file_path))
+                if ledger:
+                    ledger.record(state_key, state)
+
+            parts = state['parts']
+            part_responses, errors = self._upload_parts(file_path, state_key, parts, ledger)
+            if errors and attempt == 0 and any(_upload_rejected(e) for _, e in errors):
+                logger.warning(f"LinkedIn rechazó {len(errors)} partes de {file_path}. Se registra de nuevo el vídeo.")
+                self._forget_registration(state['asset_urn'],
+                                          [state_key] + [f"{state_key}:part:{i}" for i in range(len(parts))], ledger)
+                state = None
+                continue
+            break
+
+        if errors:
+            if not ledger:
+                self._delete_asset(state['asset_urn'])
+            index, error = errors[0]
+            raise RuntimeError(f"Fallo al subir {len(errors)} de {len(parts)} partes del vídeo {file_path} "
+                               f"(parte {index}: {error})") from error
+
+        logger.info(f"Completando la subida por partes de {file_path}...")
+        payload = {
+            "completeMultipartUploadRequest": {
+                "mediaArtifact": state['media_artifact'],
+                "metadata": state['metadata'],
+                "partUploadResponses": part_responses
+            }
+        }
+        try:
+            response = self._request("POST", f"{self.api_base}/v2/assets?action=completeMultiPartUpload",
+                                     headers=self.api_headers, json=payload)
+            response.raise_for_status()
+        except requests.exceptions.HTTPError as e:
+            logger.error(f"❌ ERROR al completar la subida del vídeo: {e.response.status_code} - {e.response.text}")
+            raise
+
+        logger.info(f"✅ Vídeo subido por partes correctamente: {state['asset_urn']}")
+        if ledger:
+            ledger.record(upload_key, {"asset_urn": state['asset_urn']})
+        return state['asset_urn']
+
+    def _upload_parts(self, file_path: str, state_key: str, parts: list, ledger=None):
+        """
+        Sube en paralelo las partes aún no subidas, guardando cada una en el ledger.
+
+        Returns:
+            tuple: (respuesta de cada parte o None, lista de (índice, error) de las que fallaron).
+        """
+        part_responses = [ledger.get(f"{state_key}:part:{i}") if ledger else None for i in range(len(parts))]
+        pending = [i for i, response in enumerate(part_responses) if response is None]
+        if len(pending) < len(parts):
+            logger.info(f"Reanudando subida de {file_path}: {len(parts) - len(pending)} de {len(parts)} partes ya subidas.")
+
+        errors = []
+        with ThreadPoolExecutor(max_workers=max(1, min(PART_CONCURRENCY, len(pending)))) as pool:
+            futures = {pool.submit(self._upload_part, file_path, parts[i]): i for i in pending}
+            for future in as_completed(futures):
+                index = futures[future]
+                try:
+                    part_responses[index] = future.result()
+                    if ledger:
+                        ledger.record(f"{state_key}:part:{index}", part_responses[index])
+                except Exception as e:
+                    errors.append((index, e))
+        return part_responses, errors
+
+    def _delete_asset(self, asset_urn: str):
+        """Elimina un asset que no llegó a publicarse (sin propagar errores)."""
+        asset_id = asset_urn.split(":")[-1]
+        try:
+            response = self._request("DELETE", f"{self.api_base}/v2/assets/{asset_id}", headers=self.api_headers)
+            response.raise_for_status()
+            logger.info(f"Asset huérfano eliminado: {asset_urn}")
+        except Exception as e:
+            logger.warning(f"No se pudo eliminar el asset huérfano {asset_urn}: {e}")
+
+    def _discard_assets(self, asset_urns: list, ledger=None):
+        """
+        Tras un fallo parcial, elimina los assets ya subidos. Con ledger se conservan,
+        porque el reintento los reutilizará.
+        """
+        if not asset_urns:
+            return
+        if ledger:
+            logger.info(f"Se conservan {len(asset_urns)} assets ya subidos para reanudar la publicación.")
+            return
+        for asset_urn in asset_urns:
+            self._delete_asset(asset_urn)
+
+    def _upload_images(self, image_paths: list, ledger=None) -> list:
+        """
+        Registra y sube varias imágenes a la vez (como mucho LINKEDIN_UPLOAD_CONCURRENCY),
+        devolviendo los URN en el mismo orden que `image_paths`. Como en `_upload_parts`, los
+        hilos solo suben y el ledger se lee y escribe desde el hilo que llama.
+        Si alguna falla, descarta las ya subidas (ver `_discard_assets`) y lanza RuntimeError.
+        """
+        asset_urns = [None] * len(image_paths)
+        registrations = [None] * len(image_paths)
+        pending = []
+        for index, path in enumerate(image_paths):
+            uploaded = ledger.get(f"linkedin_upload:{path}") if ledger else None
+            if uploaded:
+                logger.info(f"Reutilizando asset ya subido para {path}: {uploaded['asset_urn']}")
+                asset_urns[index] = uploaded['asset_urn']
+            else:
+                registrations[index] = self._saved_registration(f"linkedin_register:{path}", path, ledger)
+                pending.append(index)
+
+        errors = []
+        with ThreadPoolExecutor(max_workers=max(1, min(UPLOAD_CONCURRENCY, len(pending)))) as pool:
+            futures = {pool.submit(self._upload_image, image_paths[i], registrations[i], ledger is not None): i
+                       for i in pending}
+            for future in as_completed(futures):
+                index = futures[future]
+                path = image_paths[index]
+                try:
+                    registered = future.result()
+                except Exception as e:
+                    errors.append((path, e))
+                    # Conservar el registro para que el reintento no vuelva a registrar la imagen
+                    registered = getattr(e, 'registration', None)
+                    if ledger and registered and registered is not registrations[index]:
+                        ledger.record(f"linkedin_register:{path}", registered)
+                    continue
+                asset_urns[index] = registered['asset_urn']
+                if ledger:
+                    if registered is not registrations[index]:
+                        ledger.record(f"linkedin_register:{path}", registered)
+                    ledger.record(f"linkedin_upload:{path}", {"asset_urn": registered['asset_urn']})
+
+        if errors:
+            self._discard_assets([urn for urn in asset_urns if urn], ledger)
+            path, error = errors[0]
+            raise RuntimeError(f"Fallo al subir {len(errors)} de {len(image_paths)} imágenes a LinkedIn "
+                               f"(primer error en {path}: {error})") from error
+        return asset_urns
+
+    def _upload_image(self, file_path: str, registered: dict = None, keep: bool = False) -> dict:
+        """
+        Registra (si no hay un registro previo) y sube una imagen, sin tocar el ledger.
+        Si LinkedIn rechaza la URL de subida, registra de nuevo una vez.
+
+        Returns:
+            dict: El registro usado (asset_urn, upload_url, registered_at). Si la subida falla
+                  y `keep` es True, la excepción lo lleva en `registration` para conservarlo;
+                  si no, el asset se elimina.
+        """
+        for attempt in range(2):
+            if not registered:
+                asset_urn, upload_url = self._register_asset(is_video=False)
+                registered = {"asset_urn": asset_urn, "upload_url": upload_url, "registered_at": time.time()}
+            try:
+                self._upload_file(registered['upload_url'], file_path)
+                return registered
+            except Exception as e:
+                if attempt == 0 and _upload_rejected(e):
+                    logger.warning(f"LinkedIn rechazó la URL de subida de {file_path}. Se registra de nuevo.")
+                    self._delete_asset(registered['asset_urn'])
+                    registered = None
+                    continue
+                if keep:
+                    e.registration = registered
+                else:
+                    self._delete_asset(registered['asset_urn'])
+                raise
+
+    def prepare_media(self, image_paths: list = None, video_path: str = None, ledger=None):
+        """
+        Registra y sube los medios de una publicación sin publicarla.
+        Con un ledger, permite subirlos por adelantado y reutilizarlos al publicar.
+
+        Returns:
+            tuple: (shareMediaCategory, lista de medios para el payload de ugcPosts).
+        """
         # Publicación con vídeo
         if video_path:
             logger.info("Tipo de publicación: VÍDEO")
-            asset_urn, upload_url = self._register_asset(is_video=True)
-            self._upload_file(upload_url, video_path)
-            media_category = "VIDEO"
-            media_list = [{"status": "READY", "media": asset_urn}]
+            asset_urn = self._upload_asset(video_path, is_video=True, ledger=ledger)
+            return "VIDEO", [{"status": "READY", "media": asset_urn}]
 
         # Publicación con imágenes
-        elif image_paths:
+        if image_paths:
             logger.info(f"Tipo de publicación: IMAGEN ({len(image_paths)} ficheros)")
-            asset_urns = []
-            for path in image_paths:
-                asset_urn, upload_url = self._register_asset(is_video=False)
-                self._upload_file(upload_url, path)
-                asset_urns.append(asset_urn)
-            media_category = "IMAGE"
-            media_list = [{"status": "READY", "media": urn} for urn in asset_urns]
+            asset_urns = self._upload_images(image_paths, ledger=ledger)
+            return "IMAGE", [{"status": "READY", "media": urn} for urn in asset_urns]
 
         # Solo texto
-        else:
-            logger.info("Tipo de publicación: TEXTO")
-            media_category = "NONE"
-            media_list = []
+        logger.info("Tipo de publicación: TEXTO")
+        return "NONE", []
+
+    def post(self, text: str, image_paths: list = None, video_path: str = None, ledger=None):
+        """Crea una nueva publicación en LinkedIn.
+        - Si no se proporcionan medios, publica solo texto.
+        - Si se proporciona video_path, publica el vídeo (ignora image_paths).
+        - Si se proporcionan image_paths, publica las imágenes.
+        - Si se proporciona un PublishLedger, los pasos completados en intentos anteriores no se repiten.
+        """
+        logger.info("Iniciando proceso de publicación en LinkedIn...")
+        self.check_token()
+
+        published = ledger.get("linkedin_post") if ledger else None
+        if published:
+            logger.info("La publicación en LinkedIn ya se completó en un intento anterior.")
+            return published
 
-        # Payload de la publicación
+        media_category, media_list = self.prepare_media(image_paths=image_paths, video_path=video_path, ledger=ledger)
+        payload = self._post_payload(text, media_category, media_list)
+
+        logger.info("Enviando payload final a LinkedIn...")
+        try:
+            response = self._request("POST", f"{self.api_base}/v2/ugcPosts", headers=self.api_headers, data=json.dumps(payload))
+            response.raise_for_status()
+            logger.info("🎉 ¡Publicación en LinkedIn realizada con éxito!")
+            result = response.json()
+            if ledger:
+                ledger.record("linkedin_post", result)
+            return result
+        except requests.exceptions.HTTPError as e:
+            logger.error(f"❌ ERROR al crear la publicación final en LinkedIn: {e.response.status_code} - {e.response.text}")
+            raise
+
+    def _post_payload(self, text: str, media_category: str, media_list: list) -> dict:
+        """Construye el payload de ugcPosts."""
         payload = {
             "author": self.author_urn,
             "lifecycleState": "PUBLISHED",
@@ -131,13 +588,136 @@ class LinkedInClient:
         # Añadir la clave "media" solo si hay medios
         if media_list:
             payload["specificContent"]["com.linkedin.ugc.ShareContent"]["media"] = media_list
+        return payload
+
+    # --- Variantes asíncronas (ver src/async_http.py) ---
+    async def _request_async(self, client, method: str, url: str, bucket: str = "linkedin", **kwargs):
+        """Equivalente asíncrono de `_request`. Lanza RuntimeError si la respuesta es un error."""
+        from src import async_http
+
+        response = await async_http.request(client, bucket, self.rate_limit_account, method, url, **kwargs)
+        if response.status_code == 401:
+            self.invalidated = True
+            logger.error("❌ LinkedIn rechazó el token de acceso (401). Se descarta el cliente en caché.")
+        if response.is_error:
+            logger.error(f"❌ ERROR de LinkedIn en {method} {url}: {response.status_code} - {response.text}")
+            error = RuntimeError(f"Error de LinkedIn ({response.status_code}): {response.text}")
+            error.response = response  # como en requests.HTTPError, para consultar el status
+            raise error
+        return response
+
+    async def _upload_asset_async(self, client, file_path: str, is_video: bool = False, ledger=None) -> str:
+        """Versión asíncrona de `_upload_asset`, con los mismos pasos de ledger."""
+        register_key = f"linkedin_register:{file_path}"
+        upload_key = f"linkedin_upload:{file_path}"
+
+        uploaded = ledger.get(upload_key) if ledger else None
+        if uploaded:
+            logger.info(f"Reutilizando asset ya subido para {file_path}: {uploaded['asset_urn']}")
+            return uploaded['asset_urn']
+
+        if is_video and os.path.getsize(file_path) >= MULTIPART_THRESHOLD_BYTES:
+            # La subida por partes ya es paralela y acotada: se ejecuta en un hilo aparte
+            return await asyncio.to_thread(self._upload_video_multipart, file_path, ledger)
+
+        registered = await asyncio.to_thread(self._saved_registration, register_key, file_path, ledger)
+        # El cuerpo se envía en streaming, con Content-Length, sin cargar el fichero en memoria
+        headers = {'Content-Type': 'application/octet-stream', 'Content-Length': str(os.path.getsize(file_path))}
+        for attempt in range(2):
+            if registered:
+                asset_urn, upload_url = registered['asset_urn'], registered['upload_url']
+            else:
+                logger.info(f"Registrando nuevo asset ({'VIDEO' if is_video else 'IMAGE'})...")
+                payload = await asyncio.to_thread(self._register_payload, is_video)
+                response = await self._request_async(client, "POST", f"{self.api_base}/v2/assets?action=registerUpload",
+                                                     headers=self.api_headers, json=payload)
+                asset_urn, upload_url = self._parse_registration(response.json())
+                if ledger:
+                    await asyncio.to_thread(ledger.record, register_key, {"asset_urn": asset_urn, "upload_url": upload_url,
+                                                                          "registered_at": time.time()})
+
+            logger.info(f"Subiendo fichero: {file_path}...")
+            try:
+                await self._request_async(client, "PUT", upload_url, bucket=UPLOAD_BUCKET, headers=headers,
+                                          content_factory=lambda: _iter_file_async(file_path))
+                break
+            except Exception as e:
+                if attempt == 0 and _upload_rejected(e):
+                    logger.warning(f"LinkedIn rechazó la URL de subida de {file_path}. Se registra de nuevo.")
+                    await asyncio.to_thread(self._forget_registration, asset_urn, [register_key], ledger)
+                    registered = None
+                    continue
+                if not ledger:
+                    await asyncio.to_thread(self._delete_asset, asset_urn)
+                raise
+        logger.info(f"✅ Fichero subido correctamente: {file_path}")
+        if ledger:
+            await asyncio.to_thread(ledger.record, upload_key, {"asset_urn": asset_urn})
+        return asset_urn
+
+    async def prepare_media_async(self, client, image_paths: list = None, video_path: str = None, ledger=None):
+        """Versión asíncrona de `prepare_media`: las imágenes se suben a la vez, conservando el orden."""
+        from src import async_http
+
+        if video_path:
+            logger.info("Tipo de publicación: VÍDEO")
+            asset_urn = await self._upload_asset_async(client, video_path, is_video=True, ledger=ledger)
+            return "VIDEO", [{"status": "READY", "media": asset_urn}]
+
+        if image_paths:
+            logger.info(f"Tipo de publicación: IMAGEN ({len(image_paths)} ficheros)")
+            results = await async_http.gather_limited(
+                [lambda path=path: self._upload_asset_async(client, path, is_video=False, ledger=ledger)
+                 for path in image_paths],
+                limit=UPLOAD_CONCURRENCY
+            )
+            errors = [(path, r) for path, r in zip(image_paths, results) if isinstance(r, Exception)]
+            if errors:
+                await asyncio.to_thread(self._discard_assets,
+                                        [r for r in results if not isinstance(r, Exception)], ledger)
+                path, error = errors[0]
+                raise RuntimeError(f"Fallo al subir {len(errors)} de {len(image_paths)} imágenes a LinkedIn "
+                                   f"(primer error en {path}: {error})") from error
+            asset_urns = results
+            return "IMAGE", [{"status": "READY", "media": urn} for urn in asset_urns]
+
+        logger.info("Tipo de publicación: TEXTO")
+        return "NONE", []
+
+    async def post_async(self, client, text: str, image_paths: list = None, video_path: str = None, ledger=None):
+        """Versión asíncrona de `post`."""
+        logger.info("Iniciando proceso de publicación asíncrona en LinkedIn...")
+        self.check_token()
+
+        published = ledger.get("linkedin_post") if ledger else None
+        if published:
+            logger.info("La publicación en LinkedIn ya se completó en un intento anterior.")
+            return published
+
+        media_category, media_list = await self.prepare_media_async(client, image_paths=image_paths,
+                                                                    video_path=video_path, ledger=ledger)
+        payload = await asyncio.to_thread(self._post_payload, text, media_category, media_list)
 
         logger.info("Enviando payload final a LinkedIn...")
-        try:
-            response = requests.post("https://api.linkedin.com/v2/ugcPosts", headers=self.api_headers, data=json.dumps(payload))
-            response.raise_for_status()
-            logger.info("🎉 ¡Publicación en LinkedIn realizada con éxito!")
-            return response.json()
-        except requests.exceptions.HTTPError as e:
-            logger.error(f"❌ ERROR al crear la publicación final en LinkedIn: {e.response.status_code} - {e.response.text}")
-            raise
+        response = await self._request_async(client, "POST", f"{self.api_base}/v2/ugcPosts",
+                                             headers=self.api_headers, json=payload)
+        logger.info("🎉 ¡Publicación en LinkedIn realizada con éxito!")
+        result = response.json()
+        if ledger:
+            await asyncio.to_thread(ledger.record, "linkedin_post", result)
+        return result
+
+
+def get_linkedin_client() -> LinkedInClient:
+    """
+    Devuelve el cliente de LinkedIn compartido por el proceso, creándolo si no existe.
+    Se reemplaza si cambia ACCESS_TOKEN_LINKEDIN o si LinkedIn rechazó el token anterior,
+    releyendo el .env por si el token se ha renovado.
+    """
+    global _client
+    with _client_lock:
+        if _client is not None and _client.invalidated:
+            load_dotenv(override=True)
+        if _client is None or _client.invalidated or _client.access_token != os.getenv("ACCESS_TOKEN_LINKEDIN"):
+            _client = LinkedInClient()
+        return _client
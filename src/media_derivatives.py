@@ -0,0 +1,347 @@
+"""
+Derivados de los medios adaptados a los requisitos de cada plataforma, cacheados en disco.
+
+Las imágenes para Instagram se normalizan a JPEG RGB con la relación de aspecto y el lado
+máximo que admite el feed. El nombre de cada derivado incluye el hash del contenido original
+y el perfil de destino, así que publicar o reintentar con los mismos medios reutiliza los
+derivados ya generados. Las imágenes que aún no tienen derivado se procesan en paralelo en
+un pool de procesos (IG_NORMALIZE_WORKERS) que se crea la primera vez que hace falta y se
+reutiliza durante toda la vida del proceso.
+
+Los vídeos se transcodifican una vez con ffmpeg a MP4 H.264/AAC y se extrae su miniatura;
+ambos se registran contra el MediaAsset (tabla `media_derivatives`), de modo que las
+publicaciones y reintentos siguientes los reutilizan sin volver a leer el original.
+
+Cada reutilización actualiza la fecha de modificación del derivado; `evict_derivatives()`
+borra los que llevan más de MEDIA_DERIVATIVES_MAX_AGE_DAYS días sin usarse.
+"""
+
+import os
+import json
+import time
+import shutil
+import hashlib
+import logging
+import threading
+import subprocess
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, List, Optional
+
+from src.file_hash import file_sha256
+
+logger = logging.getLogger(__name__)
+
+DERIVATIVES_DIR = os.getenv("MEDIA_DERIVATIVES_DIR", os.path.join("media", "derivatives"))
+NORMALIZE_WORKERS = max(1, int(os.getenv("IG_NORMALIZE_WORKERS", str(min(4, os.cpu_count() or 1)))))
+# Días sin usarse tras los que se borra un derivado (0 = no se borran)
+MAX_AGE_DAYS = float(os.getenv("MEDIA_DERIVATIVES_MAX_AGE_DAYS", "30"))
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+# Perfiles de imagen: relación de aspecto admitida (ancho / alto), lado máximo en píxeles y
+# calidad JPEG. Instagram acepta en el feed desde 4:5 (vertical) hasta 1,91:1 (horizontal).
+IMAGE_PROFILES = {
+    "instagram": {
+        "min_aspect": 4 / 5,
+        "max_aspect": 1.91,
+        "max_side": int(os.getenv("IG_IMAGE_MAX_SIDE", "1080")),
+        "quality": 95,
+    },
+}
+
+FFMPEG_BIN = os.getenv("FFMPEG_BIN", "ffmpeg")
+FFMPEG_TIMEOUT_SECONDS = int(os.getenv("FFMPEG_TIMEOUT_SECONDS", "1800"))
+
+# Perfiles de vídeo: relación de aspecto admitida, ancho máximo, duración máxima (se recorta
+# lo que sobre), fotogramas por segundo máximos y calidad (CRF de x264).
+VIDEO_PROFILES = {
+    "instagram": {
+        "min_aspect": 4 / 5,
+        "max_aspect": 1.91,
+        "max_width": int(os.getenv("IG_VIDEO_MAX_WIDTH", "1080")),
+        "max_seconds": int(os.getenv("IG_VIDEO_MAX_SECONDS", "3600")),
+        "max_fps": 30,
+        "crf": 23,
+        "audio_bitrate": "128k",
+    },
+}
+
+
+def _profile_tag(profile: str, params: Dict) -> str:
+    """Nombre del perfil más un hash de sus parámetros: si cambian, los derivados se regeneran."""
+    digest = hashlib.sha1(json.dumps(params, sort_keys=True).encode("utf-8")).hexdigest()
+    return f"{profile}-{digest[:8]}"
+
+
+def image_derivative_path(source_path: str, profile: str = "instagram") -> str:
+    """Ruta del derivado de una imagen para un perfil (exista o no todavía)."""
+    tag = _profile_tag(profile, IMAGE_PROFILES[profile])
+    return os.path.join(DERIVATIVES_DIR, f"{file_sha256(source_path)}_{tag}.jpg")
+
+
+def _clamp_aspect(img, min_aspect: float, max_aspect: float):
+    """Recorta la imagen por el centro para dejar su relación de aspecto dentro del rango."""
+    width, height = img.size
+    aspect = width / height
+    if aspect > max_aspect:
+        new_width = int(height * max_aspect)
+        left = (width - new_width) // 2
+        return img.crop((left, 0, left + new_width, height))
+    if aspect < min_aspect:
+        new_height = int(width / min_aspect)
+        top = (height - new_height) // 2
+        return img.crop((0, top, width, top + new_height))
+    return img
+
+
+def normalize_image(source_path: str, target_path: str, params: Dict) -> str:
+    """
+    Genera el JPEG normalizado de una imagen. Se ejecuta en los procesos del pool, así que
+    solo recibe y devuelve datos serializables. El fichero se escribe de forma atómica.
+    """
+    from PIL import Image, ImageOps
+
+    with Image.open(source_path) as img:
+        img = ImageOps.exif_transpose(img).convert("RGB")
+        img = _clamp_aspect(img, params["min_aspect"], params["max_aspect"])
+        img.thumbnail((params["max_side"], params["max_side"]), Image.Resampling.LANCZOS)
+        # El redondeo del redimensionado puede sacar la relación de aspecto del rango por un píxel
+        img = _clamp_aspect(img, params["min_aspect"], params["max_aspect"])
+
+        tmp_path = f"{target_path}.{os.getpid()}.tmp"
+        try:
+            img.save(tmp_path, "jpeg", quality=params["quality"])
+            os.replace(tmp_path, target_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+    return target_path
+
+
+def _get_pool(workers: int) -> ProcessPoolExecutor:
+    """
+    Devuelve el pool de procesos compartido, creándolo si no existe. Cada proceso hijo
+    arranca importando de nuevo el script principal (y con él sus dependencias, incluida la
+    configuración de la BD), así que ese coste se paga una sola vez y no en cada carrusel.
+    Los hijos solo ejecutan `normalize_image`, que no usa la BD. El tamaño del pool lo fija
+    la primera llamada.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # "spawn" evita heredar los locks de los hilos del proceso (UI, workers del scheduler)
+            _pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+
+def _discard_pool(pool: ProcessPoolExecutor) -> None:
+    """Descarta un pool roto (p. ej. porque murió un proceso hijo) para que se cree otro."""
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def normalize_images(paths: List[str], profile: str = "instagram",
+                     workers: int = NORMALIZE_WORKERS) -> List[Optional[str]]:
+    """
+    Devuelve el derivado de cada imagen para el perfil indicado, generando en paralelo los
+    que aún no existen.
+
+    Args:
+        paths: Rutas de las imágenes originales.
+        profile: Perfil de destino (clave de IMAGE_PROFILES).
+        workers: Procesos para generar los derivados que faltan (1 = en este proceso). Fija
+                 el tamaño del pool compartido cuando este se crea.
+
+    Returns:
+        list: La ruta del derivado de cada imagen, en el mismo orden, o None si la imagen
+              no existe o no se pudo procesar.
+    """
+    params = IMAGE_PROFILES[profile]
+    os.makedirs(DERIVATIVES_DIR, exist_ok=True)
+
+    results: List[Optional[str]] = [None] * len(paths)
+    pending: Dict[str, List[int]] = {}
+    sources: Dict[str, str] = {}
+    for index, path in enumerate(paths):
+        try:
+            target = image_derivative_path(path, profile)
+        except OSError as e:
+            logger.error(f"No se puede leer la imagen '{path}': {e}")
+            continue
+        if os.path.exists(target):
+            _touch(target)
+            results[index] = target
+        else:
+            pending.setdefault(target, []).append(index)
+            sources.setdefault(target, path)
+
+    reused = sum(r is not None for r in results)
+    if reused:
+        logger.info(f"Imágenes ({profile}): {reused} derivados reutilizados.")
+    if not pending:
+        return results
+
+    logger.info(f"Imágenes ({profile}): generando {len(pending)} derivados.")
+    if workers <= 1 or len(pending) == 1:
+        outcomes = {}
+        for target in pending:
+            try:
+                outcomes[target] = normalize_image(sources[target], target, params)
+            except Exception as e:
+                outcomes[target] = e
+    else:
+        pool = _get_pool(workers)
+        outcomes = {}
+        try:
+            futures = {target: pool.submit(normalize_image, sources[target], target, params) for target in pending}
+        except BrokenProcessPool as e:
+            _discard_pool(pool)
+            futures = {}
+            outcomes = {target: e for target in pending}
+        for target, future in futures.items():
+            try:
+                outcomes[target] = future.result()
+            except BrokenProcessPool as e:
+                _discard_pool(pool)
+                outcomes[target] = e
+            except Exception as e:
+                outcomes[target] = e
+
+    for target, outcome in outcomes.items():
+        if isinstance(outcome, Exception):
+            logger.error(f"Error procesando la imagen '{sources[target]}': {outcome}")
+            continue
+        for index in pending[target]:
+            results[index] = outcome
+    return results
+
+
+def _run_ffmpeg(ffmpeg: str, args: List[str], target_path: str) -> None:
+    """Ejecuta ffmpeg escribiendo en un fichero temporal que luego sustituye al destino."""
+    root, ext = os.path.splitext(target_path)
+    tmp_path = f"{root}.{os.getpid()}.tmp{ext}"
+    try:
+        result = subprocess.run([ffmpeg, "-y", "-v", "error", *args, tmp_path], capture_output=True, text=True,
+                                timeout=FFMPEG_TIMEOUT_SECONDS)
+        if result.returncode != 0:
+            raise RuntimeError(result.stderr.strip() or f"ffmpeg terminó con código {result.returncode}")
+        os.replace(tmp_path, target_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def _transcode_video(ffmpeg: str, source_path: str, target_path: str, thumbnail_path: str, params: Dict) -> None:
+    """Transcodifica el vídeo al perfil y extrae su miniatura del resultado."""
+    # Recorte centrado a la relación de aspecto admitida y escalado al ancho máximo, con
+    # dimensiones pares (necesarias para yuv420p)
+    video_filter = (
+        f"crop='trunc(min(iw,ih*{params['max_aspect']})/2)*2':'trunc(min(ih,iw/{params['min_aspect']})/2)*2',"
+        f"scale='trunc(min({params['max_width']},iw)/2)*2':-2,setsar=1"
+    )
+    _run_ffmpeg(ffmpeg, [
+        "-i", source_path, "-t", str(params["max_seconds"]),
+        "-vf", video_filter, "-fpsmax", str(params["max_fps"]),
+        "-c:v", "libx264", "-preset", "medium", "-crf", str(params["crf"]), "-profile:v", "high",
+        "-pix_fmt", "yuv420p",
+        "-c:a", "aac", "-b:a", params["audio_bitrate"], "-ar", "44100", "-ac", "2",
+        "-movflags", "+faststart",
+    ], target_path)
+    # El filtro thumbnail elige el fotograma más representativo del inicio del vídeo
+    _run_ffmpeg(ffmpeg, ["-i", target_path, "-vf", "thumbnail", "-frames:v", "1", "-q:v", "2"], thumbnail_path)
+
+
+def video_derivative(source_path: str, profile: str = "instagram") -> Optional[Dict[str, str]]:
+    """
+    Devuelve el vídeo transcodificado al perfil y su miniatura, generándolos si hace falta.
+
+    Si el vídeo es un MediaAsset con derivado registrado, se reutiliza sin leer el original.
+
+    Returns:
+        dict: `file_path` y `thumbnail_path` del derivado, o None si ffmpeg no está
+              disponible o la transcodificación falla (se debe publicar el original).
+    """
+    # Importación diferida, como en el resto de funciones que usan la BD
+    from src.db_config import get_asset_ids_from_paths, get_media_derivative, save_media_derivative
+
+    params = VIDEO_PROFILES[profile]
+    tag = _profile_tag(profile, params)
+    asset_ids = get_asset_ids_from_paths([source_path])
+    asset_id = asset_ids[0] if asset_ids else None
+
+    if asset_id is not None:
+        derivative = get_media_derivative(asset_id, tag)
+        if derivative and os.path.exists(derivative["file_path"]) and os.path.exists(derivative["thumbnail_path"] or ""):
+            _touch(derivative["file_path"], derivative["thumbnail_path"])
+            logger.info(f"Vídeo ({profile}): derivado reutilizado para '{source_path}'.")
+            return {"file_path": derivative["file_path"], "thumbnail_path": derivative["thumbnail_path"]}
+
+    content_hash = file_sha256(source_path)
+    target_path = os.path.join(DERIVATIVES_DIR, f"{content_hash}_{tag}.mp4")
+    thumbnail_path = os.path.join(DERIVATIVES_DIR, f"{content_hash}_{tag}.jpg")
+
+    if not (os.path.exists(target_path) and os.path.exists(thumbnail_path)):
+        ffmpeg = shutil.which(FFMPEG_BIN)
+        if not ffmpeg:
+            logger.warning(f"No se encuentra ffmpeg ('{FFMPEG_BIN}'). Se publicará el vídeo original sin adaptar.")
+            return None
+
+        logger.info(f"Vídeo ({profile}): transcodificando '{source_path}'...")
+        os.makedirs(DERIVATIVES_DIR, exist_ok=True)
+        try:
+            _transcode_video(ffmpeg, source_path, target_path, thumbnail_path, params)
+        except (RuntimeError, OSError, subprocess.TimeoutExpired) as e:
+            logger.error(f"Error transcodificando el vídeo '{source_path}'. Se publicará el original. Error: {e}")
+            return None
+
+    if asset_id is not None:
+        try:
+            save_media_derivative(asset_id, tag, content_hash, target_path, thumbnail_path)
+        except Exception as e:
+            logger.warning(f"No se pudo registrar el derivado del MediaAsset {asset_id}: {e}")
+    return {"file_path": target_path, "thumbnail_path": thumbnail_path}
+
+
+def _touch(*paths: str) -> None:
+    """Marca los derivados como usados ahora (ver `evict_derivatives`)."""
+    for path in paths:
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+
+def evict_derivatives(max_age_days: float = MAX_AGE_DAYS) -> int:
+    """
+    Borra del directorio de derivados los ficheros que llevan más de `max_age_days` días sin
+    usarse, y los registros de `media_derivatives` que apuntaban a ellos. Si se vuelven a
+    necesitar, se generan de nuevo.
+
+    Returns:
+        int: Número de ficheros borrados.
+    """
+    from src.db_config import delete_media_derivatives_by_paths
+
+    if max_age_days <= 0 or not os.path.isdir(DERIVATIVES_DIR):
+        return 0
+
+    limit = time.time() - max_age_days * 86400
+    removed = []
+    for entry in os.scandir(DERIVATIVES_DIR):
+        try:
+            if entry.is_file() and entry.stat().st_mtime < limit:
+                os.remove(entry.path)
+                removed.append(entry.path)
+        except OSError as e:
+            logger.warning(f"No se pudo borrar el derivado '{entry.path}': {e}")
+
+    if removed:
+        delete_media_derivatives_by_paths(removed)
+        logger.info(f"Derivados: {len(removed)} ficheros sin usar en {max_age_days:g} días borrados.")
+    return len(removed)
@@ -0,0 +1,179 @@
+"""
+Métricas del scheduler en formato de texto de Prometheus.
+
+Implementación mínima (contadores, gauges e histogramas con etiquetas) sin dependencias
+externas. El scheduler expone las métricas en http://<host>:<puerto>/metrics con
+`start_metrics_server`, configurable con SCHEDULER_METRICS_HOST y SCHEDULER_METRICS_PORT.
+"""
+
+import bisect
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterable, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+_registry = []
+_lock = threading.Lock()
+
+DURATION_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+LAG_BUCKETS = (5, 15, 30, 60, 120, 300, 600, 1800, 3600, 7200, 21600)
+
+
+def _escape_label(value: str) -> str:
+    """Escapa `\\`, `"` y saltos de línea como exige el formato de texto de Prometheus."""
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(label_names: Tuple[str, ...], label_values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape_label(str(value))}"' for name, value in zip(label_names, label_values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labels: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._values: Dict[Tuple[str, ...], object] = {}
+        with _lock:
+            _registry.append(self)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.label_names)
+
+    def _samples(self):
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with _lock:
+            lines.extend(self._samples())
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        with _lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def get(self, **labels) -> float:
+        with _lock:
+            return self._values.get(self._key(labels), 0.0)
+
+    def _samples(self):
+        return [f"{self.name}{_format_labels(self.label_names, key)} {value}" for key, value in self._values.items()]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value: float, **labels) -> None:
+        with _lock:
+            self._values[self._key(labels)] = float(value)
+
+    def _samples(self):
+        return [f"{self.name}{_format_labels(self.label_names, key)} {value}" for key, value in self._values.items()]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels: Iterable[str] = (), buckets=DURATION_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with _lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), [0, 0.0]))
+            index = bisect.bisect_left(self.buckets, value)
+            if index < len(counts):
+                counts[index] += 1
+            total[0] += 1
+            total[1] += value
+            self._values[key] = (counts, total)
+
+    def _samples(self):
+        lines = []
+        for key, (counts, (count, total)) in self._values.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.label_names, key, 'le="%s"' % bound)
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.label_names, key, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{labels} {count}")
+            lines.append(f"{self.name}_count{_format_labels(self.label_names, key)} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(self.label_names, key)} {total}")
+        return lines
+
+
+def render_all() -> str:
+    """Devuelve todas las métricas registradas en formato de texto de Prometheus."""
+    with _lock:
+        metrics = list(_registry)
+    return "\n".join(metric.render() for metric in metrics) + "\n"
+
+
+# --- Métricas del publicador ---
+QUEUE_DEPTH = Gauge("publicador_queue_depth", "Publicaciones programadas pendientes de enviar.")
+DUE_UNSENT = Gauge("publicador_due_unsent", "Publicaciones vencidas que aún no se han enviado.")
+PUBLISH_LAG = Histogram("publicador_publish_lag_seconds", "Retraso entre fecha_hora y el envío real.",
+                        labels=("platform",), buckets=LAG_BUCKETS)
+PLATFORM_PUBLISH_DURATION = Histogram("publicador_platform_publish_seconds",
+                                      "Duración de la publicación completa de un post por plataforma.",
+                                      labels=("platform",))
+PLATFORM_ERRORS = Counter("publicador_platform_errors_total", "Publicaciones fallidas por plataforma.",
+                          labels=("platform",))
+POSTS_PUBLISHED = Counter("publicador_posts_published_total", "Publicaciones completadas por plataforma.",
+                          labels=("platform",))
+CYCLE_DURATION = Histogram("publicador_cycle_duration_seconds", "Duración de cada ciclo del scheduler.")
+HTTP_REQUESTS = Counter("publicador_http_requests_total", "Peticiones HTTP a las plataformas por cliente y código.",
+                        labels=("client", "status"))
+HTTP_REQUEST_DURATION = Histogram("publicador_http_request_seconds", "Duración de las peticiones HTTP por cliente.",
+                                  labels=("client",))
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render_all().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Evitar que cada scrape ensucie el log del scheduler
+        pass
+
+
+def start_metrics_server(port: int, host: str = "127.0.0.1") -> Optional[ThreadingHTTPServer]:
+    """
+    Arranca el endpoint /metrics en un hilo en segundo plano.
+
+    Returns:
+        ThreadingHTTPServer | None: El servidor, o None si el puerto es 0 o no se pudo abrir.
+    """
+    if not port:
+        return None
+    try:
+        server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    except OSError as e:
+        logger.error(f"No se pudo abrir el endpoint de métricas en {host}:{port}: {e}")
+        return None
+    threading.Thread(target=server.serve_forever, daemon=True, name="metrics-server").start()
+    logger.info(f"Métricas disponibles en http://{host}:{port}/metrics")
+    return server
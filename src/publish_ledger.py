@@ -0,0 +1,48 @@
+"""
+Ledger de publicación: registra cada paso remoto completado de un post
+(subida de medios a WordPress, assets de LinkedIn, post final...) para que
+los reintentos continúen desde el primer paso pendiente.
+"""
+
+import logging
+from typing import Any, Optional
+
+from src.db_config import get_publish_steps, record_publish_step, delete_publish_steps, clear_publish_steps
+
+logger = logging.getLogger(__name__)
+
+
+class PublishLedger:
+    """
+    Vista en memoria del ledger de un post, respaldada por la tabla `publish_steps`.
+    """
+
+    def __init__(self, post_id: int):
+        self.post_id = post_id
+        self._steps = get_publish_steps(post_id)
+        if self._steps:
+            logger.info(f"Reanudando post {post_id}: {len(self._steps)} pasos ya completados.")
+
+    def get(self, step_key: str) -> Optional[Any]:
+        """Devuelve el resultado de un paso completado, o None si está pendiente."""
+        return self._steps.get(step_key)
+
+    def record(self, step_key: str, result: Any) -> None:
+        """Guarda el resultado de un paso completado."""
+        record_publish_step(self.post_id, step_key, result)
+        self._steps[step_key] = result
+
+    def steps(self) -> list:
+        """Claves de los pasos completados."""
+        return list(self._steps)
+
+    def forget(self, *step_keys: str) -> None:
+        """Olvida pasos completados para que se repitan (p. ej. porque su resultado caducó)."""
+        delete_publish_steps(self.post_id, list(step_keys))
+        for step_key in step_keys:
+            self._steps.pop(step_key, None)
+
+    def clear(self) -> None:
+        """Elimina el ledger una vez que la publicación ha terminado con éxito."""
+        clear_publish_steps(self.post_id)
+        self._steps = {}
@@ -0,0 +1,551 @@
+"""
+Servicio de publicación unificado.
+
+Contiene un adaptador por plataforma y es el único punto desde el que se publica un post,
+tanto para el scheduler como para los trabajos encolados desde el botón "Publicar ahora".
+Los módulos de cada plataforma se importan de forma perezosa: así, la falta de credenciales
+de una plataforma (p. ej. Instagram) no impide publicar en las demás.
+"""
+
+import os
+import time
+import asyncio
+import logging
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+from typing import Callable, List, Optional
+
+from src import metrics
+from src.publish_ledger import PublishLedger
+
+logger = logging.getLogger(__name__)
+
+ProgressCallback = Optional[Callable[[str], None]]
+
+# Medios de un mismo post que se suben a WordPress a la vez
+WP_UPLOAD_CONCURRENCY = max(1, int(os.getenv("WP_UPLOAD_CONCURRENCY", "4")))
+
+# Posts que se están publicando en este proceso (ciclo del scheduler o trabajos de "Publicar ahora").
+# Evita que ambos publiquen el mismo post a la vez.
+_posts_en_curso = set()
+_posts_en_curso_lock = threading.Lock()
+
+
+def reservar_post(post_id: int) -> bool:
+    """Reserva un post para publicarlo. Devuelve False si ya lo está publicando otro hilo."""
+    with _posts_en_curso_lock:
+        if post_id in _posts_en_curso:
+            return False
+        _posts_en_curso.add(post_id)
+        return True
+
+
+def liberar_post(post_id: int) -> None:
+    """Libera la reserva de `reservar_post`."""
+    with _posts_en_curso_lock:
+        _posts_en_curso.discard(post_id)
+
+
+def base_platform(platform: str) -> str:
+    """
+    Normaliza el nombre de la plataforma eliminando sufijos como '(Idioma)'.
+    Ej: "WordPress (Inglés)" -> "wordpress"
+    """
+    return (platform or '').lower().split(' (')[0].strip()
+
+
+def _informar(progress: ProgressCallback, mensaje: str) -> None:
+    logger.info(mensaje)
+    if progress:
+        try:
+            progress(mensaje)
+        except Exception as e:
+            logger.warning(f"No se pudo notificar el progreso: {e}")
+
+
+def _progreso_subida(progress: ProgressCallback, nombre: str) -> Optional[Callable[[int, int], None]]:
+    """Adapta el progreso en bytes de una subida a mensajes de progreso cada 25 %."""
+    if not progress:
+        return None
+    ultimo = [0]
+
+    def _callback(enviados: int, total: int):
+        porcentaje = int(enviados * 100 / total) if total else 100
+        if porcentaje >= ultimo[0] + 25 or (porcentaje == 100 and ultimo[0] < 100):
+            ultimo[0] = porcentaje
+            _informar(progress, f"Subiendo {nombre}: {porcentaje}%")
+
+    return _callback
+
+
+def rutas_medios(post: dict):
+    """Devuelve las rutas existentes de imágenes y vídeos asociados a un post."""
+    media_assets = post.get('media_assets', [])
+    image_paths = [asset['file_path'] for asset in media_assets if
+                   asset['file_type'] == 'image' and os.path.exists(asset['file_path'])]
+    video_paths = [asset['file_path'] for asset in media_assets if
+                   asset['file_type'] == 'video' and os.path.exists(asset['file_path'])]
+    return image_paths, video_paths
+
+
+# --- Adaptadores por plataforma ---
+def _subir_medios_wordpress(post: dict, image_paths: list, video_paths: list, ledger: PublishLedger,
+                            progress: ProgressCallback = None) -> list:
+    """
+    Sube a WordPress las imágenes y vídeos de un post (reutilizando los ya subidos según el ledger)
+    y devuelve el HTML para incrustarlos en el contenido, en el orden original.
+    Las subidas se hacen a la vez, como mucho WP_UPLOAD_CONCURRENCY; un fallo solo omite ese medio.
+    """
+    from src.wordpress import upload_media
+
+    post_id = post.get('id')
+    title = post.get('title', 'Sin título')
+    paths = image_paths + video_paths
+    if not paths:
+        return []
+
+    def _subir(path: str):
+        tipo = "imagen" if path in image_paths else "vídeo"
+        _informar(progress, f"Subiendo {tipo} para incrustar: {os.path.basename(path)}")
+        return upload_media(path, progress=_progreso_subida(progress, os.path.basename(path)) if tipo == "vídeo" else None)
+
+    resultados = [ledger.get(f"wordpress_media:{path}") for path in paths]
+    pendientes = [i for i, resultado in enumerate(resultados) if resultado is None]
+    if len(pendientes) < len(paths):
+        logger.info(f"Post {post_id}: {len(paths) - len(pendientes)} medios ya subidos a WordPress. Se reutilizan.")
+
+    if pendientes:
+        with ThreadPoolExecutor(max_workers=min(WP_UPLOAD_CONCURRENCY, len(pendientes))) as pool:
+            futures = {pool.submit(_subir, paths[i]): i for i in pendientes}
+            for future in as_completed(futures):
+                index = futures[future]
+                try:
+                    resultados[index] = future.result()
+                except Exception as e:
+                    resultados[index] = e
+                    continue
+                if resultados[index] is not None:
+                    try:
+                        ledger.record(f"wordpress_media:{paths[index]}", resultados[index])
+                    except Exception as e:
+                        logger.warning(f"No se pudo guardar en el ledger la subida de {paths[index]}: {e}")
+
+    return _html_medios(post_id, title, paths, image_paths, resultados, progress)
+
+
+def _html_medios(post_id, title: str, paths: list, image_paths: list, resultados: list,
+                 progress: ProgressCallback = None) -> list:
+    """Construye el HTML de los medios subidos e informa de los que fallaron."""
+    embedded_media_html = []
+    for path, info in zip(paths, resultados):
+        if isinstance(info, Exception):
+            tipo = "imagen" if path in image_paths else "vídeo"
+            logger.error(f"Error al subir {tipo} para incrustar ({path}) para el post {post_id}: {info}")
+            _informar(progress, f"No se pudo subir {os.path.basename(path)}: {info}")
+        elif info and 'url' in info:
+            if path in image_paths:
+                embedded_media_html.append(f'<p><img src="{info["url"]}" alt="{title}"></p>')
+            else:
+                embedded_media_html.append(f'<p>[video src="{info["url"]}"]</p>')
+    return embedded_media_html
+
+
+def _publicar_wordpress(post: dict, ledger: PublishLedger, progress: ProgressCallback = None) -> bool:
+    from src.wordpress import create_post_wordpress
+
+    post_id = post.get('id')
+    image_paths, video_paths = rutas_medios(post)
+    _informar(progress, f"Iniciando publicación en WordPress para el post {post_id}")
+
+    # Extraer datos del post
+    title = post.get('title', 'Sin título')
+    content = post.get('content', '')
+
+    embedded_media_html = _subir_medios_wordpress(post, image_paths, video_paths, ledger, progress)
+
+    # Construir contenido final
+    final_content = content + "\n\n" + "\n".join(embedded_media_html)
+
+    # Crear el post (salvo que ya se creara en un intento anterior)
+    if not ledger.get("wordpress_post"):
+        _informar(progress, "Creando el post en WordPress...")
+        wp_post = create_post_wordpress(
+            title=title,
+            content=final_content,
+            status='publish'  # Publicar directamente
+        )
+        if not (wp_post and wp_post.get('id')):
+            logger.error(f"Fallo al crear la publicación en WordPress para el post {post_id}.")
+            return False
+        ledger.record("wordpress_post", {"id": wp_post['id'], "link": wp_post.get('link')})
+
+    wp_post = ledger.get("wordpress_post")
+    _informar(progress, f"Publicación en WordPress creada con éxito. ID: {wp_post['id']} {wp_post.get('link') or ''}".strip())
+    return True
+
+
+def _publicar_correo(post: dict, ledger: PublishLedger, progress: ProgressCallback = None) -> bool:
+    """
+    Envía el correo de un post. Usa Microsoft Graph si está configurado y, si no, SMTP.
+    Los destinatarios pasan por el outbox (ver src/email_outbox.py): se envían por bloques
+    y, si alguno falla, los reintentos solo reenvían los bloques pendientes.
+    """
+    from src.email_outbox import enqueue_post, drain_post
+
+    receivers = post.get('contacts', [])
+    if not receivers:
+        _informar(progress, "El post no tiene destinatarios.")
+        return False
+    _informar(progress, f"Enviando correo a {len(receivers)} destinatarios...")
+
+    enqueue_post(post)
+    return _resultado_correo(drain_post(post, progress), progress)
+
+
+def _resultado_correo(summary: dict, progress: ProgressCallback = None) -> bool:
+    """
+    Resume el estado del outbox de un correo. El post está enviado cuando no le quedan bloques
+    pendientes y se entregó al menos a parte de los destinatarios (ver email_outbox.py).
+    """
+    pendientes = summary['queued'] + summary['sending']
+    if summary['total'] and summary['sent'] == summary['total']:
+        _informar(progress, f"Correo enviado exitosamente a {summary['total']} destinatarios.")
+        return True
+    if summary['sent'] and not pendientes:
+        logger.warning(f"Correo entregado parcialmente: {summary['failed']} destinatarios fallidos.")
+        _informar(progress, f"Correo entregado a {summary['sent']}/{summary['total']} destinatarios "
+                            f"({summary['failed']} fallidos; se pueden reintentar desde la lista de posts).")
+        return True
+    _informar(progress, f"Correo entregado a {summary['sent']}/{summary['total']} destinatarios "
+                        f"({pendientes} pendientes de reintento, {summary['failed']} fallidos).")
+    return False
+
+
+def _publicar_instagram(post: dict, ledger: PublishLedger, progress: ProgressCallback = None) -> bool:
+    from src.instagram import post_image_ig, post_carousel_ig, post_video_ig
+
+    post_id = post.get('id')
+    image_paths, video_paths = rutas_medios(post)
+    caption = post.get('content', '')
+
+    if video_paths:
+        _informar(progress, f"Publicando vídeo en Instagram: {os.path.basename(video_paths[0])}")
+        post_video_ig(video_path=video_paths[0], caption=caption)
+    elif image_paths:
+        if len(image_paths) == 1:
+            _informar(progress, f"Publicando imagen única en Instagram: {os.path.basename(image_paths[0])}")
+            post_image_ig(image_path=image_paths[0], caption=caption)
+        else:
+            _informar(progress, f"Publicando carrusel en Instagram con {len(image_paths)} imágenes")
+            post_carousel_ig(image_paths=image_paths, caption=caption)
+    else:
+        logger.warning(f"Post de Instagram ID {post_id} no tiene medios válidos para publicar.")
+        return False
+
+    _informar(progress, "Publicación en Instagram realizada con éxito.")
+    return True
+
+
+def _medios_linkedin(post: dict):
+    """LinkedIn permite un vídeo o una o varias imágenes, no ambos. Se prioriza el vídeo."""
+    image_paths, video_paths = rutas_medios(post)
+    video_to_post = video_paths[0] if video_paths else None
+    images_to_post = image_paths if not video_to_post and image_paths else None
+    return images_to_post, video_to_post
+
+
+def _publicar_linkedin(post: dict, ledger: PublishLedger, progress: ProgressCallback = None) -> bool:
+    from src.linkedin import get_linkedin_client
+
+    _informar(progress, "Iniciando publicación en LinkedIn...")
+    images_to_post, video_to_post = _medios_linkedin(post)
+    get_linkedin_client().post(
+        text=post.get('content', ''),
+        video_path=video_to_post,
+        image_paths=images_to_post,
+        ledger=ledger
+    )
+    _informar(progress, "Publicación en LinkedIn realizada con éxito.")
+    return True
+
+
+def _publicar_whatsapp(post: dict, ledger: PublishLedger, progress: ProgressCallback = None) -> bool:
+    _informar(progress, f"La publicación para WhatsApp (ID: {post.get('id')}) se omite según la configuración actual.")
+    return True  # Devolver True para que el post se elimine de la cola y no se reintente
+
+
+ADAPTERS = {
+    'wordpress': _publicar_wordpress,
+    'gmail': _publicar_correo,
+    'instagram': _publicar_instagram,
+    'linkedin': _publicar_linkedin,
+    'whatsapp': _publicar_whatsapp,
+}
+
+
+def publicar_post(post: dict, progress: ProgressCallback = None) -> bool:
+    """
+    Publica un post según su plataforma, adjuntando los medios asociados.
+
+    Args:
+        post: Diccionario del post (ver `db_config.model_to_dict`).
+        progress: Función opcional que recibe mensajes de progreso.
+
+    Returns:
+        bool: True si la publicación se completó.
+    """
+    try:
+        if not post or not post.get('id'):
+            logger.warning(f"Se intentó procesar un post inválido: {post}")
+            return False
+
+        post_id = post.get('id')
+        platform = base_platform(post.get('platform', ''))
+        logger.info(f"Procesando post ID: {post_id} para la plataforma: {platform}")
+
+        adapter = ADAPTERS.get(platform)
+        if adapter is None:
+            logger.warning(f"Plataforma desconocida o sin acción de publicación: {post.get('platform')} para el post {post_id}")
+            return False
+
+        # Ledger con los pasos remotos ya completados en intentos anteriores
+        ledger = PublishLedger(post_id)
+        inicio = time.monotonic()
+        try:
+            ok = adapter(post, ledger, progress)
+        finally:
+            metrics.PLATFORM_PUBLISH_DURATION.observe(time.monotonic() - inicio, platform=platform)
+        (metrics.POSTS_PUBLISHED if ok else metrics.PLATFORM_ERRORS).inc(platform=platform)
+        return ok
+
+    except Exception as e:
+        metrics.PLATFORM_ERRORS.inc(platform=base_platform(post.get('platform', '')) if post else '')
+        logger.error(f"Error fatal al publicar el post ID {post.get('id', 'desconocido')} en {post.get('platform', 'desconocido')}: {e}")
+        logger.error(traceback.format_exc())
+        if progress:
+            progress(f"Error: {e}")
+        return False
+
+
+# --- Motor asíncrono (ver src/async_http.py) ---
+async def _subir_medio_wordpress_async(client, path: str, ledger: PublishLedger) -> Optional[dict]:
+    """Sube un medio a WordPress. El ledger se lee de memoria y se escribe en un hilo aparte."""
+    from src.wordpress import upload_media_async
+
+    step_key = f"wordpress_media:{path}"
+    if ledger.get(step_key):
+        return ledger.get(step_key)
+    info = await upload_media_async(client, path)
+    if info is not None:
+        await asyncio.to_thread(ledger.record, step_key, info)
+    return info
+
+
+async def _publicar_wordpress_async(client, post: dict, ledger: PublishLedger, progress: ProgressCallback = None) -> bool:
+    from src import async_http
+    from src.wordpress import create_post_wordpress_async
+
+    post_id = post.get('id')
+    image_paths, video_paths = rutas_medios(post)
+    title = post.get('title', 'Sin título')
+    _informar(progress, f"Iniciando publicación asíncrona en WordPress para el post {post_id} "
+                        f"({len(image_paths) + len(video_paths)} medios)")
+
+    paths = image_paths + video_paths
+    results = await async_http.gather_limited(
+        [lambda path=path: _subir_medio_wordpress_async(client, path, ledger) for path in paths],
+        limit=WP_UPLOAD_CONCURRENCY
+    )
+    embedded_media_html = _html_medios(post_id, title, paths, image_paths, results, progress)
+
+    if not ledger.get("wordpress_post"):
+        _informar(progress, "Creando el post en WordPress...")
+        wp_post = await create_post_wordpress_async(
+            client,
+            title=title,
+            content=post.get('content', '') + "\n\n" + "\n".join(embedded_media_html),
+            status='publish'
+        )
+        if not (wp_post and wp_post.get('id')):
+            logger.error(f"Fallo al crear la publicación en WordPress para el post {post_id}.")
+            return False
+        await asyncio.to_thread(ledger.record, "wordpress_post", {"id": wp_post['id'], "link": wp_post.get('link')})
+
+    wp_post = ledger.get("wordpress_post")
+    _informar(progress, f"Publicación en WordPress creada con éxito. ID: {wp_post['id']} {wp_post.get('link') or ''}".strip())
+    return True
+
+
+async def _publicar_correo_async(client, post: dict, ledger: PublishLedger, progress: ProgressCallback = None) -> bool:
+    from src.email_outbox import enqueue_post, drain_post_async
+    from src.graph_mail import get_graph_config
+
+    if not get_graph_config():
+        # SMTP no tiene variante asíncrona: se envía en un hilo aparte
+        return await asyncio.to_thread(_publicar_correo, post, ledger, progress)
+
+    receivers = post.get('contacts', [])
+    if not receivers:
+        _informar(progress, "El post no tiene destinatarios.")
+        return False
+    _informar(progress, f"Enviando correo a {len(receivers)} destinatarios...")
+
+    await asyncio.to_thread(enqueue_post, post)
+    return _resultado_correo(await drain_post_async(client, post, progress), progress)
+
+
+async def _publicar_linkedin_async(client, post: dict, ledger: PublishLedger, progress: ProgressCallback = None) -> bool:
+    from src.linkedin import get_linkedin_client
+
+    _informar(progress, "Iniciando publicación en LinkedIn...")
+    images_to_post, video_to_post = _medios_linkedin(post)
+    linkedin = await asyncio.to_thread(get_linkedin_client)
+    await linkedin.post_async(
+        client,
+        text=post.get('content', ''),
+        video_path=video_to_post,
+        image_paths=images_to_post,
+        ledger=ledger
+    )
+    _informar(progress, "Publicación en LinkedIn realizada con éxito.")
+    return True
+
+
+ASYNC_ADAPTERS = {
+    'wordpress': _publicar_wordpress_async,
+    'gmail': _publicar_correo_async,
+    'linkedin': _publicar_linkedin_async,
+}
+
+
+async def publicar_post_async(client, post: dict, progress: ProgressCallback = None) -> bool:
+    """
+    Equivalente asíncrono de `publicar_post`. Las plataformas sin adaptador asíncrono
+    (Instagram, WhatsApp) se publican con el adaptador síncrono en un hilo aparte.
+    """
+    platform = base_platform(post.get('platform', '') if post else '')
+    adapter = ASYNC_ADAPTERS.get(platform)
+    if adapter is None or not post.get('id'):
+        return await asyncio.to_thread(publicar_post, post, progress)
+
+    post_id = post.get('id')
+    logger.info(f"Procesando post ID: {post_id} para la plataforma: {platform} (motor asíncrono)")
+    inicio = time.monotonic()
+    try:
+        ledger = await asyncio.to_thread(PublishLedger, post_id)
+        ok = await adapter(client, post, ledger, progress)
+    except Exception as e:
+        ok = False
+        logger.error(f"Error fatal al publicar el post ID {post_id} en {post.get('platform', 'desconocido')}: {e}")
+        logger.error(traceback.format_exc())
+    finally:
+        metrics.PLATFORM_PUBLISH_DURATION.observe(time.monotonic() - inicio, platform=platform)
+    (metrics.POSTS_PUBLISHED if ok else metrics.PLATFORM_ERRORS).inc(platform=platform)
+    return ok
+
+
+def publicar_posts(posts: List[dict]) -> List[bool]:
+    """
+    Publica varios posts a la vez con el motor asíncrono, en un único hilo.
+
+    Returns:
+        list: Resultado de cada post, en el mismo orden.
+    """
+    from src import async_http
+
+    async def _publicar_todos():
+        async with async_http.build_client("publisher") as client:
+            return await async_http.gather_limited(
+                [lambda post=post: publicar_post_async(client, post) for post in posts],
+                return_exceptions=False
+            )
+
+    return async_http.run(_publicar_todos())
+
+
+def preparar_post(post: dict) -> bool:
+    """
+    Prepara por adelantado un post programado: valida sus medios y los sube a las plataformas
+    que admiten medios sin publicar (biblioteca de WordPress, assets de LinkedIn). Para Instagram
+    genera los derivados (imágenes normalizadas, vídeo transcodificado y su miniatura).
+    Los resultados quedan en el ledger o en la caché de derivados, de modo que a la hora
+    programada solo queda la llamada final.
+    """
+    post_id = post.get('id')
+    platform = base_platform(post.get('platform', ''))
+    ledger = PublishLedger(post_id)
+
+    if ledger.get("prepared"):
+        return True
+
+    missing = [asset['file_path'] for asset in post.get('media_assets', []) if not os.path.exists(asset['file_path'])]
+    for path in missing:
+        logger.warning(f"Preparación del post {post_id}: el fichero {path} no existe y se omitirá al publicar.")
+
+    try:
+        if platform == 'wordpress':
+            image_paths, video_paths = rutas_medios(post)
+            _subir_medios_wordpress(post, image_paths, video_paths, ledger)
+        elif platform == 'linkedin':
+            from src.linkedin import get_linkedin_client
+            images_to_post, video_to_post = _medios_linkedin(post)
+            get_linkedin_client().prepare_media(image_paths=images_to_post, video_path=video_to_post, ledger=ledger)
+        elif platform == 'instagram':
+            from src.media_derivatives import normalize_images, video_derivative
+            # Mismos medios que elegirá _publicar_instagram: el vídeo tiene prioridad
+            image_paths, video_paths = rutas_medios(post)
+            if video_paths:
+                video_derivative(video_paths[0], "instagram")
+            elif image_paths:
+                normalize_images(image_paths, "instagram")
+
+        ledger.record("prepared", {"at": datetime.now().isoformat()})
+        logger.info(f"Post ID {post_id} preparado con antelación.")
+        return True
+    except Exception as e:
+        # Un fallo aquí no es grave: se reintentará en el siguiente ciclo o al publicar
+        logger.warning(f"No se pudo preparar por adelantado el post ID {post_id}: {e}")
+        return False
+
+
+def ejecutar_trabajo(job: dict) -> bool:
+    """
+    Ejecuta un trabajo de la cola de publicación, volcando el progreso en la BD para la UI.
+    Si el post estaba programado, se marca como enviado para que el scheduler no lo repita.
+    Si el ciclo del scheduler está publicando el mismo post, espera a que termine y no lo
+    vuelve a publicar si el ciclo lo publicó después de encolarse el trabajo.
+    """
+    from src.db_config import get_post_by_id, update_post, update_publish_job
+
+    job_id = job['id']
+    if not reservar_post(job['post_id']):
+        update_publish_job(job_id, progress="El scheduler está publicando este post. Esperando a que termine...")
+        while not reservar_post(job['post_id']):
+            time.sleep(1)
+
+    try:
+        post = get_post_by_id(job['post_id'])
+        if not post:
+            update_publish_job(job_id, status='failed', error="La publicación ya no existe.")
+            return False
+
+        if post.get('fecha_hora') and post.get('sent_at') and post['sent_at'] >= job['created_at']:
+            update_publish_job(job_id, status='done', progress="El scheduler ya publicó este post.")
+            return True
+
+        def progress(mensaje: str):
+            update_publish_job(job_id, progress=mensaje)
+
+        if publicar_post(post, progress=progress):
+            if post.get('fecha_hora') and not post.get('sent_at'):
+                update_post(post['id'], sent_at=datetime.now().isoformat())
+            PublishLedger(post['id']).clear()
+            update_publish_job(job_id, status='done')
+            return True
+
+        update_publish_job(job_id, status='failed', error="La publicación no se pudo completar. Revisa el log del scheduler.")
+        return False
+    finally:
+        liberar_post(job['post_id'])
@@ -0,0 +1,260 @@
+"""
+Limitador de peticiones (token bucket) compartido por todos los adaptadores de plataformas.
+
+El estado de cada bucket se guarda en la base de datos (tabla `rate_limit_state`),
+de modo que el botón "Publicar ahora" de la UI y el scheduler consumen el mismo
+presupuesto. Cada plataforma se configura con variables de entorno:
+
+    RATE_LIMIT_<PLATAFORMA>_RPS     Peticiones por segundo sostenidas (0 desactiva el límite)
+    RATE_LIMIT_<PLATAFORMA>_BURST   Tamaño máximo de ráfaga
+    RATE_LIMIT_<PLATAFORMA>_DAILY   Máximo de peticiones por día y cuenta (0 = sin límite)
+
+Además, RATE_LIMIT_ENABLED=false desactiva el limitador y RATE_LIMIT_MAX_WAIT fija
+cuántos segundos como máximo se espera por un token antes de abandonar.
+"""
+
+import os
+import time
+import asyncio
+import hashlib
+import logging
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Optional
+
+from sqlalchemy.exc import IntegrityError, OperationalError
+
+from src.db_config import get_db_session, RateLimitState
+
+logger = logging.getLogger(__name__)
+
+# Valores por defecto por plataforma: (peticiones/segundo, ráfaga, máximo diario)
+DEFAULT_LIMITS = {
+    "linkedin": (0.5, 5, 0),
+    # PUT a las URLs de subida prefirmadas de LinkedIn (imágenes y partes de vídeo)
+    "linkedin_upload": (10.0, 20, 0),
+    "wordpress": (2.0, 10, 0),
+    "graph": (2.0, 10, 0),
+    "smtp": (1.0, 5, 0),
+    "instagram": (0.1, 2, 50),
+    "whatsapp": (20.0, 50, 0),
+}
+
+# Reintentos dentro de una misma llamada tras recibir un 429 con Retry-After
+MAX_THROTTLE_RETRIES = 2
+
+
+class RateLimitExceeded(RuntimeError):
+    """Se lanza cuando no se puede obtener un token en un tiempo razonable o se agotó el cupo diario."""
+
+
+def _env_float(name: str, default: float) -> float:
+    value = os.getenv(name)
+    if value is None or value.strip() == "":
+        return default
+    try:
+        return float(value)
+    except ValueError:
+        logger.warning(f"Valor no numérico en {name}='{value}'. Se usará {default}.")
+        return default
+
+
+def get_limits(platform: str) -> Optional[tuple]:
+    """
+    Devuelve la configuración (rps, burst, daily) de una plataforma.
+
+    Returns:
+        tuple | None: None si el limitador está desactivado para esa plataforma.
+    """
+    if os.getenv("RATE_LIMIT_ENABLED", "true").lower() != "true":
+        return None
+
+    key = platform.upper()
+    default_rps, default_burst, default_daily = DEFAULT_LIMITS.get(platform, (1.0, 5, 0))
+    rps = _env_float(f"RATE_LIMIT_{key}_RPS", default_rps)
+    burst = max(1.0, _env_float(f"RATE_LIMIT_{key}_BURST", default_burst))
+    daily = int(_env_float(f"RATE_LIMIT_{key}_DAILY", default_daily))
+
+    if rps <= 0:
+        return None
+    return rps, burst, daily
+
+
+def account_key(secret: str) -> str:
+    """Genera un identificador de cuenta estable sin guardar el secreto (ej. un token) en la BD."""
+    return hashlib.sha256(secret.encode("utf-8")).hexdigest()[:16]
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """
+    Interpreta una cabecera Retry-After, ya sea en segundos o como fecha HTTP.
+
+    Returns:
+        float | None: Segundos a esperar, o None si la cabecera no es válida.
+    """
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+        if retry_at.tzinfo is None:
+            retry_at = retry_at.replace(tzinfo=timezone.utc)
+        return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+
+def _lock_row(session, platform: str, account: str) -> Optional[RateLimitState]:
+    """
+    Obtiene la fila del bucket con el bloqueo de escritura de SQLite ya tomado.
+
+    Un UPDATE sin cambios fuerza el bloqueo antes de leer, de modo que dos procesos
+    (UI y scheduler) no pueden consumir el mismo token a la vez.
+    """
+    session.query(RateLimitState).filter_by(platform=platform, account=account).update(
+        {RateLimitState.platform: RateLimitState.platform}, synchronize_session=False
+    )
+    return session.query(RateLimitState).filter_by(platform=platform, account=account).first()
+
+
+def try_acquire(platform: str, account: str = "default") -> float:
+    """
+    Intenta consumir un token del bucket sin bloquear.
+
+    Returns:
+        float: 0 si se consumió un token; si no, los segundos que hay que esperar.
+
+    Raises:
+        RateLimitExceeded: Si se ha alcanzado el máximo diario de la cuenta.
+    """
+    limits = get_limits(platform)
+    if limits is None:
+        return 0.0
+    rps, burst, daily = limits
+
+    now = time.time()
+    today = datetime.now().strftime("%Y-%m-%d")
+
+    for _ in range(3):
+        try:
+            with get_db_session() as session:
+                state = _lock_row(session, platform, account)
+                if state is None:
+                    state = RateLimitState(platform=platform, account=account, tokens=burst,
+                                           updated_at=now, day=today, day_count=0)
+                    session.add(state)
+
+                # Recargar el bucket según el tiempo transcurrido
+                elapsed = max(0.0, now - state.updated_at)
+                state.tokens = min(burst, state.tokens + elapsed * rps)
+                state.updated_at = now
+
+                if state.day != today:
+                    state.day = today
+                    state.day_count = 0
+
+                if state.blocked_until and state.blocked_until > now:
+                    return state.blocked_until - now
+
+                if daily and state.day_count >= daily:
+                    raise RateLimitExceeded(
+                        f"Cupo diario de {daily} peticiones agotado para {platform} ({account})."
+                    )
+
+                if state.tokens < 1.0:
+                    return (1.0 - state.tokens) / rps
+
+                state.tokens -= 1.0
+                state.day_count += 1
+                return 0.0
+        except IntegrityError:
+            # Otro proceso creó la fila a la vez; se reintenta leyéndola
+            continue
+        except OperationalError:
+            # La BD está bloqueada por otra escritura (subidas en paralelo); se reintenta
+            time.sleep(0.1)
+            continue
+
+    return 1.0 / rps
+
+
+def acquire(platform: str, account: str = "default") -> None:
+    """
+    Bloquea hasta obtener un token para la plataforma y cuenta indicadas.
+
+    Raises:
+        RateLimitExceeded: Si la espera supera RATE_LIMIT_MAX_WAIT o se agotó el cupo diario.
+    """
+    max_wait = _env_float("RATE_LIMIT_MAX_WAIT", 300.0)
+    deadline = time.monotonic() + max_wait
+
+    while True:
+        wait = try_acquire(platform, account)
+        if wait <= 0:
+            return
+        if time.monotonic() + wait > deadline:
+            raise RateLimitExceeded(
+                f"No hay cupo de peticiones para {platform} ({account}) en los próximos {max_wait:.0f}s."
+            )
+        logger.info(f"Límite de peticiones alcanzado para {platform}. Esperando {wait:.1f}s...")
+        time.sleep(wait)
+
+
+async def acquire_async(platform: str, account: str = "default") -> None:
+    """
+    Versión asíncrona de `acquire`: espera con asyncio.sleep, sin bloquear el event loop.
+    La consulta del bucket en la BD se hace en un hilo aparte.
+
+    Raises:
+        RateLimitExceeded: Si la espera supera RATE_LIMIT_MAX_WAIT o se agotó el cupo diario.
+    """
+    max_wait = _env_float("RATE_LIMIT_MAX_WAIT", 300.0)
+    deadline = time.monotonic() + max_wait
+
+    while True:
+        wait = await asyncio.to_thread(try_acquire, platform, account)
+        if wait <= 0:
+            return
+        if time.monotonic() + wait > deadline:
+            raise RateLimitExceeded(
+                f"No hay cupo de peticiones para {platform} ({account}) en los próximos {max_wait:.0f}s."
+            )
+        logger.info(f"Límite de peticiones alcanzado para {platform}. Esperando {wait:.1f}s...")
+        await asyncio.sleep(wait)
+
+
+def register_retry_after(platform: str, account: str, seconds: float) -> None:
+    """
+    Bloquea el bucket durante los segundos indicados (normalmente, el Retry-After de un 429).
+    """
+    until = time.time() + max(0.0, seconds)
+    with get_db_session() as session:
+        state = _lock_row(session, platform, account)
+        if state is None:
+            limits = get_limits(platform)
+            burst = limits[1] if limits else 1.0
+            state = RateLimitState(platform=platform, account=account, tokens=burst,
+                                   updated_at=time.time(), day=datetime.now().strftime("%Y-%m-%d"), day_count=0)
+            session.add(state)
+        state.blocked_until = max(state.blocked_until or 0.0, until)
+    logger.warning(f"{platform} pidió esperar {seconds:.0f}s antes de la siguiente petición.")
+
+
+def check_response(platform: str, account: str, response, default_wait: float = 60.0) -> Optional[float]:
+    """
+    Revisa una respuesta HTTP y, si es un 429 (o un 503 con Retry-After),
+    registra la espera en el bucket compartido.
+
+    Returns:
+        float | None: Segundos de espera registrados, o None si la respuesta no es de throttling.
+    """
+    retry_after = parse_retry_after(response.headers.get("Retry-After"))
+    if response.status_code == 429 or (response.status_code == 503 and retry_after is not None):
+        wait = retry_after if retry_after is not None else default_wait
+        register_retry_after(platform, account, wait)
+        return wait
+    return None
@@ -5,13 +5,12 @@ import pandas as pd
 from datetime import datetime
 from streamlit_tags import st_tags
 
+from streamlit_autorefresh import st_autorefresh
+
 from .db_config import get_post_by_id, update_post, delete_post, get_all_media_assets, link_media_to_post, get_programmed_posts, get_unprogrammed_posts
+from .db_config import enqueue_publish_job, get_latest_publish_jobs, get_email_outbox_summary, retry_failed_email_chunks
 from src.db_config import get_all_contacts, get_all_contact_lists
 from . import models
-from .instagram import post_image_ig, post_carousel_ig, post_video_ig
-from .wordpress import create_post_wordpress, upload_media
-from .linkedin import LinkedInClient
-from .gmail import send_mail
 from .utils import validar_contacto, handle_add_selection, get_logo_path
 
 
@@ -403,6 +402,14 @@ def display_posts(posts, date_range, sort_by, post_type, usar_filtro_fecha=False
 
     # Mostrar publicaciones usando cards
     if filtered_posts:
+        # Estado de los trabajos de "Publicar ahora"; se refresca la página mientras haya alguno en curso
+        publish_jobs = get_latest_publish_jobs([p['id'] for p in filtered_posts])
+        # Entrega de los correos por destinatario (outbox)
+        email_outbox = get_email_outbox_summary([p['id'] for p in filtered_posts if p['platform'].lower().startswith("gmail")])
+        if any(job['status'] in ('queued', 'running') for job in publish_jobs.values()) or \
+                any(summary['queued'] or summary['sending'] for summary in email_outbox.values()):
+            st_autorefresh(interval=3000, key=f"publish_jobs_refresh_{post_type}")
+
         for post_index, post in enumerate(filtered_posts):
             platform = post['platform']
 
@@ -559,118 +566,59 @@ def display_posts(posts, date_range, sort_by, post_type, usar_filtro_fecha=False
 
                 with col3:
                     if st.button("🚀Publicar ahora", key=f"publish_now_{post['id']}", width='stretch'):
-                        with st.spinner(f"Publicando en {post['platform']}..."):
-                            # Extraer los datos del post
-                            text = post.get('content', '')
-                            contacts = post.get('contacts', [])
-                            asunto = post.get('asunto', 'Sin asunto')
-                            title = post.get('title', 'Sin título')
-                            platform_lower = post.get('platform', '').lower()
-
-                            # Obtener las rutas de los medios adjuntos, igual que hace el publicador automático
-                            media_assets = post.get('media_assets', [])
-                            image_paths = [asset['file_path'] for asset in media_assets if
-                                           asset['file_type'] == 'image' and os.path.exists(asset['file_path'])]
-                            video_paths = [asset['file_path'] for asset in media_assets if
-                                           asset['file_type'] == 'video' and os.path.exists(asset['file_path'])]
-                            all_attachments = image_paths + video_paths
-
-                            if platform_lower.startswith("instagram"):
-                                if not all_attachments:
-                                    st.error('Se necesita al menos un vídeo o imagen para publicar en Instagram.')
-                                else:
-                                    try:
-                                        if video_paths:
-                                            post_video_ig(video_path=video_paths[0], caption=text)
-                                        elif len(image_paths) == 1:
-                                            post_image_ig(image_path=image_paths[0], caption=text)
-                                        else:
-                                            post_carousel_ig(image_paths=image_paths, caption=text)
-                                        st.success("¡Publicación subida a Instagram con éxito!")
-                                    except Exception as e:
-                                        st.error(f"Error al publicar en Instagram: {str(e)}")
-
-                            elif platform_lower.startswith("gmail"):
-                                try:
-                                    send_mail(
-                                        subject=asunto,
-                                        content_text=text,
-                                        content_html=post.get('content_html'),
-                                        receivers=contacts,
-                                        attachments=all_attachments
-                                    )
-                                    st.success("Correo enviado exitosamente.")
-                                except Exception as e:
-                                    st.error(f"Error al enviar el correo: {str(e)}")
-
-                            elif platform_lower.startswith("wordpress"):
-                                try:
-                                    st.info("Iniciando publicación en WordPress...")
-                                    embedded_media_html = []
-
-                                    # Recorrer todas las imágenes para incrustarlas
-                                    for asset_path in image_paths:
-                                        st.info(f"Subiendo imagen para incrustar: {os.path.basename(asset_path)}...")
-                                        wp_media_info = upload_media(asset_path)
-
-                                        if wp_media_info and 'url' in wp_media_info:
-                                            # Se añade la etiqueta HTML <img> para la imagen
-                                            embedded_media_html.append(
-                                                f'<p><img src="{wp_media_info["url"]}" alt="{title}"></p>')
-
-                                    # Bucle para los vídeos
-                                    for asset_path in video_paths:
-                                        st.info(f"Subiendo vídeo para incrustar: {os.path.basename(asset_path)}...")
-                                        wp_video_info = upload_media(asset_path)
-
-                                        if wp_video_info and 'url' in wp_video_info:
-                                            # Shortcode [video] de WordPress
-                                            embedded_media_html.append(f'<p>[video src="{wp_video_info["url"]}"]</p>')
-
-                                    # Construir contenido final y crear el post
-                                    final_content = text + "\n\n" + "\n".join(embedded_media_html)
-
-                                    st.info("Creando el post en WordPress...")
-
-                                    wp_post = create_post_wordpress(
-                                        title=title,
-                                        content=final_content,
-                                        status='publish'
-                                    )
-
-                                    if wp_post and 'id' in wp_post:
-                                        st.success(f"¡Publicación en WordPress creada con éxito! ID: {wp_post['id']}")
-                                        st.markdown(f"**Ver post:** [Enlace]({wp_post.get('link')})")
-                                    else:
-                                        st.error("Fallo al crear la publicación en WordPress.")
-                                except Exception as e:
-                                    st.error(f"Error al publicar en WordPress: {str(e)}")
-
-                            elif platform_lower.startswith("whatsapp"):
-                                st.error("Publicar directamente en WhatsApp no está soportado actualmente.")
-
-                            elif platform_lower.startswith("linkedin"):
-                                try:
-                                    st.info("Iniciando publicación en LinkedIn...")
-                                    linkedin_client = LinkedInClient()
-
-                                    # Se prioriza vídeo sobre imágenes
-                                    video_to_post = video_paths[0] if video_paths else None
-                                    images_to_post = image_paths if not video_to_post and image_paths else None
-
-                                    linkedin_client.post(
-                                        text=text,
-                                        video_path=video_to_post,
-                                        image_paths=images_to_post
-                                    )
-                                    st.success("¡Publicación en LinkedIn realizada con éxito!")
-                                except Exception as e:
-                                    st.error(f"Error al publicar en LinkedIn: {str(e)}")
+                        if platform.lower().startswith("whatsapp"):
+                            st.error("Publicar directamente en WhatsApp no está soportado actualmente.")
+                        else:
+                            # La publicación la realizan los workers del scheduler; la página no se bloquea
+                            enqueue_publish_job(post['id'])
+                            st.rerun()
+
+                    job = publish_jobs.get(post['id'])
+                    if job:
+                        display_publish_job_status(job)
+
+                    outbox = email_outbox.get(post['id'])
+                    if outbox:
+                        display_email_outbox_status(post['id'], outbox)
 
     else:
         st.warning("No hay publicaciones que coincidan con los filtros aplicados.")
 
 
+def display_publish_job_status(job):
+    """
+    Muestra el progreso del último trabajo de "Publicar ahora" de un post.
+    Los trabajos terminados solo se muestran durante unos minutos.
+    """
+    if job['status'] == 'queued':
+        st.info(f"⏳ {job.get('progress') or 'En cola'}")
+    elif job['status'] == 'running':
+        st.info(f"🔄 {job.get('progress') or 'Publicando...'}")
+    elif datetime.now() - datetime.fromisoformat(job['updated_at']) < pd.Timedelta(minutes=10):
+        if job['status'] == 'done':
+            st.success(f"✅ {job.get('progress') or 'Publicación completada'}")
+        elif job['status'] == 'failed':
+            st.error(f"❌ {job.get('error') or 'La publicación falló'}")
+
+
+def display_email_outbox_status(post_id, summary):
+    """
+    Muestra cuántos destinatarios del correo de un post se han entregado y permite
+    reintentar los que agotaron sus intentos.
+    """
+    total = summary['total']
+    st.progress(summary['sent'] / total if total else 0.0,
+                text=f"📧 {summary['sent']}/{total} destinatarios entregados")
+    pendientes = summary['queued'] + summary['sending']
+    if pendientes:
+        st.caption(f"{pendientes} destinatarios pendientes de envío o reintento.")
+    if summary['failed']:
+        st.warning(f"{summary['failed']} destinatarios no se pudieron entregar.")
+        if st.button("🔁 Reintentar fallidos", key=f"retry_outbox_{post_id}", width='stretch'):
+            retry_failed_email_chunks(post_id)
+            st.rerun()
+
+
 def create_image_carousel(images, platform):
     # Verificar si realmente hay imágenes para mostrar
     if not images:
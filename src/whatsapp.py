@@ -4,6 +4,8 @@ from dotenv import load_dotenv
 import logging
 import mimetypes
 
+from src import rate_limiter
+
 load_dotenv()
 
 # Configuración
@@ -13,6 +15,12 @@ PHONE_NUMBER_ID = os.getenv('WHATSAPP_BUSINESS_ID')
 if not TOKEN or not PHONE_NUMBER_ID:
     raise ValueError("Faltan credenciales de WhatsApp en el entorno (WHATSAPP_TOKEN, WHATSAPP_BUSINESS_ID)")
 
+# Códigos de error de la Cloud API que indican throttling
+THROTTLE_ERROR_CODES = {4, 80007, 130429, 131056}
+
+# Endpoint de la Cloud API usado por el envío asíncrono
+WHATSAPP_API_BASE = os.getenv("WHATSAPP_API_BASE", "https://graph.facebook.com/v18.0").rstrip("/")
+
 # Inicializar cliente de WhatsApp
 wa_client = WhatsApp(token=TOKEN, phone_number_id=PHONE_NUMBER_ID)
 
@@ -37,6 +45,20 @@ def _upload_media_and_get_url(local_path: str) -> str:
     return f"https://your-public-server.com/media/{os.path.basename(local_path)}"
 
 
+def _media_type(media_path: str = None):
+    """Devuelve ('image' | 'video' | None, URL pública) para el fichero multimedia."""
+    if not (media_path and os.path.exists(media_path)):
+        return None, None
+    mime_type, _ = mimetypes.guess_type(media_path)
+    if mime_type and mime_type.startswith('image/'):
+        media_type = 'image'
+    elif mime_type and mime_type.startswith('video/'):
+        media_type = 'video'
+    else:
+        return None, None
+    return media_type, _upload_media_and_get_url(media_path)
+
+
 def send_whatsapp(recipients: list, message: str, media_path: str = None):
     """
     Envía un mensaje de WhatsApp a una lista de destinatarios,
@@ -46,31 +68,79 @@ def send_whatsapp(recipients: list, message: str, media_path: str = None):
         logging.warning("No se proporcionaron destinatarios para WhatsApp.")
         return
 
-    media_type = None
-    media_url = None
-
-    if media_path and os.path.exists(media_path):
-        mime_type, _ = mimetypes.guess_type(media_path)
-        if mime_type:
-            if mime_type.startswith('image/'):
-                media_type = 'image'
-            elif mime_type.startswith('video/'):
-                media_type = 'video'
-
-        if media_type:
-            # Subir el fichero multimedia y obtener la URL pública
-            media_url = _upload_media_and_get_url(media_path)
+    # Subir el fichero multimedia (si lo hay) y obtener la URL pública
+    media_type, media_url = _media_type(media_path)
 
     for recipient in recipients:
         try:
+            rate_limiter.acquire("whatsapp", PHONE_NUMBER_ID)
             if media_type == 'image' and media_url:
-                wa_client.send_image(image=media_url, recipient_id=recipient, caption=message)
+                response = wa_client.send_image(image=media_url, recipient_id=recipient, caption=message)
                 logging.info(f"Imagen con mensaje enviada a {recipient}")
             elif media_type == 'video' and media_url:
-                wa_client.send_video(video=media_url, recipient_id=recipient, caption=message)
+                response = wa_client.send_video(video=media_url, recipient_id=recipient, caption=message)
                 logging.info(f"Vídeo con mensaje enviado a {recipient}")
             else:
-                wa_client.send_message(message=message, recipient_id=recipient)
+                response = wa_client.send_message(message=message, recipient_id=recipient)
                 logging.info(f"Mensaje de texto enviado a {recipient}")
+
+            error = response.get('error') if isinstance(response, dict) else None
+            if error and error.get('code') in THROTTLE_ERROR_CODES:
+                logging.warning(f"WhatsApp ha limitado los envíos (código {error.get('code')}).")
+                rate_limiter.register_retry_after("whatsapp", PHONE_NUMBER_ID, 60)
         except Exception as e:
             logging.error(f"Error al enviar WhatsApp a {recipient}: {e}")
+
+
+async def send_whatsapp_async(recipients: list, message: str, media_path: str = None, client=None) -> dict:
+    """
+    Versión asíncrona de `send_whatsapp` que llama directamente a la Cloud API,
+    con varios envíos en vuelo a la vez (ver src/async_http.py).
+
+    Returns:
+        dict: {destinatario: True si el mensaje se aceptó}.
+    """
+    from src import async_http
+
+    if not recipients:
+        logging.warning("No se proporcionaron destinatarios para WhatsApp.")
+        return {}
+
+    media_type, media_url = _media_type(media_path)
+    endpoint = f"{WHATSAPP_API_BASE}/{PHONE_NUMBER_ID}/messages"
+    headers = {"Authorization": f"Bearer {TOKEN}", "Content-Type": "application/json"}
+
+    def _payload(recipient: str) -> dict:
+        payload = {"messaging_product": "whatsapp", "recipient_type": "individual", "to": recipient}
+        if media_type and media_url:
+            payload["type"] = media_type
+            payload[media_type] = {"link": media_url, "caption": message}
+        else:
+            payload["type"] = "text"
+            payload["text"] = {"preview_url": True, "body": message}
+        return payload
+
+    async def _send(http, recipient: str) -> bool:
+        try:
+            response = await async_http.request(http, "whatsapp", PHONE_NUMBER_ID, "POST", endpoint,
+                                                headers=headers, json=_payload(recipient))
+            data = response.json() if response.content else {}
+            error = data.get('error') if isinstance(data, dict) else None
+            if error:
+                if error.get('code') in THROTTLE_ERROR_CODES:
+                    logging.warning(f"WhatsApp ha limitado los envíos (código {error.get('code')}).")
+                    rate_limiter.register_retry_after("whatsapp", PHONE_NUMBER_ID, 60)
+                logging.error(f"Error al enviar WhatsApp a {recipient}: {error.get('message')}")
+                return False
+            logging.info(f"Mensaje enviado a {recipient}")
+            return True
+        except Exception as e:
+            logging.error(f"Error al enviar WhatsApp a {recipient}: {e}")
+            return False
+
+    if client is not None:
+        results = await async_http.gather_limited([lambda r=r: _send(client, r) for r in recipients])
+    else:
+        async with async_http.build_client("whatsapp") as http:
+            results = await async_http.gather_limited([lambda r=r: _send(http, r) for r in recipients])
+    return dict(zip(recipients, results))
@@ -1,12 +1,20 @@
 from __future__ import annotations
+import asyncio
 import base64
 import os
-from typing import Iterable
+from typing import Callable, Iterable
 import requests
 from dotenv import load_dotenv
+from sqlalchemy.exc import OperationalError, SQLAlchemyError
 import mimetypes
 import logging
 import json
+import time
+
+from src import http_client, rate_limiter
+from src.db_config import (get_wordpress_media, save_wordpress_media, mark_wordpress_media_verified,
+                           delete_wordpress_media)
+from src.file_hash import file_sha256
 
 # Logger
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -26,6 +34,63 @@ else:
     API_BASE = f"{WP_SITE}/wp-json/wp/v2"
 
 
+# Reutilización de medios ya subidos (por hash del contenido) y cada cuántas horas se comprueba que siguen en el sitio
+MEDIA_DEDUP = os.getenv("WP_MEDIA_DEDUP", "true").lower() == "true"
+MEDIA_VERIFY_HOURS = float(os.getenv("WP_MEDIA_VERIFY_HOURS", "24"))
+# Intentos de cada escritura en la caché de medios si SQLite está bloqueado por otra escritura
+CACHE_WRITE_ATTEMPTS = 3
+
+# Tamaño de los bloques leídos del disco en las subidas asíncronas
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+# Función de progreso de las subidas: recibe (bytes enviados, bytes totales)
+UploadProgress = Callable[[int, int], None]
+
+
+class _ProgressFile:
+    """
+    Envuelve un fichero abierto para subirlo en streaming: requests lo lee por bloques
+    en lugar de cargarlo entero en memoria, y cada bloque leído se notifica al callback.
+    """
+
+    def __init__(self, f, progress: UploadProgress | None = None):
+        self._f = f
+        self._total = os.fstat(f.fileno()).st_size
+        self._sent = 0
+        self._progress = progress
+
+    def __len__(self) -> int:
+        # requests usa la longitud para enviar Content-Length (WordPress no acepta bien cuerpos chunked)
+        return self._total
+
+    def read(self, size: int = -1) -> bytes:
+        chunk = self._f.read(size)
+        if chunk and self._progress:
+            self._sent += len(chunk)
+            self._progress(self._sent, self._total)
+        return chunk
+
+    def seek(self, offset: int, whence: int = 0) -> int:
+        # Permite reenviar el cuerpo tras un 429
+        self._sent = offset if whence == 0 else self._sent
+        return self._f.seek(offset, whence)
+
+
+async def _iter_file_async(file_path: str, progress: UploadProgress | None = None):
+    """Lee el fichero por bloques en un hilo aparte y los va entregando al cliente httpx."""
+    total = os.path.getsize(file_path)
+    sent = 0
+    with open(file_path, 'rb') as f:
+        while True:
+            chunk = await asyncio.to_thread(f.read, UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            sent += len(chunk)
+            if progress:
+                progress(sent, total)
+            yield chunk
+
+
 def _check_config():
     """Verifica si la configuración de WordPress está completa."""
     if not all((WP_SITE, WP_USER, WP_APP_PASS)):
@@ -39,6 +104,27 @@ def _auth_header() -> dict[str, str]:
     return {"Authorization": f"Basic {token}"}
 
 
+def _parse_json(response_text: str) -> dict | None:
+    """Interpreta el JSON de una respuesta, ignorando los avisos de PHP que lo preceden."""
+    if not response_text:
+        return None
+
+    json_start_index = response_text.find('{')
+
+    if json_start_index == -1:
+        logger.error(f"La respuesta de WordPress no contiene un objeto JSON. Respuesta: {response_text}")
+        raise json.JSONDecodeError("No JSON object could be decoded", response_text, 0)
+
+    if json_start_index > 0:
+        warning_text = response_text[:json_start_index].strip()
+        logger.warning(f"Respuesta de WordPress contenía texto no-JSON. Se ignorará. Texto: '{warning_text}'")
+        json_text = response_text[json_start_index:]
+    else:
+        json_text = response_text
+
+    return json.loads(json_text)
+
+
 def _request(method: str, endpoint: str, **kwargs) -> dict | None:
     """
     Función centralizada para realizar peticiones a la API de WordPress.
@@ -50,27 +136,17 @@ def _request(method: str, endpoint: str, **kwargs) -> dict | None:
 
     logger.info(f"Realizando petición a WordPress: {method} {url}")
     try:
-        r = requests.request(method, url, headers=headers, timeout=120, **kwargs)
+        for attempt in range(rate_limiter.MAX_THROTTLE_RETRIES + 1):
+            rate_limiter.acquire("wordpress", WP_SITE)
+            data = kwargs.get("data")
+            if attempt and hasattr(data, "seek"):
+                data.seek(0)
+            r = http_client.get_session("wordpress").request(method, url, headers=headers, **kwargs)
+            if rate_limiter.check_response("wordpress", WP_SITE, r) is None:
+                break
+            logger.warning(f"WordPress respondió {r.status_code} (throttling). Intento {attempt + 1}.")
         r.raise_for_status()
-
-        if not r.text:
-            return None
-
-        response_text = r.text
-        json_start_index = response_text.find('{')
-
-        if json_start_index == -1:
-            logger.error(f"La respuesta de WordPress no contiene un objeto JSON. Respuesta: {response_text}")
-            raise json.JSONDecodeError("No JSON object could be decoded", response_text, 0)
-
-        if json_start_index > 0:
-            warning_text = response_text[:json_start_index].strip()
-            logger.warning(f"Respuesta de WordPress contenía texto no-JSON. Se ignorará. Texto: '{warning_text}'")
-            json_text = response_text[json_start_index:]
-        else:
-            json_text = response_text
-
-        return json.loads(json_text)
+        return _parse_json(r.text)
 
     except json.JSONDecodeError as e:
         logger.error(f"Error de JSON: WordPress no devolvió un JSON válido. Status: {r.status_code}. Respuesta: {r.text}")
@@ -83,10 +159,94 @@ def _request(method: str, endpoint: str, **kwargs) -> dict | None:
         raise RuntimeError(f"Error de conexión a WordPress: {e}") from e
 
 
-def upload_media(file_path: str) -> dict | None:
+def upload_media(file_path: str, progress: UploadProgress | None = None) -> dict | None:
     """
     Sube un archivo de media a WordPress y devuelve un diccionario con su ID y URL.
+    El fichero se envía en streaming desde el disco, sin cargarlo en memoria.
+
+    Args:
+        file_path: Ruta del fichero.
+        progress: Función opcional que recibe (bytes enviados, bytes totales).
+    """
+    headers = _media_headers(file_path)
+    content_hash, reused = _reuse_media(file_path, progress)
+    if reused:
+        return reused
+
+    with open(file_path, 'rb') as f:
+        response_json = _request("POST", "media", data=_ProgressFile(f, progress), headers=headers)
+    return _remember_media(content_hash, _media_info(response_json))
+
+
+def _media_exists(media_id: int) -> bool:
+    """Comprueba que un medio sigue existiendo en la biblioteca de WordPress."""
+    rate_limiter.acquire("wordpress", WP_SITE)
+    r = http_client.get_session("wordpress").get(f"{API_BASE}/media/{media_id}", headers=_auth_header(),
+                                                 params={"_fields": "id,source_url"})
+    if r.status_code in (404, 410):
+        return False
+    r.raise_for_status()
+    return True
+
+
+def _reuse_media(file_path: str, progress: UploadProgress | None = None) -> tuple[str | None, dict | None]:
+    """
+    Busca el fichero en la caché de medios ya subidos al sitio (por hash del contenido).
+    Si el medio no se ha comprobado en las últimas WP_MEDIA_VERIFY_HOURS, verifica que sigue existiendo.
+
+    Returns:
+        tuple: (hash del contenido, información del medio a reutilizar o None).
+    """
+    if not MEDIA_DEDUP:
+        return None, None
+
+    content_hash = file_sha256(file_path)
+    cached = get_wordpress_media(WP_SITE, content_hash)
+    if not cached:
+        return content_hash, None
+
+    if time.time() - cached['verified_at'] > MEDIA_VERIFY_HOURS * 3600:
+        if not _media_exists(cached['media_id']):
+            logger.info(f"El medio {cached['media_id']} ya no existe en WordPress. Se volverá a subir {file_path}.")
+            _write_cache(delete_wordpress_media, content_hash)
+            return content_hash, None
+        _write_cache(mark_wordpress_media_verified, content_hash)
+
+    logger.info(f"Reutilizando medio ya subido a WordPress para {file_path}. ID: {cached['media_id']}")
+    if progress:
+        size = os.path.getsize(file_path)
+        progress(size, size)
+    return content_hash, {'id': cached['media_id'], 'url': cached['source_url']}
+
+
+def _remember_media(content_hash: str | None, media_info: dict | None) -> dict | None:
+    """Guarda en la caché el medio recién subido."""
+    if content_hash and media_info:
+        _write_cache(save_wordpress_media, content_hash, media_info['id'], media_info.get('url'))
+    return media_info
+
+
+def _write_cache(func: Callable, content_hash: str, *args) -> None:
+    """
+    Escribe en la caché de medios del sitio. Las subidas van en paralelo, así que SQLite puede
+    estar bloqueado por otra escritura: se reintenta y, si aun así falla, solo se pierde la
+    entrada de caché; la subida no se da por fallida.
     """
+    for attempt in range(1, CACHE_WRITE_ATTEMPTS + 1):
+        try:
+            func(WP_SITE, content_hash, *args)
+            return
+        except OperationalError as e:
+            error = e
+            time.sleep(0.1 * attempt)
+        except SQLAlchemyError as e:
+            error = e
+            break
+    logger.warning(f"No se pudo actualizar la caché de medios de WordPress ({content_hash[:12]}): {error}")
+
+
+def _media_headers(file_path: str) -> dict[str, str]:
+    """Comprueba que el fichero existe y construye las cabeceras de la subida."""
     logger.info(f"Iniciando subida a WordPress para: {file_path}")
     if not os.path.exists(file_path):
         logger.error(f"Fichero no encontrado para subir a WordPress: {file_path}")
@@ -99,15 +259,14 @@ def upload_media(file_path: str) -> dict | None:
 
     file_name = os.path.basename(file_path)
 
-    with open(file_path, 'rb') as f:
-        file_data = f.read()
-
     headers = _auth_header()
     headers['Content-Disposition'] = f'attachment; filename="{file_name}"'
     headers['Content-Type'] = mime_type
+    return headers
 
-    response_json = _request("POST", "media", data=file_data, headers=headers)
 
+def _media_info(response_json: dict | None) -> dict | None:
+    """Extrae el ID y la URL del medio subido."""
     if response_json and 'id' in response_json:
         media_info = {
             'id': response_json['id'],
@@ -124,6 +283,16 @@ def create_post_wordpress(*, title: str, content: str, status: str = "publish",
     """
     Crea una nueva entrada en WordPress.
     """
+    payload = _post_payload(title, content, status, excerpt, categories, tags)
+    headers = _auth_header()
+    headers["Content-Type"] = "application/json"
+
+    response_data = _request("POST", "posts", json=payload, headers=headers)
+    return _check_post_response(response_data)
+
+
+def _post_payload(title: str, content: str, status: str, excerpt: str | None,
+                  categories: Iterable[int] | None, tags: Iterable[int] | None) -> dict:
     logger.info(f"Creando post en WordPress con título: '{title}' y estado: '{status}'")
     payload = {
         "title": title,
@@ -133,15 +302,59 @@ def create_post_wordpress(*, title: str, content: str, status: str = "publish",
     if excerpt is not None: payload["excerpt"] = excerpt
     if categories: payload["categories"] = list(categories)
     if tags: payload["tags"] = list(tags)
+    return payload
 
-    headers = _auth_header()
-    headers["Content-Type"] = "application/json"
-
-    response_data = _request("POST", "posts", json=payload, headers=headers)
 
+def _check_post_response(response_data: dict | None) -> dict:
     if response_data and response_data.get('id'):
         logger.info(f"Post creado con éxito en WordPress. ID: {response_data.get('id')}")
     else:
         logger.error(f"No se pudo crear el post en WordPress. Respuesta: {response_data}")
 
     return response_data
+
+
+# --- Variantes asíncronas (ver src/async_http.py) ---
+async def _request_async(client, method: str, endpoint: str, **kwargs) -> dict | None:
+    """Equivalente asíncrono de `_request` sobre un httpx.AsyncClient."""
+    from src import async_http
+
+    _check_config()
+    url = f"{API_BASE}/{endpoint.lstrip('/')}"
+    headers = kwargs.pop('headers', _auth_header())
+
+    logger.info(f"Realizando petición asíncrona a WordPress: {method} {url}")
+    r = await async_http.request(client, "wordpress", WP_SITE, method, url, headers=headers, **kwargs)
+    if r.is_error:
+        logger.error(f"Error HTTP de WordPress ({r.status_code}) en {method} {url}: {r.text}")
+        raise RuntimeError(f"Error de WordPress ({r.status_code}): {r.text}")
+    try:
+        return _parse_json(r.text)
+    except json.JSONDecodeError as e:
+        logger.error(f"Error de JSON: WordPress no devolvió un JSON válido. Status: {r.status_code}. Respuesta: {r.text}")
+        raise RuntimeError(f"WordPress devolvió una respuesta no-JSON (Status: {r.status_code})") from e
+
+
+async def upload_media_async(client, file_path: str, progress: UploadProgress | None = None) -> dict | None:
+    """Versión asíncrona de `upload_media`, también en streaming (bloques de UPLOAD_CHUNK_SIZE)."""
+    headers = _media_headers(file_path)
+    headers['Content-Length'] = str(os.path.getsize(file_path))
+    content_hash, reused = await asyncio.to_thread(_reuse_media, file_path, progress)
+    if reused:
+        return reused
+
+    response_json = await _request_async(client, "POST", "media", headers=headers,
+                                         content_factory=lambda: _iter_file_async(file_path, progress))
+    return await asyncio.to_thread(_remember_media, content_hash, _media_info(response_json))
+
+
+async def create_post_wordpress_async(client, *, title: str, content: str, status: str = "publish",
+                                      excerpt: str | None = None, categories: Iterable[int] | None = None,
+                                      tags: Iterable[int] | None = None) -> dict:
+    """Versión asíncrona de `create_post_wordpress`."""
+    payload = _post_payload(title, content, status, excerpt, categories, tags)
+    headers = _auth_header()
+    headers["Content-Type"] = "application/json"
+
+    response_data = await _request_async(client, "POST", "posts", json=payload, headers=headers)
+    return _check_post_response(response_data)